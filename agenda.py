@@ -0,0 +1,111 @@
+from bisect import bisect_left
+from datetime import timedelta
+from sqlalchemy import select, union_all, or_, func
+from models import db, Agendamento, ExcecaoAgendamento
+from recorrencia import RegraRecorrencia, expandir_series
+
+# Consultas de intervalo da agenda (conflitos e disponibilidade). Cada busca no banco é feita em dois ramos com
+# limite dos dois lados - eventos que começam na janela e eventos que começaram antes e terminam depois do início -
+# para que os índices (dimensão, data_inicio) e (dimensão, data_fim) sejam usados e o histórico antigo nunca seja lido.
+
+# Eventos sem fim ocupam este tempo para fins de conflito e disponibilidade
+DURACAO_PADRAO = timedelta(hours=1)
+# Séries sem fim são verificadas contra conflitos só neste horizonte a partir do início
+HORIZONTE_CONFLITOS = timedelta(days=365)
+COLUNAS = (Agendamento.id, Agendamento.titulo, Agendamento.data_inicio, Agendamento.data_fim,
+           Agendamento.usuario_id, Agendamento.cliente_id, Agendamento.empreendimento_id)
+
+
+def fim_efetivo(evento):
+    return evento['data_fim'] or evento['data_inicio'] + DURACAO_PADRAO
+
+
+def buscar_excecoes_na_janela(series, inicio, fim):
+    # Exceções cuja ocorrência original cai na janela (para suprimi-la) ou cujo novo horário cai nela (para exibi-la)
+    query = select(ExcecaoAgendamento).filter(ExcecaoAgendamento.agendamento_id.in_([serie.id for serie in series]))
+    if inicio and fim:
+        maior_duracao = max((serie.data_fim - serie.data_inicio for serie in series if serie.data_fim), default=timedelta(0))
+        query = query.filter(or_(
+            (ExcecaoAgendamento.data_original >= inicio - maior_duracao) & (ExcecaoAgendamento.data_original < fim),
+            (ExcecaoAgendamento.data_inicio < fim) & (func.coalesce(ExcecaoAgendamento.data_fim, ExcecaoAgendamento.data_inicio) >= inicio),
+        ))
+    return db.session.execute(query).scalars().all()
+
+
+def eventos_na_janela(filtros, inicio, fim, ignorar_id=None):
+    # filtros: [(coluna, valores)] combinados com OU. Devolve eventos e ocorrências de séries que ocupam
+    # algum instante de [inicio, fim), como dicts ordenados por data_inicio.
+    consultas = []
+    for coluna, valores in filtros:
+        base = select(*COLUNAS).where(coluna.in_(valores), Agendamento.regra_recorrencia.is_(None))
+        consultas.append(base.where(Agendamento.data_inicio >= inicio - DURACAO_PADRAO, Agendamento.data_inicio < fim))
+        consultas.append(base.where(Agendamento.data_fim > inicio, Agendamento.data_inicio < fim))
+    eventos = {(linha.id, None): dict(linha._mapping, ocorrencia=None) for linha in db.session.execute(union_all(*consultas))}
+    series = db.session.execute(
+        select(*COLUNAS, Agendamento.regra_recorrencia).where(
+            Agendamento.regra_recorrencia.is_not(None), or_(*(coluna.in_(valores) for coluna, valores in filtros)),
+            Agendamento.data_inicio < fim, or_(Agendamento.recorrencia_ate.is_(None), Agendamento.recorrencia_ate > inicio - DURACAO_PADRAO))
+    ).all()
+    if series:
+        por_id = {serie.id: serie for serie in series}
+        janela_inicio = inicio - DURACAO_PADRAO
+        for ocorrencia in expandir_series(series, buscar_excecoes_na_janela(series, janela_inicio, fim), janela_inicio, fim):
+            serie = por_id[ocorrencia['id']]
+            ocorrencia.update(usuario_id=serie.usuario_id, cliente_id=serie.cliente_id, empreendimento_id=serie.empreendimento_id)
+            eventos[(ocorrencia['id'], ocorrencia['ocorrencia'])] = ocorrencia
+    return sorted((evento for evento in eventos.values() if evento['id'] != ignorar_id and evento['data_inicio'] < fim and fim_efetivo(evento) > inicio),
+                  key=lambda evento: evento['data_inicio'])
+
+
+def intervalos_do_evento(dados):
+    # (início, fim) de cada ocorrência do evento sendo salvo; séries sem fim só até HORIZONTE_CONFLITOS
+    duracao = (dados['data_fim'] - dados['data_inicio']) if dados['data_fim'] else DURACAO_PADRAO
+    if not dados.get('regra_recorrencia'):
+        return [(dados['data_inicio'], dados['data_inicio'] + duracao)]
+    limite = dados['data_inicio'] + HORIZONTE_CONFLITOS
+    if dados.get('recorrencia_ate'):
+        limite = min(limite, dados['recorrencia_ate'])
+    regra = RegraRecorrencia.interpretar(dados['regra_recorrencia'])
+    return [(inicio, inicio + duracao) for inicio in regra.ocorrencias(dados['data_inicio'], janela_inicio=dados['data_inicio'], janela_fim=limite)]
+
+
+def encontrar_conflitos(dados, ignorar_id=None, limite=5):
+    # Eventos do mesmo corretor, do mesmo cliente ou do mesmo empreendimento que se sobrepõem a alguma ocorrência
+    intervalos = intervalos_do_evento(dados)
+    if not intervalos:
+        return []
+    filtros = [(Agendamento.usuario_id, [dados['usuario_id']])]
+    if dados.get('cliente_id'):
+        filtros.append((Agendamento.cliente_id, [dados['cliente_id']]))
+    if dados.get('empreendimento_id'):
+        filtros.append((Agendamento.empreendimento_id, [dados['empreendimento_id']]))
+    existentes = eventos_na_janela(filtros, intervalos[0][0], max(fim for _, fim in intervalos), ignorar_id)
+    # Índice de intervalos: inícios ordenados + maior duração; cada ocorrência só examina os candidatos via bisect
+    inicios = [evento['data_inicio'] for evento in existentes]
+    maior_duracao = max((fim_efetivo(evento) - evento['data_inicio'] for evento in existentes), default=timedelta(0))
+    conflitos = []
+    for inicio, fim in intervalos:
+        posicao = bisect_left(inicios, inicio - maior_duracao)
+        while posicao < len(existentes) and inicios[posicao] < fim:
+            evento = existentes[posicao]
+            if fim_efetivo(evento) > inicio:
+                motivos = [motivo for campo, motivo in (('usuario_id', 'mesmo corretor'), ('cliente_id', 'mesmo cliente'), ('empreendimento_id', 'mesmo empreendimento'))
+                           if dados.get(campo) and evento[campo] == dados[campo]]
+                conflitos.append(dict(evento, motivos=motivos))
+                if len(conflitos) >= limite:
+                    return conflitos
+            posicao += 1
+    return conflitos
+
+
+def disponibilidade(usuario_ids, inicio, fim):
+    # Períodos ocupados de cada usuário na janela, já unidos (eventos sobrepostos ou encostados viram um só)
+    ocupado = {usuario_id: [] for usuario_id in usuario_ids}
+    for evento in eventos_na_janela([(Agendamento.usuario_id, usuario_ids)], inicio, fim):
+        periodos = ocupado[evento['usuario_id']]
+        periodo = [max(evento['data_inicio'], inicio), min(fim_efetivo(evento), fim)]
+        if periodos and periodo[0] <= periodos[-1][1]:
+            periodos[-1][1] = max(periodos[-1][1], periodo[1])
+        else:
+            periodos.append(periodo)
+    return ocupado
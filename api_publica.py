@@ -0,0 +1,147 @@
+import json
+import gzip
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response, request, abort, url_for
+from sqlalchemy.orm import selectinload
+from models import db, Empreendimento
+from versoes_dados import obter_versao, ao_confirmar_versoes
+from coalescencia import coalescedor
+
+# Cache em memória da API pública de empreendimentos (/api/v1/empreendimentos). O catálogo público é montado uma
+# vez por versão de 'catalogo' (versoes_dados.py) e cada combinação de fields/página vira um corpo JSON pronto, já
+# comprimido com gzip, com ETag forte. Entre verificações da versão no banco (API_PUBLICA_INTERVALO_VERSAO) as
+# respostas saem sem nenhuma consulta; o worker que alterou o catálogo limpa o próprio cache logo após o commit.
+
+CAMPOS_DISPONIVEIS = ('id', 'nome', 'endereco', 'status', 'descricao', 'previsao_entrega', 'valor_a_partir_de',
+                      'valor_medio_unidades', 'quantidade_torres', 'andares', 'tipologias')
+CAMPOS_PADRAO = ('id', 'nome', 'endereco', 'status', 'descricao')
+MAXIMO_RESPOSTAS_EM_CACHE = 256
+
+
+class _Representacao:
+    def __init__(self, corpo, total, links):
+        self.corpo = corpo
+        self.corpo_gzip = gzip.compress(corpo, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha256(corpo).hexdigest()[:32]
+        self.total = total
+        self.links = links
+
+
+class CacheApiPublica:
+    def __init__(self, app=None):
+        self._trava = threading.Lock()
+        self._versao = None
+        self._verificado_em = None
+        self._catalogo = None
+        self._respostas = OrderedDict()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('API_PUBLICA_INTERVALO_VERSAO', 5)
+        app.config.setdefault('API_PUBLICA_MAX_AGE', 60)
+        app.config.setdefault('API_PUBLICA_POR_PAGINA', 100)
+        app.config.setdefault('API_PUBLICA_POR_PAGINA_MAXIMO', 500)
+        self.intervalo_versao = app.config['API_PUBLICA_INTERVALO_VERSAO']
+        self.max_age = app.config['API_PUBLICA_MAX_AGE']
+        self.por_pagina_padrao = app.config['API_PUBLICA_POR_PAGINA']
+        self.por_pagina_maximo = app.config['API_PUBLICA_POR_PAGINA_MAXIMO']
+        app.extensions['api_publica'] = self
+        ao_confirmar_versoes(self._apos_commit)
+
+    def _apos_commit(self, chaves):
+        if 'catalogo' in chaves:
+            self.invalidar()
+
+    def invalidar(self):
+        with self._trava:
+            self._verificado_em = None
+
+    def _versao_atual(self):
+        # Consulta a versão no banco no máximo uma vez por intervalo; se mudou, descarta o catálogo e as respostas
+        agora = time.monotonic()
+        if self._verificado_em is not None and agora - self._verificado_em < self.intervalo_versao:
+            return self._versao
+        versao, _ = obter_versao(db.session, 'catalogo')
+        with self._trava:
+            if versao != self._versao:
+                self._versao = versao
+                self._catalogo = None
+                self._respostas.clear()
+            self._verificado_em = agora
+        return versao
+
+    def _montar_catalogo(self):
+        empreendimentos = db.session.execute(db.select(Empreendimento).options(selectinload(Empreendimento.tipologias))
+                                             .filter_by(publico=True).order_by(Empreendimento.nome, Empreendimento.id)).scalars().all()
+        catalogo = []
+        for emp in empreendimentos:
+            dados = {campo: getattr(emp, campo) for campo in CAMPOS_DISPONIVEIS if campo != 'tipologias'}
+            dados['tipologias'] = [{'metragem': tipologia.metragem, 'suites': tipologia.suites, 'vagas': tipologia.vagas} for tipologia in emp.tipologias]
+            catalogo.append(dados)
+        return catalogo
+
+    def _ler_parametros(self):
+        campos = tuple(campo.strip() for campo in request.args.get('fields', '').split(',') if campo.strip()) or CAMPOS_PADRAO
+        if any(campo not in CAMPOS_DISPONIVEIS for campo in campos):
+            abort(400, description=f"Campos disponíveis: {', '.join(CAMPOS_DISPONIVEIS)}")
+        pagina = request.args.get('pagina', 1, type=int)
+        por_pagina = request.args.get('por_pagina', self.por_pagina_padrao, type=int)
+        if pagina < 1 or por_pagina < 1:
+            abort(400)
+        return campos, pagina, min(por_pagina, self.por_pagina_maximo)
+
+    def _representacao(self, versao, campos, pagina, por_pagina):
+        chave = (campos, pagina, por_pagina)
+        with self._trava:
+            if versao == self._versao and chave in self._respostas:
+                self._respostas.move_to_end(chave)
+                return self._respostas[chave]
+            catalogo = self._catalogo
+        if catalogo is None:
+            # Uma rajada de requisições logo após a mudança do catálogo monta o catálogo uma vez só
+            catalogo = coalescedor.executar(('api_publica', versao), self._montar_catalogo)
+        inicio = (pagina - 1) * por_pagina
+        itens = [{campo: item[campo] for campo in campos} for item in catalogo[inicio:inicio + por_pagina]]
+        corpo = json.dumps(itens, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        links = []
+        parametros = {'fields': ','.join(campos)} if campos != CAMPOS_PADRAO else {}
+        if inicio + por_pagina < len(catalogo):
+            links.append(f'<{url_for(request.endpoint, pagina=pagina + 1, por_pagina=por_pagina, **parametros)}>; rel="next"')
+        if pagina > 1:
+            links.append(f'<{url_for(request.endpoint, pagina=pagina - 1, por_pagina=por_pagina, **parametros)}>; rel="prev"')
+        representacao = _Representacao(corpo, len(catalogo), links)
+        with self._trava:
+            if versao == self._versao:
+                self._catalogo = catalogo
+                self._respostas[chave] = representacao
+                while len(self._respostas) > MAXIMO_RESPOSTAS_EM_CACHE:
+                    self._respostas.popitem(last=False)
+        return representacao
+
+    def resposta(self):
+        campos, pagina, por_pagina = self._ler_parametros()
+        representacao = self._representacao(self._versao_atual(), campos, pagina, por_pagina)
+        usar_gzip = request.accept_encodings['gzip'] > 0
+        # ETag forte por representação: a versão comprimida tem a sua, como recomenda a RFC 9110
+        etag = representacao.etag + ('-gz' if usar_gzip else '')
+        resposta = Response(mimetype='application/json')
+        resposta.set_etag(etag)
+        resposta.cache_control.public = True
+        resposta.cache_control.max_age = self.max_age
+        resposta.vary.add('Accept-Encoding')
+        resposta.headers['X-Total-Count'] = str(representacao.total)
+        if representacao.links:
+            resposta.headers['Link'] = ', '.join(representacao.links)
+        if request.if_none_match.contains(etag):
+            resposta.status_code = 304
+            return resposta
+        if usar_gzip:
+            resposta.set_data(representacao.corpo_gzip)
+            resposta.content_encoding = 'gzip'
+        else:
+            resposta.set_data(representacao.corpo)
+        return resposta
@@ -1,20 +1,49 @@
 import os
+import io
+import base64
+import csv
 import json
-import fitz
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, jsonify, Response
-from sqlalchemy import func
-import pandas as pd
-from datetime import datetime, date
-from models import db, Cliente, Empreendimento, Usuario, Material, PerfilUsuario, StatusCliente, TemperaturaLead, EstadoCivil, Agendamento, Atividade, TipoAtividade, ExemploIA, Tipologia
+import enum
+import hashlib
+import hmac
+from flask import Flask, render_template, request, redirect, url_for, session, g, flash, send_from_directory, jsonify, Response, abort, stream_with_context
+from sqlalchemy import func, tuple_, or_
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.orm import selectinload, joinedload
+from datetime import datetime, date, timedelta
+from models import db, Cliente, Empreendimento, Usuario, Material, PerfilUsuario, StatusCliente, TemperaturaLead, EstadoCivil, Agendamento, ExcecaoAgendamento, Atividade, TipoAtividade, ExemploIA, Tipologia, TarefaLeituraPDF, StatusTarefa, interesses_table, EstatisticaPainel
 from functools import wraps
-from werkzeug.utils import secure_filename
 from markupsafe import escape, Markup
 from dotenv import load_dotenv
 import google.generativeai as genai
 from flask_migrate import Migrate
+from importacao import importar_clientes_csv
+from leitura_pdf import FilaLeituraPDF
+from cache_ia import CacheRespostasIA, gerar_resposta_ia, gerar_resposta_ia_em_partes, invalidar_cache_ia
+from limitador_ia import LimitadorIA, IAOcupada
+from contador_consultas import orcamento_consultas
+from instrumentacao import Instrumentacao
+from api_publica import CacheApiPublica
+from limite_requisicoes import LimitadorRequisicoes, limitar
+from contexto_usuario import cache_usuarios, usuario_atual
+from edicao_parcial import aplicar_alteracoes, reconciliar_tipologias
+from operacoes_lote import reatribuir_clientes, descartar_clientes, restaurar_clientes, alterar_status_clientes, excluir_clientes
+from busca_clientes import subconsulta_busca, reindexar_todos
+from versoes_dados import obter_versao
+from recorrencia import RegraRecorrencia, expandir_series, DIAS_SEMANA
+from recomendacao import recomendar_empreendimentos
+from agenda import buscar_excecoes_na_janela, encontrar_conflitos, disponibilidade
+from estatisticas_painel import reconstruir_estatisticas, ESCOPO_GERAL
+from armazenamento import armazenar_arquivo, salvar_upload_como_material, anexar_arquivo_existente, liberar_material, deduplicar_materiais_existentes, limpar_arquivos_sem_referencia
 
 load_dotenv()
 app = Flask(__name__)
+# Quantos proxies reversos (nginx, roteador) ficam na frente do app: request.remote_addr passa a ser o IP real
+# do cliente, usado pelo limite de requisições sem login. 0 quando o gunicorn recebe as conexões diretamente.
+PROXIES_CONFIAVEIS = int(os.getenv('PROXIES_CONFIAVEIS', 1))
+if PROXIES_CONFIAVEIS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIAVEIS, x_proto=PROXIES_CONFIAVEIS, x_host=PROXIES_CONFIAVEIS)
 
 # --- CONFIGURAÇÕES ---
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///halley_crm.db')
@@ -23,6 +52,13 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(basedir, 'static/uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['CLIENTES_POR_PAGINA'] = int(os.getenv('CLIENTES_POR_PAGINA', 50))
+app.config['CLIENTES_POR_PAGINA_MAXIMO'] = 500
+app.config['ATIVIDADES_POR_PAGINA'] = int(os.getenv('ATIVIDADES_POR_PAGINA', 20))
+app.config['RECOMENDACAO_CANDIDATOS'] = int(os.getenv('RECOMENDACAO_CANDIDATOS', 8))
+app.config['PDF_WORKERS'] = int(os.getenv('PDF_WORKERS', 2))
+app.config['PDF_PROCESSOS'] = int(os.getenv('PDF_PROCESSOS', 2))
+app.config['ARQUIVOS_ORFAOS_HORAS'] = int(os.getenv('ARQUIVOS_ORFAOS_HORAS', 24))
 
 try:
     genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
@@ -32,6 +68,13 @@ except Exception as e:
 
 db.init_app(app)
 migrate = Migrate(app, db)
+fila_leitura_pdf = FilaLeituraPDF(app)
+cache_ia = CacheRespostasIA(app)
+limitador_ia = LimitadorIA(app)
+api_publica = CacheApiPublica(app)
+limitador_requisicoes = LimitadorRequisicoes(app)
+cache_usuarios.init_app(app)
+instrumentacao = Instrumentacao(app)
 
 @app.template_filter('nl2br')
 def nl2br_filter(s):
@@ -41,15 +84,20 @@ def nl2br_filter(s):
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'usuario_id' not in session:
-            flash('Por favor, faça login para acessar esta página.', 'warning')
+        if usuario_atual() is None:
+            if 'usuario_id' in session:
+                # Conta desativada ou removida depois do login: a sessão deixa de valer já na próxima requisição
+                session.clear()
+                flash('Sua conta está inativa. Fale com um administrador.', 'danger')
+            else:
+                flash('Por favor, faça login para acessar esta página.', 'warning')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
-def verificar_permissao_cliente(id_cliente):
-    cliente = db.get_or_404(Cliente, id_cliente)
-    if session.get('usuario_perfil') != 'Admin' and cliente.proprietario_id != session.get('usuario_id'):
+def verificar_permissao_cliente(id_cliente, opcoes=()):
+    cliente = db.get_or_404(Cliente, id_cliente, options=opcoes)
+    if not g.usuario.admin and cliente.proprietario_id != g.usuario.id:
         flash('Você não tem permissão para acessar este cliente.', 'danger')
         return None
     return cliente
@@ -74,6 +122,38 @@ def salvar_exemplo_ia(texto_original, form_data):
     db.session.commit()
     flash('Obrigado! A IA usará este exemplo para aprender e melhorar no futuro.', 'info')
 
+def anexar_arquivos_enviados(empreendimento_id):
+    for arquivo_ja_enviado in request.form.getlist('arquivos_ja_enviados'):
+        if '|' in arquivo_ja_enviado:
+            nome_original, nome_servidor = arquivo_ja_enviado.rsplit('|', 1)
+            anexar_arquivo_existente(nome_original, nome_servidor, empreendimento_id)
+    for file in request.files.getlist('arquivos'):
+        if file and file.filename != '':
+            salvar_upload_como_material(file, empreendimento_id, app.config['UPLOAD_FOLDER'])
+
+@app.cli.command('deduplicar-uploads')
+def deduplicar_uploads_command():
+    migrados, bytes_liberados = deduplicar_materiais_existentes(app.config['UPLOAD_FOLDER'])
+    print(f"{migrados} materiais migrados para o armazenamento por hash; {bytes_liberados / (1024 * 1024):.1f} MB de cópias removidas.")
+
+@app.cli.command('limpar-uploads')
+def limpar_uploads_command():
+    # Arquivos lidos pela IA em "Ler PDF" cujo formulário nunca foi salvo
+    removidos, bytes_liberados = limpar_arquivos_sem_referencia(app.config['UPLOAD_FOLDER'], app.config['ARQUIVOS_ORFAOS_HORAS'])
+    print(f"{removidos} arquivos sem referência removidos; {bytes_liberados / (1024 * 1024):.1f} MB liberados.")
+
+@app.cli.command('reindexar-busca')
+def reindexar_busca_command():
+    with db.engine.begin() as conexao:
+        total = reindexar_todos(conexao)
+    print(f"{total} clientes indexados para busca.")
+
+@app.cli.command('reconstruir-estatisticas')
+def reconstruir_estatisticas_command():
+    with db.engine.begin() as conexao:
+        total = reconstruir_estatisticas(conexao)
+    print(f"Estatísticas do dashboard recalculadas ({total} linhas).")
+
 # --- ROTAS DE AUTENTICAÇÃO ---
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -82,9 +162,9 @@ def login():
         senha = request.form.get('senha')
         usuario = db.session.execute(db.select(Usuario).filter_by(email=email)).scalar_one_or_none()
         if usuario and usuario.ativo and usuario.verificar_senha(senha):
+            # Só o id vai para o cookie: perfil, nome e ativo são lidos a cada requisição (contexto_usuario.py)
+            session.clear()
             session['usuario_id'] = usuario.id
-            session['usuario_nome'] = usuario.nome
-            session['usuario_perfil'] = usuario.perfil.value
             return redirect(url_for('dashboard'))
         else:
             flash('Email, senha ou permissão inválidos.', 'danger')
@@ -124,51 +204,122 @@ def logout():
 @app.route('/')
 @login_required
 def dashboard():
-    if session['usuario_perfil'] == 'Admin':
-        total_clientes = db.session.execute(db.select(func.count(Cliente.id)).filter_by(descartado=False)).scalar_one()
-    else:
-        total_clientes = db.session.execute(db.select(func.count(Cliente.id)).filter_by(proprietario_id=session['usuario_id'], descartado=False)).scalar_one()
-    total_empreendimentos = db.session.execute(db.select(func.count(Empreendimento.id))).scalar_one()
+    # Os contadores vêm da tabela materializada estatistica_painel (linha do usuário + linha geral) em vez de COUNT(*)
+    escopo = ESCOPO_GERAL if g.usuario.admin else g.usuario.id
+    linhas = {linha.proprietario_id: linha for linha in db.session.execute(db.select(EstatisticaPainel).filter(EstatisticaPainel.proprietario_id.in_([ESCOPO_GERAL, escopo]))).scalars()}
+    estatisticas = linhas.get(escopo) or EstatisticaPainel(**{coluna.name: 0 for coluna in EstatisticaPainel.__table__.columns})
+    total_clientes = estatisticas.clientes_ativos
+    total_empreendimentos = linhas[ESCOPO_GERAL].total_empreendimentos if ESCOPO_GERAL in linhas else 0
     query_clientes_recentes = db.select(Cliente).filter_by(descartado=False).order_by(Cliente.id.desc())
-    if session['usuario_perfil'] != 'Admin':
-        query_clientes_recentes = query_clientes_recentes.filter_by(proprietario_id=session['usuario_id'])
+    if not g.usuario.admin:
+        query_clientes_recentes = query_clientes_recentes.filter_by(proprietario_id=g.usuario.id)
     ultimos_clientes = db.session.execute(query_clientes_recentes.limit(5)).scalars().all()
     ultimos_empreendimentos = db.session.execute(db.select(Empreendimento).order_by(Empreendimento.id.desc()).limit(5)).scalars().all()
-    return render_template('dashboard.html', total_clientes=total_clientes, total_empreendimentos=total_empreendimentos, ultimos_clientes=ultimos_clientes, ultimos_empreendimentos=ultimos_empreendimentos)
+    return render_template('dashboard.html', total_clientes=total_clientes, total_empreendimentos=total_empreendimentos, estatisticas=estatisticas, status_options=StatusCliente, temperatura_options=TemperaturaLead, ultimos_clientes=ultimos_clientes, ultimos_empreendimentos=ultimos_empreendimentos)
 
 @app.route('/usuarios')
 @login_required
 def lista_usuarios():
-    if session.get('usuario_perfil') != 'Admin':
+    if not g.usuario.admin:
         flash('Você não tem permissão para acessar esta página.', 'danger')
         return redirect(url_for('dashboard'))
     usuarios = db.session.execute(db.select(Usuario).order_by(Usuario.nome)).scalars().all()
-    return render_template('usuarios.html', usuarios=usuarios)
+    return render_template('usuarios.html', usuarios=usuarios, perfil_options=PerfilUsuario)
+
+@app.route('/usuario/<int:id>/editar', methods=['POST'])
+@login_required
+def editar_usuario(id):
+    if not g.usuario.admin:
+        flash('Você não tem permissão para acessar esta página.', 'danger')
+        return redirect(url_for('dashboard'))
+    usuario = db.get_or_404(Usuario, id)
+    perfil = PerfilUsuario[request.form.get('perfil', usuario.perfil.name)]
+    ativo = request.form.get('ativo') == 'on'
+    if usuario.id == g.usuario.id and (perfil != PerfilUsuario.ADMIN or not ativo):
+        flash('Você não pode remover o próprio acesso de administrador.', 'danger')
+        return redirect(url_for('lista_usuarios'))
+    usuario.perfil = perfil
+    usuario.ativo = ativo
+    # O commit descarta o usuário do cache de contexto (contexto_usuario.py): a mudança vale na próxima requisição dele
+    db.session.commit()
+    flash(f'Usuário "{usuario.nome}" atualizado.', 'success')
+    return redirect(url_for('lista_usuarios'))
 
 # --- ROTAS DE CLIENTES ---
+def codificar_cursor(*valores):
+    return base64.urlsafe_b64encode(json.dumps(valores).encode('utf-8')).decode('ascii')
+
+def decodificar_cursor(cursor, *tipos):
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        abort(400)
+    if not isinstance(valores, list) or len(valores) != len(tipos) or not all(type(valor) is tipo for valor, tipo in zip(valores, tipos)):
+        abort(400)
+    return valores
+
+def paginar_clientes(termo_busca, status_busca, cursor=None, por_pagina=None):
+    # Sem termo de busca, paginação por chave (keyset) em (nome_completo, id): cada página é uma busca no índice
+    # a partir do último cliente da página anterior, então o custo não cresce com a profundidade da rolagem
+    por_pagina = min(por_pagina or app.config['CLIENTES_POR_PAGINA'], app.config['CLIENTES_POR_PAGINA_MAXIMO'])
+    query = db.select(Cliente).filter_by(descartado=False)
+    if not g.usuario.admin:
+        query = query.filter(Cliente.proprietario_id == g.usuario.id)
+    if status_busca:
+        if status_busca not in StatusCliente.__members__:
+            abort(400)
+        query = query.filter(Cliente.status == StatusCliente[status_busca])
+    busca = subconsulta_busca(termo_busca, db.engine.dialect.name) if termo_busca else None
+    if termo_busca and busca is None:
+        return [], None
+    if busca is not None:
+        # Com termo de busca a ordem é a relevância; o cursor guarda apenas a posição na lista ranqueada
+        posicao = max(decodificar_cursor(cursor, int)[0], 0) if cursor else 0
+        query = query.join(busca, busca.c.id == Cliente.id).order_by(busca.c.ordem, Cliente.id).offset(posicao)
+        clientes = db.session.execute(query.limit(por_pagina + 1)).scalars().all()
+        proximo_cursor = codificar_cursor(posicao + por_pagina) if len(clientes) > por_pagina else None
+        return clientes[:por_pagina], proximo_cursor
+    if cursor:
+        query = query.filter(tuple_(Cliente.nome_completo, Cliente.id) > tuple_(*decodificar_cursor(cursor, str, int)))
+    clientes = db.session.execute(query.order_by(Cliente.nome_completo, Cliente.id).limit(por_pagina + 1)).scalars().all()
+    proximo_cursor = codificar_cursor(clientes[por_pagina - 1].nome_completo, clientes[por_pagina - 1].id) if len(clientes) > por_pagina else None
+    return clientes[:por_pagina], proximo_cursor
+
 @app.route('/clientes')
 @login_required
 def lista_clientes():
     termo_busca = request.args.get('termo_busca', '')
     status_busca = request.args.get('status_busca', '')
-    query = db.select(Cliente).filter_by(descartado=False)
-    if session['usuario_perfil'] != 'Admin':
-        query = query.filter(Cliente.proprietario_id == session['usuario_id'])
-    if termo_busca:
-        query = query.filter(Cliente.nome_completo.ilike(f'%{termo_busca}%'))
-    if status_busca:
-        query = query.filter(Cliente.status == StatusCliente[status_busca])
-    lista_de_clientes = db.session.execute(query.order_by(Cliente.nome_completo)).scalars().all()
-    return render_template('index.html', clientes=lista_de_clientes, termo_busca=termo_busca, status_busca=status_busca, status_options=StatusCliente)
+    cursor = request.args.get('cursor')
+    lista_de_clientes, proximo_cursor = paginar_clientes(termo_busca, status_busca, cursor, request.args.get('por_pagina', type=int))
+    return render_template('index.html', clientes=lista_de_clientes, termo_busca=termo_busca, status_busca=status_busca, status_options=StatusCliente, temperatura_options=TemperaturaLead, cursor=cursor, proximo_cursor=proximo_cursor)
+
+@app.route('/api/clientes')
+@login_required
+def api_clientes():
+    lista_de_clientes, proximo_cursor = paginar_clientes(request.args.get('termo_busca', ''), request.args.get('status_busca', ''), request.args.get('cursor'), request.args.get('por_pagina', type=int))
+    clientes_json = [{'id': cliente.id, 'nome_completo': cliente.nome_completo, 'status': cliente.status.name if cliente.status else None, 'status_descricao': cliente.status.value if cliente.status else None, 'url': url_for('detalhes_cliente', id=cliente.id)} for cliente in lista_de_clientes]
+    return jsonify({'clientes': clientes_json, 'proximo_cursor': proximo_cursor})
 
 @app.route('/cliente/<int:id>')
 @login_required
+@orcamento_consultas(4)
 def detalhes_cliente(id):
-    cliente = verificar_permissao_cliente(id)
+    # Número fixo de consultas, independente do tamanho do histórico: cliente + interesses (selectin), uma página
+    # de atividades já com o autor (joinedload) e só id/nome dos demais empreendimentos para o select
+    cliente = verificar_permissao_cliente(id, opcoes=[selectinload(Cliente.empreendimentos_interesse)])
     if not cliente: return redirect(url_for('lista_clientes'))
-    ids_interesse = [emp.id for emp in cliente.empreendimentos_interesse]
-    empreendimentos_disponiveis = db.session.execute(db.select(Empreendimento).filter(Empreendimento.id.not_in(ids_interesse))).scalars().all()
-    return render_template('detalhes_cliente.html', cliente=cliente, empreendimentos_disponiveis=empreendimentos_disponiveis, tipos_atividade=TipoAtividade, Atividade=Atividade)
+    pagina = max(request.args.get('pagina_atividades', 1, type=int), 1)
+    por_pagina = app.config['ATIVIDADES_POR_PAGINA']
+    atividades = db.session.execute(
+        db.select(Atividade).options(joinedload(Atividade.usuario)).filter_by(cliente_id=id)
+        .order_by(Atividade.data_criacao.desc(), Atividade.id.desc()).offset((pagina - 1) * por_pagina).limit(por_pagina + 1)
+    ).scalars().all()
+    tem_proxima_pagina = len(atividades) > por_pagina
+    ids_interesse = db.select(interesses_table.c.empreendimento_id).filter(interesses_table.c.cliente_id == id)
+    empreendimentos_disponiveis = db.session.execute(db.select(Empreendimento.id, Empreendimento.nome).filter(Empreendimento.id.not_in(ids_interesse)).order_by(Empreendimento.nome)).all()
+    return render_template('detalhes_cliente.html', cliente=cliente, empreendimentos_disponiveis=empreendimentos_disponiveis, tipos_atividade=TipoAtividade,
+                           atividades=atividades[:por_pagina], pagina_atividades=pagina, tem_proxima_pagina=tem_proxima_pagina)
 
 @app.route('/cliente/adicionar', methods=['GET', 'POST'])
 @login_required
@@ -192,7 +343,7 @@ def adicionar_cliente():
         data_nasc_obj = datetime.strptime(request.form.get('data_nascimento'), '%Y-%m-%d').date() if request.form.get('data_nascimento') else None
         
         novo_cliente = Cliente(
-            proprietario_id=session['usuario_id'],
+            proprietario_id=g.usuario.id,
             nome_completo=request.form.get('nome_completo'), data_nascimento=data_nasc_obj, cpf=cpf, rg=request.form.get('rg'), 
             profissao=request.form.get('profissao'), email=email, email_comercial=email_comercial,
             ddd_pessoal=request.form.get('ddd_pessoal'), telefone_pessoal=request.form.get('telefone_pessoal'),
@@ -226,6 +377,17 @@ def adicionar_cliente():
     
     return render_template('cliente_form.html', estado_civil_options=EstadoCivil, status_options=StatusCliente, temperatura_options=TemperaturaLead)
 
+# Campos do formulário de cliente gravados como texto; os opcionais com valor único ou documento viram NULL quando vazios
+CAMPOS_TEXTO_CLIENTE = (
+    'nome_completo', 'profissao', 'ddd_pessoal', 'telefone_pessoal', 'ddd_pessoal_2', 'telefone_pessoal_2',
+    'ddd_residencial', 'telefone_residencial', 'ddd_comercial', 'telefone_comercial', 'cep_residencial',
+    'logradouro_residencial', 'numero_residencial', 'complemento_residencial', 'bairro_residencial', 'cidade_residencial',
+    'estado_residencial', 'empresa_cliente', 'endereco_comercial_cliente', 'nome_conjuge', 'profissao_conjuge',
+    'email_conjuge', 'email_conjuge_comercial', 'ddd_conjuge', 'telefone_conjuge', 'empresa_conjuge',
+    'endereco_comercial_conjuge', 'origem_lead', 'valor_imovel_buscado', 'faixa_renda', 'observacoes',
+)
+CAMPOS_OPCIONAIS_CLIENTE = ('cpf', 'rg', 'email', 'email_comercial', 'cpf_conjuge')
+
 @app.route('/cliente/<int:id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_cliente(id):
@@ -235,51 +397,22 @@ def editar_cliente(id):
         if not request.form.get('ddd_pessoal') or not request.form.get('telefone_pessoal'):
             flash('O DDD e o Telefone Pessoal são obrigatórios.', 'danger')
             return render_template('cliente_form.html', cliente=cliente, estado_civil_options=EstadoCivil, status_options=StatusCliente, temperatura_options=TemperaturaLead)
-        cliente.nome_completo = request.form.get('nome_completo')
-        cliente.data_nascimento = datetime.strptime(request.form.get('data_nascimento'), '%Y-%m-%d').date() if request.form.get('data_nascimento') else None
-        cliente.cpf = request.form.get('cpf') if request.form.get('cpf') else None
-        cliente.rg = request.form.get('rg') if request.form.get('rg') else None
-        cliente.profissao = request.form.get('profissao')
-        cliente.email = request.form.get('email') if request.form.get('email') else None
-        cliente.email_comercial = request.form.get('email_comercial') if request.form.get('email_comercial') else None
-        cliente.ddd_pessoal = request.form.get('ddd_pessoal')
-        cliente.telefone_pessoal = request.form.get('telefone_pessoal')
-        cliente.ddd_pessoal_2 = request.form.get('ddd_pessoal_2')
-        cliente.telefone_pessoal_2 = request.form.get('telefone_pessoal_2')
-        cliente.ddd_residencial = request.form.get('ddd_residencial')
-        cliente.telefone_residencial = request.form.get('telefone_residencial')
-        cliente.ddd_comercial = request.form.get('ddd_comercial')
-        cliente.telefone_comercial = request.form.get('telefone_comercial')
-        cliente.cep_residencial = request.form.get('cep_residencial')
-        cliente.logradouro_residencial = request.form.get('logradouro_residencial')
-        cliente.numero_residencial = request.form.get('numero_residencial')
-        cliente.complemento_residencial = request.form.get('complemento_residencial')
-        cliente.bairro_residencial = request.form.get('bairro_residencial')
-        cliente.cidade_residencial = request.form.get('cidade_residencial')
-        cliente.estado_residencial = request.form.get('estado_residencial')
-        cliente.empresa_cliente = request.form.get('empresa_cliente')
-        cliente.endereco_comercial_cliente = request.form.get('endereco_comercial_cliente')
-        estado_civil_form = request.form.get('estado_civil')
-        cliente.estado_civil = EstadoCivil[estado_civil_form] if estado_civil_form else None
-        cliente.nome_conjuge = request.form.get('nome_conjuge')
-        cliente.cpf_conjuge = request.form.get('cpf_conjuge') if request.form.get('cpf_conjuge') else None
-        cliente.profissao_conjuge = request.form.get('profissao_conjuge')
-        cliente.email_conjuge = request.form.get('email_conjuge')
-        cliente.email_conjuge_comercial = request.form.get('email_conjuge_comercial')
-        cliente.ddd_conjuge = request.form.get('ddd_conjuge')
-        cliente.telefone_conjuge = request.form.get('telefone_conjuge')
-        cliente.empresa_conjuge = request.form.get('empresa_conjuge')
-        cliente.endereco_comercial_conjuge = request.form.get('endereco_comercial_conjuge')
-        cliente.origem_lead = request.form.get('origem_lead')
-        temperatura_form = request.form.get('temperatura')
-        cliente.temperatura = TemperaturaLead[temperatura_form] if temperatura_form else None
-        status_form = request.form.get('status')
-        cliente.status = StatusCliente[status_form] if status_form else None
-        cliente.valor_imovel_buscado = request.form.get('valor_imovel_buscado')
-        cliente.faixa_renda = request.form.get('faixa_renda')
-        cliente.observacoes = request.form.get('observacoes')
-        db.session.commit()
-        flash('Cliente atualizado com sucesso!', 'success')
+        # Só os campos presentes no formulário entram na comparação; o UPDATE leva apenas as colunas alteradas
+        valores = {campo: request.form.get(campo) for campo in CAMPOS_TEXTO_CLIENTE if campo in request.form}
+        valores.update({campo: request.form.get(campo) or None for campo in CAMPOS_OPCIONAIS_CLIENTE if campo in request.form})
+        if 'data_nascimento' in request.form:
+            valores['data_nascimento'] = datetime.strptime(request.form.get('data_nascimento'), '%Y-%m-%d').date() if request.form.get('data_nascimento') else None
+        for campo, enumeracao in (('estado_civil', EstadoCivil), ('temperatura', TemperaturaLead), ('status', StatusCliente)):
+            if campo in request.form:
+                valores[campo] = enumeracao[request.form[campo]] if request.form[campo] else None
+        alterados = aplicar_alteracoes(cliente, valores)
+        app.logger.info("Cliente %s salvo: %d de %d colunas alteradas (%s)", cliente.id, len(alterados), len(valores), ', '.join(alterados) or 'nenhuma')
+        if alterados:
+            db.session.commit()
+            invalidar_cache_ia(f'cliente:{cliente.id}')
+            flash('Cliente atualizado com sucesso!', 'success')
+        else:
+            flash('Nenhuma alteração para salvar.', 'info')
         return redirect(url_for('detalhes_cliente', id=cliente.id))
     return render_template('cliente_form.html', cliente=cliente, estado_civil_options=EstadoCivil, status_options=StatusCliente, temperatura_options=TemperaturaLead)
 
@@ -297,16 +430,17 @@ def descartar_cliente(id):
 @app.route('/clientes/descartados')
 @login_required
 def lista_clientes_descartados():
-    if session.get('usuario_perfil') != 'Admin':
+    if not g.usuario.admin:
         flash('Você não tem permissão para acessar esta página.', 'danger')
         return redirect(url_for('dashboard'))
     clientes_descartados = db.session.execute(db.select(Cliente).filter_by(descartado=True).order_by(Cliente.nome_completo)).scalars().all()
-    return render_template('descartados.html', clientes=clientes_descartados)
+    usuarios_disponiveis = db.session.execute(db.select(Usuario).filter_by(ativo=True).order_by(Usuario.nome)).scalars().all()
+    return render_template('descartados.html', clientes=clientes_descartados, usuarios_disponiveis=usuarios_disponiveis)
 
 @app.route('/cliente/<int:id>/restaurar', methods=['GET', 'POST'])
 @login_required
 def restaurar_cliente(id):
-    if session.get('usuario_perfil') != 'Admin':
+    if not g.usuario.admin:
         return redirect(url_for('dashboard'))
     cliente = db.get_or_404(Cliente, id)
     if request.method == 'POST':
@@ -325,7 +459,7 @@ def restaurar_cliente(id):
 @app.route('/cliente/<int:id>/deletar_permanente', methods=['POST'])
 @login_required
 def deletar_cliente_permanente(id):
-    if session.get('usuario_perfil') != 'Admin':
+    if not g.usuario.admin:
         return redirect(url_for('dashboard'))
     cliente = db.get_or_404(Cliente, id)
     db.session.delete(cliente)
@@ -333,6 +467,100 @@ def deletar_cliente_permanente(id):
     flash(f'Cliente "{cliente.nome_completo}" deletado permanentemente.', 'danger')
     return redirect(url_for('lista_clientes_descartados'))
 
+# Ações em massa: reatribuir, restaurar e excluir são só do Admin; corretores descartam e mudam status dos próprios clientes
+ACOES_LOTE = ('reatribuir', 'descartar', 'restaurar', 'alterar_status', 'excluir')
+ACOES_LOTE_ADMIN = ('reatribuir', 'restaurar', 'excluir')
+
+def ler_parametros_lote():
+    # Formulário (ids repetidos) ou JSON ({"acao": ..., "ids": [...]} ou filtros no lugar dos ids)
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        return request.form, request.form.getlist('ids', type=int)
+    try:
+        return dados, [int(id_cliente) for id_cliente in dados.get('ids') or []]
+    except (TypeError, ValueError):
+        abort(400)
+
+def selecionar_clientes_lote(parametros, ids, acao):
+    # Ids explícitos ou os filtros da lista de clientes (proprietário, status, busca), sempre dentro do que o usuário
+    # pode alterar; restaurar e excluir atuam na lixeira, as demais ações nos clientes ativos
+    query = db.select(Cliente.id).filter(Cliente.descartado == (acao in ('restaurar', 'excluir')))
+    if not g.usuario.admin:
+        query = query.filter(Cliente.proprietario_id == g.usuario.id)
+    if ids:
+        selecionados = []
+        for inicio in range(0, len(ids), 1000):
+            selecionados += db.session.execute(query.filter(Cliente.id.in_(ids[inicio:inicio + 1000]))).scalars().all()
+        return selecionados
+    proprietario_id, status_busca, termo_busca = parametros.get('proprietario_id'), parametros.get('status_busca'), parametros.get('termo_busca')
+    if not (proprietario_id or status_busca or termo_busca):
+        return None
+    if proprietario_id:
+        query = query.filter(Cliente.proprietario_id == int(proprietario_id))
+    if status_busca:
+        query = query.filter(Cliente.status == StatusCliente[status_busca])
+    if termo_busca:
+        busca = subconsulta_busca(termo_busca, db.engine.dialect.name)
+        if busca is None:
+            return []
+        query = query.join(busca, busca.c.id == Cliente.id)
+    return db.session.execute(query).scalars().all()
+
+@app.route('/clientes/lote', methods=['POST'])
+@login_required
+def operacao_clientes_lote():
+    parametros, ids = ler_parametros_lote()
+    responder_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+    def erro(mensagem):
+        if responder_json:
+            return jsonify({'erro': mensagem}), 400
+        flash(mensagem, 'danger')
+        return redirect(request.referrer or url_for('lista_clientes'))
+    acao = parametros.get('acao')
+    if acao not in ACOES_LOTE:
+        return erro('Ação em massa inválida.')
+    if acao in ACOES_LOTE_ADMIN and not g.usuario.admin:
+        return erro('Você não tem permissão para executar esta ação.')
+    novo_proprietario = None
+    if acao in ('reatribuir', 'restaurar'):
+        novo_proprietario_id = str(parametros.get('novo_proprietario_id') or '')
+        novo_proprietario = db.session.get(Usuario, int(novo_proprietario_id)) if novo_proprietario_id.isdigit() else None
+        if novo_proprietario is None or not novo_proprietario.ativo:
+            return erro('Você precisa selecionar um usuário ativo para reatribuir os clientes.')
+    status = parametros.get('status') or None
+    temperatura = parametros.get('temperatura') or None
+    if status not in (None, *StatusCliente.__members__) or temperatura not in (None, *TemperaturaLead.__members__) or parametros.get('status_busca', '') not in ('', *StatusCliente.__members__):
+        return erro('Status ou temperatura inválidos.')
+    if acao == 'alterar_status' and not (status or temperatura):
+        return erro('Informe o novo status ou a nova temperatura.')
+    try:
+        ids_clientes = selecionar_clientes_lote(parametros, ids, acao)
+    except (TypeError, ValueError):
+        return erro('Filtro inválido.')
+    if ids_clientes is None:
+        return erro('Selecione clientes ou informe um filtro.')
+    conexao = db.session.connection()
+    if acao == 'reatribuir':
+        contagem = reatribuir_clientes(conexao, ids_clientes, novo_proprietario.id)
+        mensagem = f"{contagem['clientes']} clientes reatribuídos para {novo_proprietario.nome} ({contagem['agendamentos']} agendamentos pendentes transferidos)."
+    elif acao == 'descartar':
+        contagem = descartar_clientes(conexao, ids_clientes)
+        mensagem = f"{contagem['clientes']} clientes movidos para a lixeira."
+    elif acao == 'restaurar':
+        contagem = restaurar_clientes(conexao, ids_clientes, novo_proprietario.id)
+        mensagem = f"{contagem['clientes']} clientes restaurados e atribuídos a {novo_proprietario.nome}."
+    elif acao == 'alterar_status':
+        contagem = alterar_status_clientes(conexao, ids_clientes, StatusCliente[status] if status else None, TemperaturaLead[temperatura] if temperatura else None)
+        mensagem = f"{contagem['clientes']} clientes atualizados."
+    else:
+        contagem = excluir_clientes(conexao, ids_clientes)
+        mensagem = f"{contagem['clientes']} clientes deletados permanentemente ({contagem['atividades']} atividades e {contagem['agendamentos']} agendamentos removidos)."
+    db.session.commit()
+    if responder_json:
+        return jsonify({'acao': acao, 'selecionados': len(ids_clientes), **contagem})
+    flash(mensagem, 'danger' if acao == 'excluir' else 'success')
+    return redirect(request.referrer or url_for('lista_clientes'))
+
 # --- ROTAS DE ATIVIDADES ---
 @app.route('/cliente/<int:cliente_id>/adicionar_atividade', methods=['POST'])
 @login_required
@@ -342,7 +570,7 @@ def adicionar_atividade(cliente_id):
     tipo_str = request.form.get('tipo')
     resumo = request.form.get('resumo')
     if tipo_str and resumo:
-        nova_atividade = Atividade(tipo=TipoAtividade[tipo_str], resumo=resumo, cliente_id=cliente_id, usuario_id=session['usuario_id'])
+        nova_atividade = Atividade(tipo=TipoAtividade[tipo_str], resumo=resumo, cliente_id=cliente_id, usuario_id=g.usuario.id)
         db.session.add(nova_atividade)
         db.session.commit()
         flash('Atividade registrada com sucesso!', 'success')
@@ -354,7 +582,7 @@ def adicionar_atividade(cliente_id):
 @login_required
 def editar_atividade(id):
     atividade = db.get_or_404(Atividade, id)
-    if atividade.usuario_id != session['usuario_id'] and session.get('usuario_perfil') != 'Admin':
+    if atividade.usuario_id != g.usuario.id and not g.usuario.admin:
         flash('Você não tem permissão para editar esta atividade.', 'danger')
         return redirect(url_for('detalhes_cliente', id=atividade.cliente_id))
     if request.method == 'POST':
@@ -370,7 +598,7 @@ def editar_atividade(id):
 def deletar_atividade(id):
     atividade = db.get_or_404(Atividade, id)
     cliente_id = atividade.cliente_id
-    if atividade.usuario_id != session['usuario_id'] and session.get('usuario_perfil') != 'Admin':
+    if atividade.usuario_id != g.usuario.id and not g.usuario.admin:
         flash('Você não tem permissão para deletar esta atividade.', 'danger')
         return redirect(url_for('detalhes_cliente', id=cliente_id))
     db.session.delete(atividade)
@@ -406,28 +634,89 @@ def remover_interesse(cliente_id, empreendimento_id):
         flash(f'Interesse em "{empreendimento.nome}" removido.', 'info')
     return redirect(url_for('detalhes_cliente', id=cliente_id))
 
+def montar_prompt_sugestao(cliente, candidatos):
+    # Só os candidatos pré-selecionados pelo índice local (recomendacao.py): o prompt tem tamanho constante
+    prompt = f"Analisando o Perfil do Cliente: - Nome: {cliente.nome_completo}, Status: {cliente.status.value}, Profissão: {cliente.profissao}, Renda: {cliente.faixa_renda}, Valor Buscado: {cliente.valor_imovel_buscado}, Estado Civil: {cliente.estado_civil.value if cliente.estado_civil else ''}, Observações: {cliente.observacoes} --- Com base neste perfil, sugira os 3 empreendimentos mais adequados da lista abaixo, justificando brevemente. Empreendimentos Disponíveis: "
+    if not candidatos: prompt += "Nenhum."
+    else:
+        for _, emp in candidatos:
+            prompt += f"- {emp['nome']} (valor: {emp['valor'] or 'não informado'}; tipologias: {emp['tipologias'] or 'não informadas'}): {emp['descricao']}\n"
+    return prompt
+
+def candidatos_json(candidatos):
+    return [{'id': emp['id'], 'nome': emp['nome'], 'valor': emp['valor'], 'pontuacao': round(pontuacao, 4), 'url': url_for('detalhes_empreendimento', id=emp['id'])} for pontuacao, emp in candidatos]
+
+MENSAGEM_IA_OCUPADA = 'A IA está atendendo muitas solicitações agora. Tente novamente em alguns segundos.'
+
 @app.route('/cliente/<int:cliente_id>/sugerir_ia', methods=['POST'])
 @login_required
+@limitar('ia')
 def sugerir_empreendimento_ia(cliente_id):
+    # Versão sem JavaScript: espera a resposta inteira e mostra via flash
     cliente = verificar_permissao_cliente(cliente_id)
     if not cliente: return redirect(url_for('lista_clientes'))
-    ids_interesse = [emp.id for emp in cliente.empreendimentos_interesse]
-    empreendimentos_disponiveis = db.session.execute(db.select(Empreendimento).filter(Empreendimento.id.not_in(ids_interesse))).scalars().all()
-    prompt = f"Analisando o Perfil do Cliente: - Nome: {cliente.nome_completo}, Status: {cliente.status.value}, Profissão: {cliente.profissao}, Renda: {cliente.faixa_renda}, Valor Buscado: {cliente.valor_imovel_buscado}, Estado Civil: {cliente.estado_civil.value if cliente.estado_civil else ''}, Observações: {cliente.observacoes} --- Com base neste perfil, sugira os 3 empreendimentos mais adequados da lista abaixo, justificando brevemente. Empreendimentos Disponíveis: "
-    if not empreendimentos_disponiveis: prompt += "Nenhum."
-    else:
-        for emp in empreendimentos_disponiveis:
-            prompt += f"- {emp.nome}: {emp.descricao}\n"
-    sugestao_gerada = "Não foi possível gerar uma sugestão."
+    candidatos = recomendar_empreendimentos(cliente, app.config['RECOMENDACAO_CANDIDATOS'])
+    prompt = montar_prompt_sugestao(cliente, candidatos)
+    # Sem a IA (ocupada ou fora do ar), a pré-seleção local já serve como sugestão
+    # (escapada: os nomes dos empreendimentos são editáveis pelos usuários e o base.html exibe os flashes com |safe)
+    sugestao_local = "Mais compatíveis com o perfil: " + (', '.join(emp['nome'] for _, emp in candidatos[:3]) or 'nenhum empreendimento disponível') + "."
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        response = model.generate_content(prompt)
-        sugestao_gerada = response.text
+        with limitador_ia.vaga():
+            sugestao_gerada = gerar_resposta_ia(prompt, etiquetas=(f'cliente:{cliente.id}', 'catalogo'))
+        flash(Markup(sugestao_gerada.replace('\n', '<br>')), 'info')
+    except IAOcupada:
+        flash(MENSAGEM_IA_OCUPADA, 'warning')
+        flash(escape(sugestao_local), 'info')
     except Exception as e:
         flash(f"Não foi possível contatar a IA. Erro: {e}", "danger")
-    flash(Markup(sugestao_gerada.replace('\n', '<br>')), 'info')
+        flash(escape(sugestao_local), 'info')
     return redirect(url_for('detalhes_cliente', id=cliente_id))
 
+def evento_sse(dados, evento=None):
+    # Cada pedaço vai como JSON para preservar quebras de linha e espaços do texto gerado
+    return (f"event: {evento}\n" if evento else '') + f"data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+@app.route('/cliente/<int:cliente_id>/sugerir_ia/stream')
+@login_required
+@limitar('ia')
+def sugerir_empreendimento_ia_stream(cliente_id):
+    # A mesma sugestão por Server-Sent Events, enviada conforme o modelo escreve. O prompt é montado antes do
+    # streaming, então a conexão do banco volta ao pool e o gerador só conversa com o Gemini e com o cache.
+    cliente = verificar_permissao_cliente(cliente_id)
+    if not cliente: abort(403)
+    candidatos = recomendar_empreendimentos(cliente, app.config['RECOMENDACAO_CANDIDATOS'])
+    prompt = montar_prompt_sugestao(cliente, candidatos)
+    evento_candidatos = evento_sse(candidatos_json(candidatos), 'candidatos')
+    try:
+        liberar_vaga = limitador_ia.reservar()
+    except IAOcupada:
+        return Response(evento_candidatos + evento_sse(MENSAGEM_IA_OCUPADA, 'erro'), status=503, mimetype='text/event-stream', headers={'Retry-After': '5'})
+    partes = gerar_resposta_ia_em_partes(prompt, etiquetas=(f'cliente:{cliente.id}', 'catalogo'))
+
+    def gerar_eventos():
+        # A pré-seleção local sai de imediato; o texto da IA vem em seguida, conforme é gerado
+        yield evento_candidatos
+        try:
+            for parte in partes:
+                yield evento_sse(parte)
+            yield evento_sse('', 'fim')
+        except Exception as e:
+            yield evento_sse(f"Não foi possível contatar a IA. Erro: {e}", 'erro')
+
+    resposta = Response(gerar_eventos(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # call_on_close roda mesmo se o cliente desconectar antes do fim (ou antes do primeiro pedaço)
+    resposta.call_on_close(liberar_vaga)
+    return resposta
+
+@app.route('/api/cliente/<int:cliente_id>/recomendacoes')
+@login_required
+def api_recomendacoes_cliente(cliente_id):
+    # Ranking local, sem chamar a IA
+    cliente = verificar_permissao_cliente(cliente_id)
+    if not cliente: abort(403)
+    k = min(request.args.get('k', app.config['RECOMENDACAO_CANDIDATOS'], type=int), 50)
+    return jsonify({'empreendimentos': candidatos_json(recomendar_empreendimentos(cliente, k))})
+
 # --- ROTAS DE EMPREENDIMENTOS ---
 @app.route('/empreendimentos')
 @login_required
@@ -483,70 +772,53 @@ def adicionar_empreendimento():
         if 'form_originado_ia' in request.form:
             salvar_exemplo_ia(request.form.get('texto_original_ia'), request.form)
         
-        files = request.files.getlist('arquivos')
-        for file in files:
-            if file and file.filename != '':
-                nome_original = file.filename
-                nome_seguro = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{secure_filename(nome_original)}"
-                caminho_salvar = os.path.join(app.config['UPLOAD_FOLDER'], nome_seguro)
-                file.save(caminho_salvar)
-                novo_material = Material(nome_original=nome_original, nome_arquivo_servidor=nome_seguro, empreendimento_id=novo_empreendimento.id)
-                db.session.add(novo_material)
+        anexar_arquivos_enviados(novo_empreendimento.id)
         
         db.session.commit()
+        invalidar_cache_ia('catalogo')
         flash('Empreendimento adicionado com sucesso!', 'success')
         return redirect(url_for('detalhes_empreendimento', id=novo_empreendimento.id))
         
     return render_template('empreendimento_form.html', dados_extraidos={})
 
+CAMPOS_TEXTO_EMPREENDIMENTO = (
+    'status', 'endereco', 'descricao', 'previsao_entrega', 'valor_medio_unidades', 'valor_a_partir_de', 'tamanho_terreno',
+    'campanha_promocional', 'arquiteto', 'paisagismo', 'decoracao',
+)
+
 @app.route('/empreendimento/<int:id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_empreendimento(id):
     empreendimento = db.get_or_404(Empreendimento, id)
     if request.method == 'POST':
-        empreendimento.publico = 'publico' in request.form
-        empreendimento.nome = request.form['nome']
-        empreendimento.status = request.form.get('status')
-        empreendimento.endereco = request.form.get('endereco')
-        empreendimento.descricao = request.form.get('descricao')
-        empreendimento.prazo_entrega = datetime.strptime(request.form.get('prazo_entrega'), '%Y-%m-%d').date() if request.form.get('prazo_entrega') else None
-        empreendimento.previsao_entrega = request.form.get('previsao_entrega')
-        empreendimento.valor_medio_unidades = request.form.get('valor_medio_unidades')
-        empreendimento.valor_a_partir_de = request.form.get('valor_a_partir_de')
-        empreendimento.tamanho_terreno = request.form.get('tamanho_terreno')
-        empreendimento.quantidade_torres = int(request.form.get('quantidade_torres')) if request.form.get('quantidade_torres') else None
-        empreendimento.subsolos = int(request.form.get('subsolos')) if request.form.get('subsolos') else None
-        empreendimento.andares = int(request.form.get('andares')) if request.form.get('andares') else None
-        empreendimento.campanha_promocional = request.form.get('campanha_promocional')
-        empreendimento.arquiteto = request.form.get('arquiteto')
-        empreendimento.paisagismo = request.form.get('paisagismo')
-        empreendimento.decoracao = request.form.get('decoracao')
-        
-        for tipologia_antiga in empreendimento.tipologias:
-            db.session.delete(tipologia_antiga)
-        
+        valores = {'publico': 'publico' in request.form, 'nome': request.form['nome']}
+        valores.update({campo: request.form.get(campo) for campo in CAMPOS_TEXTO_EMPREENDIMENTO if campo in request.form})
+        if 'prazo_entrega' in request.form:
+            valores['prazo_entrega'] = datetime.strptime(request.form.get('prazo_entrega'), '%Y-%m-%d').date() if request.form.get('prazo_entrega') else None
+        for campo in ('quantidade_torres', 'subsolos', 'andares'):
+            if campo in request.form:
+                valores[campo] = int(request.form.get(campo)) if request.form.get(campo) else None
+        alterados = aplicar_alteracoes(empreendimento, valores)
+
+        # Tipologias reconciliadas no lugar (UPDATE/INSERT/DELETE por id) em vez de apagar e recriar todas
         metragens = request.form.getlist('metragem')
         suites_lista = request.form.getlist('suites')
         vagas_lista = request.form.getlist('vagas')
-        for i, metragem_item in enumerate(metragens):
-            if metragem_item and metragem_item.strip():
-                nova_tipologia = Tipologia(
-                    metragem=metragem_item, suites=suites_lista[i],
-                    vagas=vagas_lista[i], empreendimento_id=empreendimento.id
-                )
-                db.session.add(nova_tipologia)
-        
-        files = request.files.getlist('arquivos')
-        for file in files:
-            if file and file.filename != '':
-                nome_original = file.filename
-                nome_seguro = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{secure_filename(nome_original)}"
-                caminho_salvar = os.path.join(app.config['UPLOAD_FOLDER'], nome_seguro)
-                file.save(caminho_salvar)
-                novo_material = Material(nome_original=nome_original, nome_arquivo_servidor=nome_seguro, empreendimento_id=empreendimento.id)
-                db.session.add(novo_material)
+        ids_tipologias = request.form.getlist('tipologia_id', type=lambda valor: int(valor) if valor else None)
+        if len(ids_tipologias) != len(metragens):
+            ids_tipologias = [None] * len(metragens)
+        linhas = [{'id': ids_tipologias[i], 'metragem': metragem_item, 'suites': suites_lista[i], 'vagas': vagas_lista[i]}
+                  for i, metragem_item in enumerate(metragens) if metragem_item and metragem_item.strip()]
+        tipologias = reconciliar_tipologias(empreendimento, linhas)
+        app.logger.info("Empreendimento %s salvo: %d de %d colunas alteradas (%s); tipologias: %d inseridas, %d alteradas (%d colunas), %d removidas",
+                        empreendimento.id, len(alterados), len(valores), ', '.join(alterados) or 'nenhuma',
+                        tipologias['inseridas'], tipologias['alteradas'], tipologias['colunas'], tipologias['removidas'])
+
+        anexar_arquivos_enviados(empreendimento.id)
 
         db.session.commit()
+        if alterados or tipologias['inseridas'] or tipologias['alteradas'] or tipologias['removidas']:
+            invalidar_cache_ia('catalogo')
         flash('Empreendimento atualizado com sucesso!', 'success')
         return redirect(url_for('detalhes_empreendimento', id=empreendimento.id))
         
@@ -555,20 +827,19 @@ def editar_empreendimento(id):
 @app.route('/empreendimento/<int:id>/deletar', methods=['POST'])
 @login_required
 def deletar_empreendimento(id):
-    if session.get('usuario_perfil') != 'Admin':
+    if not g.usuario.admin:
         flash('Apenas administradores podem deletar empreendimentos.', 'danger')
         return redirect(url_for('pagina_empreendimentos'))
     empreendimento = db.get_or_404(Empreendimento, id)
     for material in empreendimento.materiais:
         try:
-            caminho_arquivo = os.path.join(app.config['UPLOAD_FOLDER'], material.nome_arquivo_servidor)
-            if os.path.exists(caminho_arquivo):
-                os.remove(caminho_arquivo)
+            liberar_material(material, app.config['UPLOAD_FOLDER'])
         except OSError as e:
             print(f"Erro ao deletar arquivo físico do material {material.id}: {e}")
             flash(f"Erro ao deletar arquivo {material.nome_original}", "danger")
     db.session.delete(empreendimento)
     db.session.commit()
+    invalidar_cache_ia('catalogo')
     flash(f'Empreendimento "{empreendimento.nome}" e todos os seus materiais foram deletados permanentemente.', 'success')
     return redirect(url_for('pagina_empreendimentos'))
 
@@ -577,7 +848,7 @@ def deletar_empreendimento(id):
 @login_required
 def adicionar_tipologia(empreendimento_id):
     empreendimento = db.get_or_404(Empreendimento, empreendimento_id)
-    if session.get('usuario_perfil') != 'Admin':
+    if not g.usuario.admin:
         flash('Apenas administradores podem adicionar tipologias.', 'danger')
         return redirect(url_for('detalhes_empreendimento', id=empreendimento_id))
     nova_tipologia = Tipologia(
@@ -596,7 +867,7 @@ def adicionar_tipologia(empreendimento_id):
 def deletar_tipologia(id):
     tipologia = db.get_or_404(Tipologia, id)
     empreendimento_id = tipologia.empreendimento_id
-    if session.get('usuario_perfil') != 'Admin':
+    if not g.usuario.admin:
         flash('Apenas administradores podem deletar tipologias.', 'danger')
         return redirect(url_for('detalhes_empreendimento', id=empreendimento_id))
     db.session.delete(tipologia)
@@ -615,11 +886,9 @@ def download_material(filename):
 def deletar_material(id):
     material = db.get_or_404(Material, id)
     empreendimento_id = material.empreendimento_id
-    if session.get('usuario_perfil') == 'Admin':
+    if g.usuario.admin:
         try:
-            caminho_arquivo = os.path.join(app.config['UPLOAD_FOLDER'], material.nome_arquivo_servidor)
-            if os.path.exists(caminho_arquivo):
-                os.remove(caminho_arquivo)
+            liberar_material(material, app.config['UPLOAD_FOLDER'])
             db.session.delete(material)
             db.session.commit()
             flash('Material deletado com sucesso.', 'info')
@@ -651,81 +920,225 @@ def agenda():
 @app.route('/api/agendamentos')
 @login_required
 def api_agendamentos():
-    query = db.select(Agendamento)
-    if session['usuario_perfil'] != 'Admin':
-        query = query.filter_by(usuario_id=session['usuario_id'])
-    meus_agendamentos = db.session.execute(query).scalars().all()
-    eventos = []
-    for agendamento in meus_agendamentos:
-        eventos.append({'title': agendamento.titulo, 'start': agendamento.data_inicio.isoformat(), 'end': agendamento.data_fim.isoformat() if agendamento.data_fim else None, 'url': url_for('detalhes_agendamento', id=agendamento.id), 'color': '#007BFF', 'textColor': 'white'})
-    return jsonify(eventos)
+    # Só os eventos da janela visível do FullCalendar (?start=&end=). O ETag vem da versão da agenda
+    # (versoes_dados.py), então uma janela que não mudou responde 304 sem consultar os eventos.
+    try:
+        inicio = ler_data_calendario(request.args.get('start'))
+        fim = ler_data_calendario(request.args.get('end'))
+    except ValueError:
+        abort(400)
+    chave_versao = 'agenda' if g.usuario.admin else f"agenda:{g.usuario.id}"
+    versao, data_atualizacao = obter_versao(db.session, chave_versao)
+    resposta = Response(mimetype='application/json')
+    resposta.set_etag(hashlib.sha1(f"{chave_versao}:{versao}:{inicio}:{fim}".encode()).hexdigest())
+    resposta.last_modified = data_atualizacao
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    if not is_resource_modified(request.environ, etag=resposta.get_etag()[0], last_modified=data_atualizacao):
+        resposta.status_code = 304
+        return resposta
+    colunas = [Agendamento.id, Agendamento.titulo, Agendamento.data_inicio, Agendamento.data_fim]
+    query = db.select(*colunas).filter(Agendamento.regra_recorrencia.is_(None))
+    query_series = db.select(*colunas, Agendamento.regra_recorrencia).filter(Agendamento.regra_recorrencia.is_not(None))
+    if not g.usuario.admin:
+        query = query.filter(Agendamento.usuario_id == g.usuario.id)
+        query_series = query_series.filter(Agendamento.usuario_id == g.usuario.id)
+    if fim:
+        query = query.filter(Agendamento.data_inicio < fim)
+        query_series = query_series.filter(Agendamento.data_inicio < fim)
+    if inicio:
+        # Eventos que começam na janela ou que começaram antes e ainda não terminaram; cada ramo usa seu índice
+        query = query.filter(or_(Agendamento.data_inicio >= inicio, Agendamento.data_fim > inicio))
+        query_series = query_series.filter(or_(Agendamento.recorrencia_ate.is_(None), Agendamento.recorrencia_ate > inicio))
+    series = db.session.execute(query_series).all()
+    ocorrencias = expandir_series(series, buscar_excecoes_na_janela(series, inicio, fim), inicio, fim) if series else []
+    modelo_url = url_for('detalhes_agendamento', id=0).replace('/0', '/{id}')
+    eventos = [{'title': linha.titulo, 'start': linha.data_inicio.isoformat(), 'end': linha.data_fim.isoformat() if linha.data_fim else None, 'url': modelo_url.format(id=linha.id), 'color': '#007BFF', 'textColor': 'white'}
+               for linha in db.session.execute(query.order_by(Agendamento.data_inicio))]
+    eventos += [{'title': ocorrencia['titulo'], 'start': ocorrencia['data_inicio'].isoformat(), 'end': ocorrencia['data_fim'].isoformat() if ocorrencia['data_fim'] else None,
+                 'url': modelo_url.format(id=ocorrencia['id']) + '?ocorrencia=' + ocorrencia['ocorrencia'].isoformat(), 'color': '#17A2B8', 'textColor': 'white'}
+                for ocorrencia in ocorrencias]
+    resposta.set_data(json.dumps(eventos))
+    return resposta
+
+def ler_recorrencia_do_formulario(form, data_inicio):
+    # Monta a regra RRULE a partir dos campos "Repetir" do formulário; None para evento único
+    frequencia = form.get('repetir')
+    if not frequencia:
+        return None, None
+    contagem = int(form['contagem']) if form.get('termino') == 'contagem' and form.get('contagem') else None
+    ate = datetime.fromisoformat(form['repetir_ate']).replace(hour=23, minute=59, second=59) if form.get('termino') == 'data' and form.get('repetir_ate') else None
+    regra = RegraRecorrencia(frequencia, int(form.get('intervalo') or 1), [DIAS_SEMANA.index(dia) for dia in form.getlist('dias_semana')], contagem, ate)
+    data_fim = datetime.fromisoformat(form['data_fim']) if form.get('data_fim') else None
+    return regra.formatar(), regra.fim_da_serie(data_inicio, data_fim - data_inicio if data_fim else timedelta(0))
+
+@app.route('/api/agenda/disponibilidade')
+@login_required
+def api_disponibilidade():
+    # Livre/ocupado de um conjunto de corretores (?usuarios=1,2&start=&end=). Corretores só consultam a própria agenda.
+    try:
+        inicio = ler_data_calendario(request.args.get('start'))
+        fim = ler_data_calendario(request.args.get('end'))
+        usuario_ids = [int(valor) for valor in request.args.get('usuarios', str(g.usuario.id)).split(',') if valor]
+    except ValueError:
+        abort(400)
+    if not inicio or not fim or fim <= inicio or fim - inicio > timedelta(days=366) or not usuario_ids:
+        abort(400)
+    if not g.usuario.admin and usuario_ids != [g.usuario.id]:
+        abort(403)
+    usuarios = db.session.execute(db.select(Usuario.id, Usuario.nome).filter(Usuario.id.in_(usuario_ids))).all()
+    ocupado = disponibilidade([usuario.id for usuario in usuarios], inicio, fim)
+    return jsonify({'inicio': inicio.isoformat(), 'fim': fim.isoformat(), 'usuarios': [
+        {'id': usuario.id, 'nome': usuario.nome, 'ocupado': [{'inicio': periodo[0].isoformat(), 'fim': periodo[1].isoformat()} for periodo in ocupado[usuario.id]]}
+        for usuario in usuarios]})
+
+def ler_data_calendario(valor):
+    # O FullCalendar envia ISO 8601 com o fuso do navegador; as datas da agenda são gravadas sem fuso (hora local)
+    if not valor:
+        return None
+    return datetime.fromisoformat(valor.replace('Z', '+00:00')).replace(tzinfo=None)
 
 @app.route('/agendamento/adicionar', methods=['GET', 'POST'])
 @login_required
 def adicionar_agendamento():
     if request.method == 'POST':
-        data_inicio_str = request.form.get('data_inicio')
-        data_fim_str = request.form.get('data_fim')
-        data_inicio_obj = datetime.fromisoformat(data_inicio_str) if data_inicio_str else None
-        data_fim_obj = datetime.fromisoformat(data_fim_str) if data_fim_str else None
-        cliente_id = request.form.get('cliente_id') if request.form.get('cliente_id') else None
-        empreendimento_id = request.form.get('empreendimento_id') if request.form.get('empreendimento_id') else None
-        novo_evento = Agendamento(
-            titulo=request.form['titulo'], data_inicio=data_inicio_obj, data_fim=data_fim_obj,
-            descricao=request.form.get('descricao'), usuario_id=session['usuario_id'],
-            cliente_id=cliente_id, empreendimento_id=empreendimento_id
-        )
+        try:
+            dados = ler_agendamento_do_formulario(request.form, g.usuario.id)
+        except ValueError:
+            flash('Regra de repetição inválida. Verifique os campos.', 'danger')
+            return redirect(url_for('adicionar_agendamento'))
+        conflitos = encontrar_conflitos(dados) if not request.form.get('ignorar_conflitos') else []
+        if conflitos:
+            avisar_conflitos(conflitos)
+            return renderizar_form_agendamento(Agendamento(**dados), conflitos)
+        novo_evento = Agendamento(**dados)
         db.session.add(novo_evento)
         db.session.commit()
         flash('Evento adicionado à agenda com sucesso!', 'success')
         return redirect(url_for('agenda'))
-    if session['usuario_perfil'] == 'Admin':
+    return renderizar_form_agendamento(None)
+
+def ler_agendamento_do_formulario(form, usuario_id, data_inicio_atual=None):
+    data_inicio = datetime.fromisoformat(form['data_inicio']) if form.get('data_inicio') else data_inicio_atual
+    data_fim = datetime.fromisoformat(form['data_fim']) if form.get('data_fim') else None
+    regra_recorrencia, recorrencia_ate = ler_recorrencia_do_formulario(form, data_inicio)
+    return {'titulo': form['titulo'], 'data_inicio': data_inicio, 'data_fim': data_fim, 'descricao': form.get('descricao'), 'usuario_id': usuario_id,
+            'cliente_id': int(form['cliente_id']) if form.get('cliente_id') else None,
+            'empreendimento_id': int(form['empreendimento_id']) if form.get('empreendimento_id') else None,
+            'regra_recorrencia': regra_recorrencia, 'recorrencia_ate': recorrencia_ate}
+
+def avisar_conflitos(conflitos):
+    itens = ''.join(f"<li>{escape(conflito['titulo'])} em {conflito['data_inicio'].strftime('%d/%m/%Y %H:%M')} ({', '.join(conflito['motivos'])})</li>" for conflito in conflitos)
+    flash(f"Conflito de horário com outros eventos:<ul>{itens}</ul>Ajuste o horário ou marque \"Salvar mesmo assim\".", 'danger')
+
+def renderizar_form_agendamento(agendamento, conflitos=()):
+    if g.usuario.admin:
         clientes_do_usuario = db.session.execute(db.select(Cliente).order_by(Cliente.nome_completo)).scalars().all()
     else:
-        clientes_do_usuario = db.session.execute(db.select(Cliente).filter_by(proprietario_id=session['usuario_id']).order_by(Cliente.nome_completo)).scalars().all()
+        clientes_do_usuario = db.session.execute(db.select(Cliente).filter_by(proprietario_id=g.usuario.id).order_by(Cliente.nome_completo)).scalars().all()
     todos_empreendimentos = db.session.execute(db.select(Empreendimento).order_by(Empreendimento.nome)).scalars().all()
-    return render_template('agendamento_form.html', clientes=clientes_do_usuario, empreendimentos=todos_empreendimentos)
+    regra = RegraRecorrencia.interpretar(agendamento.regra_recorrencia) if agendamento and agendamento.regra_recorrencia else None
+    return render_template('agendamento_form.html', agendamento=agendamento, clientes=clientes_do_usuario, empreendimentos=todos_empreendimentos,
+                           regra=regra, dias_semana=DIAS_SEMANA, conflitos=conflitos)
 
 @app.route('/agendamento/<int:id>')
 @login_required
 def detalhes_agendamento(id):
     agendamento = db.get_or_404(Agendamento, id)
-    if session['usuario_perfil'] != 'Admin' and agendamento.usuario_id != session['usuario_id']:
+    if not g.usuario.admin and agendamento.usuario_id != g.usuario.id:
         flash('Você não tem permissão para ver este evento.', 'danger')
         return redirect(url_for('agenda'))
-    return render_template('detalhes_agendamento.html', agendamento=agendamento)
+    ocorrencia, excecao = ler_ocorrencia(agendamento, request.args.get('ocorrencia')) if request.args.get('ocorrencia') else (None, None)
+    return render_template('detalhes_agendamento.html', agendamento=agendamento, ocorrencia=ocorrencia, excecao=excecao, dias_semana=DIAS_SEMANA,
+                           regra=RegraRecorrencia.interpretar(agendamento.regra_recorrencia) if agendamento.regra_recorrencia else None)
+
+def ler_ocorrencia(agendamento, valor):
+    # Valida que a data pedida é mesmo uma ocorrência da série; devolve (data original, exceção já gravada ou None)
+    try:
+        data_original = datetime.fromisoformat(valor)
+    except ValueError:
+        abort(404)
+    if not agendamento.regra_recorrencia:
+        abort(404)
+    excecao = db.session.execute(db.select(ExcecaoAgendamento).filter_by(agendamento_id=agendamento.id, data_original=data_original)).scalar_one_or_none()
+    regra = RegraRecorrencia.interpretar(agendamento.regra_recorrencia)
+    if excecao is None and data_original not in regra.ocorrencias(agendamento.data_inicio, timedelta(0), data_original, data_original + timedelta(seconds=1)):
+        abort(404)
+    return data_original, excecao
+
+@app.route('/agendamento/<int:id>/ocorrencia/<ocorrencia>/editar', methods=['GET', 'POST'])
+@login_required
+def editar_ocorrencia(id, ocorrencia):
+    # Edita só uma ocorrência da série, gravando uma ExcecaoAgendamento em vez de duplicar o evento
+    agendamento = db.get_or_404(Agendamento, id)
+    if not g.usuario.admin and agendamento.usuario_id != g.usuario.id:
+        flash('Você não tem permissão para editar este evento.', 'danger')
+        return redirect(url_for('agenda'))
+    data_original, excecao = ler_ocorrencia(agendamento, ocorrencia)
+    if request.method == 'POST':
+        if excecao is None:
+            excecao = ExcecaoAgendamento(agendamento=agendamento, data_original=data_original)
+            db.session.add(excecao)
+        excecao.cancelada = False
+        excecao.titulo = request.form['titulo']
+        excecao.data_inicio = datetime.fromisoformat(request.form['data_inicio']) if request.form.get('data_inicio') else data_original
+        excecao.data_fim = datetime.fromisoformat(request.form['data_fim']) if request.form.get('data_fim') else None
+        excecao.descricao = request.form.get('descricao')
+        db.session.commit()
+        flash('Ocorrência atualizada com sucesso!', 'success')
+        return redirect(url_for('detalhes_agendamento', id=id, ocorrencia=data_original.isoformat()))
+    duracao = agendamento.data_fim - agendamento.data_inicio if agendamento.data_fim else None
+    return render_template('ocorrencia_form.html', agendamento=agendamento, ocorrencia=data_original,
+                           titulo=(excecao and excecao.titulo) or agendamento.titulo,
+                           data_inicio=(excecao and excecao.data_inicio) or data_original,
+                           data_fim=(excecao and excecao.data_fim) or (data_original + duracao if duracao else None),
+                           descricao=excecao.descricao if excecao else agendamento.descricao)
+
+@app.route('/agendamento/<int:id>/ocorrencia/<ocorrencia>/cancelar', methods=['POST'])
+@login_required
+def cancelar_ocorrencia(id, ocorrencia):
+    agendamento = db.get_or_404(Agendamento, id)
+    if not g.usuario.admin and agendamento.usuario_id != g.usuario.id:
+        flash('Você não tem permissão para alterar este evento.', 'danger')
+        return redirect(url_for('agenda'))
+    data_original, excecao = ler_ocorrencia(agendamento, ocorrencia)
+    if excecao is None:
+        excecao = ExcecaoAgendamento(agendamento=agendamento, data_original=data_original)
+        db.session.add(excecao)
+    excecao.cancelada = True
+    db.session.commit()
+    flash('Ocorrência cancelada. As demais ocorrências da série foram mantidas.', 'info')
+    return redirect(url_for('agenda'))
 
 @app.route('/agendamento/<int:id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_agendamento(id):
     agendamento = db.get_or_404(Agendamento, id)
-    if session['usuario_perfil'] != 'Admin' and agendamento.usuario_id != session['usuario_id']:
+    if not g.usuario.admin and agendamento.usuario_id != g.usuario.id:
         flash('Você não tem permissão para editar este evento.', 'danger')
         return redirect(url_for('agenda'))
     if request.method == 'POST':
-        agendamento.titulo = request.form['titulo']
-        data_inicio_str = request.form.get('data_inicio')
-        data_fim_str = request.form.get('data_fim')
-        agendamento.data_inicio = datetime.fromisoformat(data_inicio_str) if data_inicio_str else agendamento.data_inicio
-        agendamento.data_fim = datetime.fromisoformat(data_fim_str) if data_fim_str else None
-        agendamento.cliente_id = request.form.get('cliente_id') if request.form.get('cliente_id') else None
-        agendamento.empreendimento_id = request.form.get('empreendimento_id') if request.form.get('empreendimento_id') else None
-        agendamento.descricao = request.form.get('descricao')
+        try:
+            dados = ler_agendamento_do_formulario(request.form, agendamento.usuario_id, agendamento.data_inicio)
+        except ValueError:
+            flash('Regra de repetição inválida. Verifique os campos.', 'danger')
+            return redirect(url_for('editar_agendamento', id=id))
+        conflitos = encontrar_conflitos(dados, ignorar_id=id) if not request.form.get('ignorar_conflitos') else []
+        if conflitos:
+            avisar_conflitos(conflitos)
+            return renderizar_form_agendamento(Agendamento(id=id, **dados), conflitos)
+        for campo, valor in dados.items():
+            setattr(agendamento, campo, valor)
         db.session.commit()
         flash('Evento atualizado com sucesso!', 'success')
         return redirect(url_for('detalhes_agendamento', id=id))
-    if session['usuario_perfil'] == 'Admin':
-        clientes_do_usuario = db.session.execute(db.select(Cliente).order_by(Cliente.nome_completo)).scalars().all()
-    else:
-        clientes_do_usuario = db.session.execute(db.select(Cliente).filter_by(proprietario_id=session['usuario_id']).order_by(Cliente.nome_completo)).scalars().all()
-    todos_empreendimentos = db.session.execute(db.select(Empreendimento).order_by(Empreendimento.nome)).scalars().all()
-    return render_template('agendamento_form.html', agendamento=agendamento, clientes=clientes_do_usuario, empreendimentos=todos_empreendimentos)
+    return renderizar_form_agendamento(agendamento)
 
 @app.route('/agendamento/<int:id>/deletar', methods=['POST'])
 @login_required
 def deletar_agendamento(id):
     agendamento = db.get_or_404(Agendamento, id)
-    if session['usuario_perfil'] != 'Admin' and agendamento.usuario_id != session['usuario_id']:
+    if not g.usuario.admin and agendamento.usuario_id != g.usuario.id:
         flash('Você não tem permissão para deletar este evento.', 'danger')
         return redirect(url_for('agenda'))
     db.session.delete(agendamento)
@@ -739,35 +1152,44 @@ def deletar_agendamento(id):
 def pagina_relatorios():
     return render_template('relatorios.html')
 
+COLUNAS_EXPORTACAO_CLIENTES = [
+    ('Nome Completo', Cliente.nome_completo), ('Email Pessoal', Cliente.email), ('Email Comercial', Cliente.email_comercial),
+    ('DDD Pessoal', Cliente.ddd_pessoal), ('Telefone Pessoal', Cliente.telefone_pessoal),
+    ('DDD Pessoal 2', Cliente.ddd_pessoal_2), ('Telefone Pessoal 2', Cliente.telefone_pessoal_2),
+    ('DDD Residencial', Cliente.ddd_residencial), ('Telefone Residencial', Cliente.telefone_residencial),
+    ('DDD Comercial', Cliente.ddd_comercial), ('Telefone Comercial', Cliente.telefone_comercial),
+    ('CPF', Cliente.cpf), ('RG', Cliente.rg), ('Data de Nascimento', Cliente.data_nascimento), ('Profissão', Cliente.profissao),
+    ('Estado Civil', Cliente.estado_civil), ('Status', Cliente.status), ('Temperatura', Cliente.temperatura),
+    ('Origem do Lead', Cliente.origem_lead), ('Renda', Cliente.faixa_renda), ('Valor Buscado', Cliente.valor_imovel_buscado),
+    ('Observações', Cliente.observacoes)
+]
+TAMANHO_LOTE_EXPORTACAO = 1000
+
+def gerar_csv_clientes(query):
+    # Lê os clientes em lotes (yield_per) só com as colunas exportadas e devolve o CSV em pedaços,
+    # no mesmo formato do antigo DataFrame.to_csv(sep=';')
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';', lineterminator='\n')
+    escritor.writerow([titulo for titulo, _ in COLUNAS_EXPORTACAO_CLIENTES])
+    resultado = db.session.execute(query.execution_options(yield_per=TAMANHO_LOTE_EXPORTACAO))
+    for linhas in resultado.partitions():
+        for linha in linhas:
+            escritor.writerow([valor.value if isinstance(valor, enum.Enum) else valor for valor in linha])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
 @app.route('/relatorios/exportar_clientes_csv')
 @login_required
 def exportar_clientes_csv():
-    if session['usuario_perfil'] == 'Admin':
-        query = db.select(Cliente).order_by(Cliente.nome_completo)
-    else:
-        query = db.select(Cliente).filter_by(proprietario_id=session['usuario_id']).order_by(Cliente.nome_completo)
-    clientes = db.session.execute(query).scalars().all()
-    if not clientes:
+    query = db.select(*[coluna for _, coluna in COLUNAS_EXPORTACAO_CLIENTES])
+    if not g.usuario.admin:
+        query = query.filter(Cliente.proprietario_id == g.usuario.id)
+    if db.session.execute(query.with_only_columns(Cliente.id).limit(1)).first() is None:
         flash('Não há clientes para exportar.', 'info')
         return redirect(url_for('pagina_relatorios'))
-    dados_para_planilha = []
-    for cliente in clientes:
-        dados_para_planilha.append({
-            'Nome Completo': cliente.nome_completo, 'Email Pessoal': cliente.email, 'Email Comercial': cliente.email_comercial,
-            'DDD Pessoal': cliente.ddd_pessoal, 'Telefone Pessoal': cliente.telefone_pessoal,
-            'DDD Pessoal 2': cliente.ddd_pessoal_2, 'Telefone Pessoal 2': cliente.telefone_pessoal_2,
-            'DDD Residencial': cliente.ddd_residencial, 'Telefone Residencial': cliente.telefone_residencial,
-            'DDD Comercial': cliente.ddd_comercial, 'Telefone Comercial': cliente.telefone_comercial,
-            'CPF': cliente.cpf, 'RG': cliente.rg, 'Data de Nascimento': cliente.data_nascimento, 'Profissão': cliente.profissao,
-            'Estado Civil': cliente.estado_civil.value if cliente.estado_civil else '',
-            'Status': cliente.status.value if cliente.status else '',
-            'Temperatura': cliente.temperatura.value if cliente.temperatura else '',
-            'Origem do Lead': cliente.origem_lead, 'Renda': cliente.faixa_renda, 'Valor Buscado': cliente.valor_imovel_buscado,
-            'Observações': cliente.observacoes
-        })
-    df = pd.DataFrame(dados_para_planilha)
-    output_csv = df.to_csv(index=False, encoding='utf-8-sig', sep=';')
-    return Response(output_csv, mimetype="text/csv", headers={"Content-Disposition": "attachment;filename=relatorio_clientes.csv"})
+    return Response(stream_with_context(gerar_csv_clientes(query.order_by(Cliente.nome_completo))), mimetype="text/csv", headers={"Content-Disposition": "attachment;filename=relatorio_clientes.csv"})
 
 @app.route('/importar', methods=['GET', 'POST'])
 @login_required
@@ -779,30 +1201,13 @@ def importar_clientes():
         file = request.files['arquivo']
         if file and file.filename.endswith('.csv'):
             try:
-                df = pd.read_csv(file, encoding='utf-8', sep=';')
-                clientes_novos = []
-                for index, row in df.iterrows():
-                    cpf = str(row['CPF']) if pd.notna(row['CPF']) else None
-                    email = str(row['Email Pessoal']) if pd.notna(row['Email Pessoal']) else None
-                    if cpf and db.session.execute(db.select(Cliente).filter_by(cpf=cpf)).scalar_one_or_none(): continue
-                    if email and db.session.execute(db.select(Cliente).filter_by(email=email)).scalar_one_or_none(): continue
-                    data_nasc_obj = pd.to_datetime(row['Data de Nascimento'], dayfirst=True, errors='coerce').date() if pd.notna(row['Data de Nascimento']) else None
-                    novo_cliente = Cliente(
-                        proprietario_id=session['usuario_id'],
-                        nome_completo=row['Nome Completo'], data_nascimento=data_nasc_obj, cpf=cpf, rg=str(row['RG']) if pd.notna(row['RG']) else None,
-                        profissao=str(row['Profissão']) if pd.notna(row['Profissão']) else None, email=email, 
-                        ddd_pessoal=str(row['DDD Pessoal']) if pd.notna(row['DDD Pessoal']) else None, 
-                        telefone_pessoal=str(row['Telefone Pessoal']) if pd.notna(row['Telefone Pessoal']) else None, 
-                        estado_civil=EstadoCivil[row['Estado Civil'].upper().replace(" ", "_")] if pd.notna(row['Estado Civil']) else None
-                    )
-                    clientes_novos.append(novo_cliente)
-                if clientes_novos:
-                    db.session.add_all(clientes_novos)
-                    db.session.commit()
-                    flash(f'{len(clientes_novos)} novos clientes importados com sucesso!', 'success')
+                contagem = importar_clientes_csv(file, g.usuario.id)
+                if contagem['inseridos']:
+                    flash(f"{contagem['inseridos']} novos clientes importados com sucesso! ({contagem['ignorados']} já existentes ou repetidos, {contagem['rejeitados']} rejeitados por dados inválidos)", 'success')
                 else:
-                    flash('Nenhum cliente novo para importar (contatos já podem existir).', 'info')
+                    flash(f"Nenhum cliente novo para importar ({contagem['ignorados']} já existentes ou repetidos, {contagem['rejeitados']} rejeitados por dados inválidos).", 'info')
             except Exception as e:
+                db.session.rollback()
                 flash(f'Ocorreu um erro ao processar o arquivo. Verifique se os nomes das colunas estão corretos. Erro: {e}', 'danger')
             return redirect(url_for('lista_clientes'))
         else:
@@ -813,69 +1218,78 @@ def importar_clientes():
 
 # --- ROTAS DE API PÚBLICA E IA ---
 @app.route('/api/v1/empreendimentos')
+@limitar('api_publica')
 def api_empreendimentos():
-    empreendimentos_publicos = db.session.execute(db.select(Empreendimento).filter_by(publico=True).order_by(Empreendimento.nome)).scalars().all()
-    lista_para_json = []
-    for emp in empreendimentos_publicos:
-        lista_para_json.append({'id': emp.id, 'nome': emp.nome, 'endereco': emp.endereco, 'status': emp.status, 'descricao': emp.descricao})
-    return jsonify(lista_para_json)
+    # ?fields=id,nome,tipologias&pagina=2&por_pagina=50; servida do cache em memória (api_publica.py)
+    return api_publica.resposta()
+
+@app.route('/api/cache_ia')
+@login_required
+def estatisticas_cache_ia():
+    if not g.usuario.admin:
+        abort(403)
+    return jsonify(cache_ia.estatisticas())
+
+@app.route('/metrics')
+def metricas():
+    # Formato texto do Prometheus; acesso de Admin logado ou com "Authorization: Bearer <INSTRUMENTACAO_TOKEN>"
+    if not instrumentacao.ativa:
+        abort(404)
+    token = app.config['INSTRUMENTACAO_TOKEN']
+    autorizado_por_token = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    usuario = usuario_atual()
+    if not (usuario and usuario.admin) and not autorizado_por_token:
+        abort(403)
+    return Response(instrumentacao.formato_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/empreendimento/ler_pdf', methods=['POST'])
 @login_required
+@limitar('ler_pdf')
 def ler_pdf_empreendimento():
     files = request.files.getlist('documento')
     if not files or files[0].filename == '':
         flash('Nenhum documento enviado.', 'danger')
         return redirect(url_for('adicionar_empreendimento'))
-    texto_extraido_completo = ""
-    nomes_arquivos_salvos = []
+    arquivos_salvos = []
     for file in files:
         if file and file.filename.endswith('.pdf'):
             try:
-                nome_original = file.filename
-                nome_seguro = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{secure_filename(nome_original)}"
-                caminho_salvar = os.path.join(app.config['UPLOAD_FOLDER'], nome_seguro)
-                file.seek(0)
-                file.save(caminho_salvar)
-                nomes_arquivos_salvos.append(f"{nome_original}|{nome_seguro}")
                 file.seek(0)
-                with fitz.open(stream=file.read(), filetype="pdf") as doc:
-                    for page in doc:
-                        texto_extraido_completo += page.get_text() + "\n\n"
+                arquivo = armazenar_arquivo(file.stream, file.filename, app.config['UPLOAD_FOLDER'])
+                arquivos_salvos.append((file.filename, arquivo.nome_arquivo_servidor))
             except Exception as e:
                 flash(f"Erro ao processar o arquivo {file.filename}: {e}", "danger")
-    if not texto_extraido_completo.strip():
-        flash("Não foi possível extrair texto dos PDFs enviados (o PDF pode ser baseado em imagem).", "warning")
-        return render_template('empreendimento_form.html', dados_extraidos={}, arquivos_para_anexar=nomes_arquivos_salvos)
-    prompt = f"""Você é um robô assistente altamente preciso, especialista em extrair dados de documentos do mercado imobiliário para um CRM. Analise o texto abaixo e retorne as informações em um formato JSON. REGRAS RÍGIDAS: Sua resposta deve ser APENAS e EXCLUSIVAMENTE um objeto JSON válido. Se uma informação não for encontrada, o valor do campo no JSON deve ser uma string vazia "". Use este formato: {{"nome": "...", "status": "...", "endereco": "...", "descricao": "...", "previsao_entrega": "...", "valor_a_partir_de": "...", "tamanho_apartamentos_planta": "...", "vagas_garagem": "...", "quantidade_torres": 1, "subsolos": 2, "andares": 25, "campanha_promocional": "..."}} TEXTO DOS DOCUMENTOS: --- {texto_extraido_completo[:8000]} ---"""
-    dados_extraidos = {}
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        response = model.generate_content(prompt)
-        resposta_texto = response.text
-        inicio_json = resposta_texto.find('{')
-        fim_json = resposta_texto.rfind('}') + 1
-        if inicio_json != -1 and fim_json != 0:
-            json_limpo = resposta_texto[inicio_json:fim_json]
-            dados_extraidos = json.loads(json_limpo)
-            if 'project' in dados_extraidos: dados_extraidos = dados_extraidos['project']
-            flash("Documento analisado com IA! Por favor, revise os campos preenchidos.", "success")
-        else:
-            flash("A IA respondeu, mas não em um formato JSON válido. Tentando autocorreção...", "warning")
-            prompt_correcao = f"Sua resposta anterior não estava no formato JSON correto. Sua resposta foi: '{response.text}'. Por favor, corrija seu erro e forneça APENAS o objeto JSON válido baseado no documento original, sem nenhuma outra palavra ou explicação."
-            response_corrigida = model.generate_content(prompt_correcao)
-            resposta_texto_corrigido = response_corrigida.text
-            inicio_json_c = resposta_texto_corrigido.find('{')
-            fim_json_c = resposta_texto_corrigido.rfind('}') + 1
-            if inicio_json_c != -1 and fim_json_c != 0:
-                json_limpo_c = resposta_texto_corrigido[inicio_json_c:fim_json_c]
-                dados_extraidos = json.loads(json_limpo_c)
-                if 'project' in dados_extraidos: dados_extraidos = dados_extraidos['project']
-                flash("Autocorreção da IA bem-sucedida! Por favor, revise os campos.", "success")
-            else:
-                 flash(Markup(f"A autocorreção da IA também falhou. A resposta da IA foi: <pre>{escape(response_corrigida.text)}</pre>"), "danger")
-    except Exception as e:
-        print(f"Erro ao processar com a IA ou ao fazer o parse do JSON: {e}")
-        flash(f"A IA não conseguiu processar os documentos. Erro: {e}", "danger")
-        
-    return render_template('empreendimento_form.html', dados_extraidos=dados_extraidos, texto_original_para_salvar=texto_extraido_completo, arquivos_para_anexar=nomes_arquivos_salvos)
\ No newline at end of file
+    if not arquivos_salvos:
+        flash("Nenhum PDF válido foi enviado.", "warning")
+        return redirect(url_for('adicionar_empreendimento'))
+    tarefa = fila_leitura_pdf.enfileirar(g.usuario.id, arquivos_salvos)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'tarefa_id': tarefa.id, 'status_url': url_for('status_leitura_pdf', id=tarefa.id), 'resultado_url': url_for('resultado_leitura_pdf', id=tarefa.id)}), 202
+    return redirect(url_for('resultado_leitura_pdf', id=tarefa.id))
+
+def buscar_tarefa_leitura_pdf(id):
+    tarefa = db.get_or_404(TarefaLeituraPDF, id)
+    if not g.usuario.admin and tarefa.usuario_id != g.usuario.id:
+        abort(404)
+    return tarefa
+
+@app.route('/empreendimento/ler_pdf/<int:id>/status')
+@login_required
+def status_leitura_pdf(id):
+    tarefa = buscar_tarefa_leitura_pdf(id)
+    if tarefa.status not in (StatusTarefa.CONCLUIDA, StatusTarefa.ERRO) and fila_leitura_pdf.expirar_tarefas_abandonadas(tarefa.id):
+        db.session.refresh(tarefa)
+    finalizada = tarefa.status in (StatusTarefa.CONCLUIDA, StatusTarefa.ERRO)
+    return jsonify({'tarefa_id': tarefa.id, 'status': tarefa.status.name, 'finalizada': finalizada})
+
+@app.route('/empreendimento/ler_pdf/<int:id>')
+@login_required
+def resultado_leitura_pdf(id):
+    tarefa = buscar_tarefa_leitura_pdf(id)
+    arquivos_para_anexar = [f"{nome_original}|{nome_seguro}" for nome_original, nome_seguro in json.loads(tarefa.arquivos)]
+    if tarefa.status not in (StatusTarefa.CONCLUIDA, StatusTarefa.ERRO):
+        return render_template('empreendimento_form.html', dados_extraidos={}, tarefa_pendente=tarefa, arquivos_para_anexar=arquivos_para_anexar)
+    for categoria, mensagem in json.loads(tarefa.mensagens or '[]'):
+        flash(Markup(mensagem), categoria)
+    dados_extraidos = json.loads(tarefa.dados_extraidos or '{}')
+    return render_template('empreendimento_form.html', dados_extraidos=dados_extraidos, texto_original_para_salvar=tarefa.texto_extraido, arquivos_para_anexar=arquivos_para_anexar)
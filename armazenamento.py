@@ -0,0 +1,161 @@
+import os
+import hashlib
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.utils import secure_filename
+from models import db, ArquivoArmazenado, Material
+
+TAMANHO_BLOCO = 1024 * 1024
+
+
+def _nome_por_hash(hash_sha256, nome_original):
+    extensao = os.path.splitext(secure_filename(nome_original))[1].lower()
+    return f"{hash_sha256}{extensao}"
+
+
+def armazenar_arquivo(stream, nome_original, pasta_uploads):
+    # Grava o stream em disco calculando o SHA-256 ao mesmo tempo; se o conteúdo já existe, reaproveita o arquivo
+    hash_arquivo = hashlib.sha256()
+    tamanho = 0
+    descritor, caminho_temporario = tempfile.mkstemp(dir=pasta_uploads, prefix='.upload_')
+    try:
+        with os.fdopen(descritor, 'wb') as destino:
+            while True:
+                bloco = stream.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                hash_arquivo.update(bloco)
+                destino.write(bloco)
+                tamanho += len(bloco)
+        hash_sha256 = hash_arquivo.hexdigest()
+        arquivo = db.session.execute(db.select(ArquivoArmazenado).filter_by(hash_sha256=hash_sha256)).scalar_one_or_none()
+        if arquivo is None:
+            arquivo = ArquivoArmazenado(hash_sha256=hash_sha256, nome_arquivo_servidor=_nome_por_hash(hash_sha256, nome_original), tamanho=tamanho, referencias=0)
+            os.replace(caminho_temporario, os.path.join(pasta_uploads, arquivo.nome_arquivo_servidor))
+            try:
+                with db.session.begin_nested():
+                    db.session.add(arquivo)
+            except IntegrityError:
+                # Outro upload do mesmo conteúdo registrou o hash ao mesmo tempo; o arquivo em disco é idêntico
+                nome_perdedor = arquivo.nome_arquivo_servidor
+                arquivo = db.session.execute(db.select(ArquivoArmazenado).filter_by(hash_sha256=hash_sha256)).scalar_one()
+                if arquivo.nome_arquivo_servidor != nome_perdedor:
+                    os.remove(os.path.join(pasta_uploads, nome_perdedor))
+        elif not os.path.exists(os.path.join(pasta_uploads, arquivo.nome_arquivo_servidor)):
+            # O registro existe mas o arquivo físico sumiu: restaura a partir deste upload
+            os.replace(caminho_temporario, os.path.join(pasta_uploads, arquivo.nome_arquivo_servidor))
+    finally:
+        if os.path.exists(caminho_temporario):
+            os.remove(caminho_temporario)
+    return arquivo
+
+
+class ArquivoRemovido(Exception):
+    pass
+
+
+def _ajustar_referencias(arquivo, delta):
+    # UPDATE atômico no banco (dois workers anexando/removendo ao mesmo tempo não perdem incrementos);
+    # devolve a nova contagem, ou None se o registro foi apagado por outra requisição
+    referencias = db.session.execute(update(ArquivoArmazenado).where(ArquivoArmazenado.id == arquivo.id)
+                                     .values(referencias=ArquivoArmazenado.referencias + delta)
+                                     .returning(ArquivoArmazenado.referencias)
+                                     .execution_options(synchronize_session=False)).scalar_one_or_none()
+    if referencias is not None:
+        set_committed_value(arquivo, 'referencias', referencias)
+    return referencias
+
+
+def _apagar_se_sem_referencias(arquivo, pasta_uploads):
+    # Só apaga se ninguém anexou o arquivo entre a leitura da contagem e o DELETE
+    resultado = db.session.execute(delete(ArquivoArmazenado).where(ArquivoArmazenado.id == arquivo.id, ArquivoArmazenado.referencias <= 0)
+                                   .execution_options(synchronize_session=False))
+    if resultado.rowcount:
+        db.session.expunge(arquivo)
+        caminho_arquivo = os.path.join(pasta_uploads, arquivo.nome_arquivo_servidor)
+        if os.path.exists(caminho_arquivo):
+            os.remove(caminho_arquivo)
+    return bool(resultado.rowcount)
+
+
+def criar_material(arquivo, nome_original, empreendimento_id):
+    if _ajustar_referencias(arquivo, 1) is None:
+        raise ArquivoRemovido(arquivo.nome_arquivo_servidor)
+    material = Material(nome_original=nome_original, nome_arquivo_servidor=arquivo.nome_arquivo_servidor, arquivo=arquivo, empreendimento_id=empreendimento_id)
+    db.session.add(material)
+    return material
+
+
+def salvar_upload_como_material(file, empreendimento_id, pasta_uploads):
+    arquivo = armazenar_arquivo(file.stream, file.filename, pasta_uploads)
+    try:
+        return criar_material(arquivo, file.filename, empreendimento_id)
+    except ArquivoRemovido:
+        # O último material com o mesmo conteúdo foi removido no meio do caminho: grava o upload de novo
+        file.stream.seek(0)
+        return criar_material(armazenar_arquivo(file.stream, file.filename, pasta_uploads), file.filename, empreendimento_id)
+
+
+def anexar_arquivo_existente(nome_original, nome_arquivo_servidor, empreendimento_id):
+    # Usado para os PDFs já enviados em ler_pdf_empreendimento, que ficam armazenados sem referência até o formulário ser salvo
+    arquivo = db.session.execute(db.select(ArquivoArmazenado).filter_by(nome_arquivo_servidor=nome_arquivo_servidor)).scalar_one_or_none()
+    if arquivo is None:
+        return None
+    try:
+        return criar_material(arquivo, nome_original, empreendimento_id)
+    except ArquivoRemovido:
+        return None
+
+
+def liberar_material(material, pasta_uploads):
+    # Decrementa a contagem de referências e só apaga o arquivo físico quando ninguém mais aponta para ele.
+    # Materiais antigos (sem ArquivoArmazenado) continuam com um arquivo exclusivo.
+    arquivo = material.arquivo
+    if arquivo is None:
+        caminho_arquivo = os.path.join(pasta_uploads, material.nome_arquivo_servidor)
+        if os.path.exists(caminho_arquivo):
+            os.remove(caminho_arquivo)
+        return
+    material.arquivo = None
+    referencias = _ajustar_referencias(arquivo, -1)
+    if referencias is not None and referencias <= 0:
+        _apagar_se_sem_referencias(arquivo, pasta_uploads)
+
+
+def limpar_arquivos_sem_referencia(pasta_uploads, horas):
+    # PDFs enviados em ler_pdf_empreendimento ficam com referencias=0 até o formulário ser salvo; os que
+    # ninguém anexou depois de algumas horas são apagados do disco e do banco
+    limite = datetime.utcnow() - timedelta(hours=horas)
+    arquivos = db.session.execute(db.select(ArquivoArmazenado).filter(ArquivoArmazenado.referencias <= 0, ArquivoArmazenado.data_criacao < limite)).scalars().all()
+    removidos, bytes_liberados = 0, 0
+    for arquivo in arquivos:
+        tamanho = arquivo.tamanho
+        if _apagar_se_sem_referencias(arquivo, pasta_uploads):
+            removidos += 1
+            bytes_liberados += tamanho
+    db.session.commit()
+    return removidos, bytes_liberados
+
+
+def deduplicar_materiais_existentes(pasta_uploads):
+    # Migra os materiais com nome por timestamp para o armazenamento por hash, removendo as cópias repetidas
+    materiais = db.session.execute(db.select(Material).filter(Material.arquivo_id.is_(None))).scalars().all()
+    migrados, bytes_liberados = 0, 0
+    for material in materiais:
+        caminho_antigo = os.path.join(pasta_uploads, material.nome_arquivo_servidor)
+        if not os.path.exists(caminho_antigo):
+            continue
+        tamanho_antigo = os.path.getsize(caminho_antigo)
+        with open(caminho_antigo, 'rb') as stream:
+            arquivo = armazenar_arquivo(stream, material.nome_original, pasta_uploads)
+        if _ajustar_referencias(arquivo, 1) > 1:
+            bytes_liberados += tamanho_antigo
+        material.arquivo = arquivo
+        material.nome_arquivo_servidor = arquivo.nome_arquivo_servidor
+        os.remove(caminho_antigo)
+        migrados += 1
+    db.session.commit()
+    return migrados, bytes_liberados
@@ -0,0 +1,164 @@
+import re
+import unicodedata
+from sqlalchemy import event, text, DDL, Integer, Float, select, inspect
+from sqlalchemy.orm import Session
+from models import Cliente
+
+# Índice de busca de clientes. No SQLite é uma tabela virtual FTS5 (rowid = cliente.id); no Postgres é uma
+# tabela comum com tsvector (GIN) + trigramas (pg_trgm) para tolerar erros de digitação.
+# Os textos são gravados já sem acentos e em minúsculas, então "Joao" encontra "João" nos dois bancos.
+# Clientes descartados saem do índice e voltam quando restaurados.
+
+CAMPOS_INDEXADOS = (
+    'nome_completo', 'email', 'email_comercial', 'cpf', 'observacoes', 'descartado',
+    'ddd_pessoal', 'telefone_pessoal', 'ddd_pessoal_2', 'telefone_pessoal_2',
+    'ddd_residencial', 'telefone_residencial', 'ddd_comercial', 'telefone_comercial',
+)
+TELEFONES = (('ddd_pessoal', 'telefone_pessoal'), ('ddd_pessoal_2', 'telefone_pessoal_2'),
+             ('ddd_residencial', 'telefone_residencial'), ('ddd_comercial', 'telefone_comercial'))
+
+DDL_SQLITE = "CREATE VIRTUAL TABLE IF NOT EXISTS cliente_busca USING fts5(nome, contatos, observacoes, tokenize='unicode61 remove_diacritics 2')"
+DDL_POSTGRES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE TABLE IF NOT EXISTS cliente_busca (cliente_id INTEGER PRIMARY KEY REFERENCES cliente (id) ON DELETE CASCADE, texto TEXT NOT NULL, documento TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_cliente_busca_documento ON cliente_busca USING GIN (documento)",
+    "CREATE INDEX IF NOT EXISTS ix_cliente_busca_texto_trgm ON cliente_busca USING GIN (texto gin_trgm_ops)",
+]
+
+
+def normalizar_texto(valor):
+    if not valor:
+        return ''
+    sem_acentos = unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode('ascii')
+    return sem_acentos.lower().strip()
+
+
+def _digitos(valor):
+    return re.sub(r'\D', '', valor or '')
+
+
+def montar_documento(dados):
+    # dados: objeto ou linha com os CAMPOS_INDEXADOS; devolve (nome, contatos, observacoes)
+    contatos = [normalizar_texto(dados.email), normalizar_texto(dados.email_comercial), _digitos(dados.cpf)]
+    for campo_ddd, campo_telefone in TELEFONES:
+        telefone = _digitos(getattr(dados, campo_telefone))
+        if telefone:
+            contatos.append(_digitos(getattr(dados, campo_ddd)) + telefone)
+            contatos.append(telefone)
+    return normalizar_texto(dados.nome_completo), ' '.join(contato for contato in contatos if contato), normalizar_texto(dados.observacoes)
+
+
+# CPF e telefones ficam no índice só com dígitos; na busca, "123.456.789-00" ou "(11) 98765-4321" viram um termo só
+PADRAO_NUMERICO = re.compile(r'[\d\s().\-/+]*\d[\d\s().\-/+]*')
+
+
+def _termos(termo_busca):
+    texto = normalizar_texto(termo_busca)
+    if PADRAO_NUMERICO.fullmatch(texto):
+        return [_digitos(texto)]
+    termos = []
+    for trecho in texto.split():
+        if PADRAO_NUMERICO.fullmatch(trecho):
+            termos.append(_digitos(trecho))
+        else:
+            termos += re.findall(r'\w+', trecho)
+    return termos
+
+
+def atualizar_indice(conexao, clientes):
+    # clientes: objetos/linhas com id e os CAMPOS_INDEXADOS. Descartados são apenas removidos.
+    clientes = list(clientes)
+    if not clientes:
+        return
+    ids = [{'id': cliente.id} for cliente in clientes]
+    documentos = []
+    for cliente in clientes:
+        if not cliente.descartado:
+            nome, contatos, observacoes = montar_documento(cliente)
+            documentos.append({'id': cliente.id, 'nome': nome, 'contatos': contatos, 'observacoes': observacoes})
+    if conexao.dialect.name == 'postgresql':
+        conexao.execute(text("DELETE FROM cliente_busca WHERE cliente_id = :id"), ids)
+        if documentos:
+            conexao.execute(text(
+                "INSERT INTO cliente_busca (cliente_id, texto, documento) VALUES (:id, concat_ws(' ', :nome, :contatos, :observacoes), "
+                "setweight(to_tsvector('simple', :nome), 'A') || setweight(to_tsvector('simple', :contatos), 'B') || setweight(to_tsvector('simple', :observacoes), 'C'))"),
+                documentos)
+    else:
+        conexao.execute(text("DELETE FROM cliente_busca WHERE rowid = :id"), ids)
+        if documentos:
+            conexao.execute(text("INSERT INTO cliente_busca (rowid, nome, contatos, observacoes) VALUES (:id, :nome, :contatos, :observacoes)"), documentos)
+
+
+def remover_do_indice(conexao, ids_clientes):
+    if not ids_clientes:
+        return
+    coluna = 'cliente_id' if conexao.dialect.name == 'postgresql' else 'rowid'
+    conexao.execute(text(f"DELETE FROM cliente_busca WHERE {coluna} = :id"), [{'id': id_cliente} for id_cliente in ids_clientes])
+
+
+def indexar_clientes_por_id(conexao, ids_clientes, tamanho_lote=1000):
+    # Usado pelas operações em massa (INSERT/UPDATE direto), que não passam pelos eventos do ORM
+    colunas = [Cliente.id] + [getattr(Cliente, campo) for campo in CAMPOS_INDEXADOS]
+    ids_clientes = list(ids_clientes)
+    for inicio in range(0, len(ids_clientes), tamanho_lote):
+        lote = ids_clientes[inicio:inicio + tamanho_lote]
+        atualizar_indice(conexao, conexao.execute(select(*colunas).where(Cliente.id.in_(lote))).all())
+
+
+def reindexar_todos(conexao, tamanho_lote=1000):
+    conexao.execute(text("DELETE FROM cliente_busca"))
+    colunas = [Cliente.id] + [getattr(Cliente, campo) for campo in CAMPOS_INDEXADOS]
+    total = 0
+    resultado = conexao.execution_options(yield_per=tamanho_lote).execute(select(*colunas).where(Cliente.descartado == False))
+    for linhas in resultado.partitions():
+        atualizar_indice(conexao, linhas)
+        total += len(linhas)
+    return total
+
+
+def criar_estrutura(conexao):
+    if conexao.dialect.name == 'postgresql':
+        for comando in DDL_POSTGRES:
+            conexao.execute(text(comando))
+    else:
+        conexao.execute(text(DDL_SQLITE))
+
+
+def subconsulta_busca(termo_busca, dialeto):
+    # Subconsulta (id, ordem) com os clientes que casam com o termo; ordem menor = mais relevante
+    termos = _termos(termo_busca)
+    if not termos:
+        return None
+    if dialeto == 'postgresql':
+        consulta = text(
+            "SELECT cliente_id AS id, -(ts_rank(documento, to_tsquery('simple', :consulta)) + word_similarity(:termo, texto)) AS ordem "
+            "FROM cliente_busca WHERE documento @@ to_tsquery('simple', :consulta) OR :termo <% texto"
+        ).bindparams(consulta=' & '.join(f"{termo}:*" for termo in termos), termo=' '.join(termos))
+    else:
+        consulta = text(
+            "SELECT rowid AS id, bm25(cliente_busca, 10.0, 5.0, 1.0) AS ordem FROM cliente_busca WHERE cliente_busca MATCH :consulta"
+        ).bindparams(consulta=' '.join(f'"{termo}"*' for termo in termos))
+    return consulta.columns(id=Integer, ordem=Float).subquery('busca')
+
+
+# --- Manutenção incremental via eventos do ORM ---
+def _campos_alterados(cliente):
+    estado = inspect(cliente)
+    return any(estado.attrs[campo].history.has_changes() for campo in CAMPOS_INDEXADOS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _atualizar_indice_apos_flush(session, contexto_flush):
+    novos_ou_alterados = [objeto for objeto in session.new if isinstance(objeto, Cliente)]
+    novos_ou_alterados += [objeto for objeto in session.dirty if isinstance(objeto, Cliente) and _campos_alterados(objeto)]
+    removidos = [objeto.id for objeto in session.deleted if isinstance(objeto, Cliente)]
+    if novos_ou_alterados or removidos:
+        conexao = session.connection()
+        atualizar_indice(conexao, novos_ou_alterados)
+        remover_do_indice(conexao, removidos)
+
+
+event.listen(Cliente.__table__, 'after_create', DDL(DDL_SQLITE).execute_if(dialect='sqlite'))
+for _comando in DDL_POSTGRES:
+    event.listen(Cliente.__table__, 'after_create', DDL(_comando).execute_if(dialect='postgresql'))
+event.listen(Cliente.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS cliente_busca"))
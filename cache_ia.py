@@ -0,0 +1,158 @@
+import os
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+import google.generativeai as genai
+from flask import current_app
+from instrumentacao import medir_chamada_externa
+from coalescencia import coalescedor
+
+MODELO_PADRAO = 'gemini-1.5-flash-latest'
+
+
+def _criar_modelo(nome_modelo):
+    return genai.GenerativeModel(nome_modelo)
+
+
+def _chamar_modelo(nome_modelo, prompt):
+    with medir_chamada_externa('gemini'):
+        return _criar_modelo(nome_modelo).generate_content(prompt).text
+
+
+def _chamar_modelo_em_partes(nome_modelo, prompt):
+    # Mesma chamada com stream=True: devolve os pedaços do texto conforme o Gemini os gera
+    with medir_chamada_externa('gemini'):
+        for parte in _criar_modelo(nome_modelo).generate_content(prompt, stream=True):
+            if parte.text:
+                yield parte.text
+
+
+class CacheRespostasIA:
+    # Cache em disco (SQLite próprio, independente do banco do CRM) das respostas do Gemini, indexado pelo hash
+    # do modelo + prompt. Sobrevive a reinícios e é compartilhado entre os workers do gunicorn.
+    # Cada entrada leva etiquetas (ex.: 'cliente:12', 'catalogo') para ser invalidada quando os dados mudam.
+    def __init__(self, app=None):
+        self.caminho = None
+        self.ttl = None
+        self.max_itens = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_IA_CAMINHO', os.path.join(app.instance_path, 'cache_ia.sqlite3'))
+        app.config.setdefault('CACHE_IA_TTL', 24 * 60 * 60)
+        app.config.setdefault('CACHE_IA_MAX_ITENS', 1000)
+        self.caminho = app.config['CACHE_IA_CAMINHO']
+        self.ttl = app.config['CACHE_IA_TTL']
+        self.max_itens = app.config['CACHE_IA_MAX_ITENS']
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("CREATE TABLE IF NOT EXISTS resposta (chave TEXT PRIMARY KEY, texto TEXT NOT NULL, criado_em REAL NOT NULL, acessado_em REAL NOT NULL)")
+            conexao.execute("CREATE INDEX IF NOT EXISTS ix_resposta_acessado_em ON resposta (acessado_em)")
+            conexao.execute("CREATE TABLE IF NOT EXISTS etiqueta (chave TEXT NOT NULL, etiqueta TEXT NOT NULL, PRIMARY KEY (etiqueta, chave))")
+            conexao.execute("CREATE TABLE IF NOT EXISTS contador (nome TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+            conexao.executemany("INSERT OR IGNORE INTO contador (nome, valor) VALUES (?, 0)", [('acertos',), ('falhas',), ('invalidacoes',)])
+        app.extensions['cache_ia'] = self
+
+    @contextmanager
+    def _conectar(self):
+        conexao = sqlite3.connect(self.caminho, timeout=5)
+        try:
+            with conexao:
+                yield conexao
+        finally:
+            conexao.close()
+
+    @staticmethod
+    def calcular_chave(nome_modelo, prompt):
+        return hashlib.sha256(f"{nome_modelo}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def buscar(self, chave):
+        agora = time.time()
+        with self._conectar() as conexao:
+            linha = conexao.execute("SELECT texto, criado_em FROM resposta WHERE chave = ?", (chave,)).fetchone()
+            if linha is None or agora - linha[1] > self.ttl:
+                if linha is not None:
+                    conexao.execute("DELETE FROM resposta WHERE chave = ?", (chave,))
+                    conexao.execute("DELETE FROM etiqueta WHERE chave = ?", (chave,))
+                conexao.execute("UPDATE contador SET valor = valor + 1 WHERE nome = 'falhas'")
+                return None
+            conexao.execute("UPDATE resposta SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            conexao.execute("UPDATE contador SET valor = valor + 1 WHERE nome = 'acertos'")
+            return linha[0]
+
+    def guardar(self, chave, texto, etiquetas=()):
+        agora = time.time()
+        with self._conectar() as conexao:
+            conexao.execute("INSERT OR REPLACE INTO resposta (chave, texto, criado_em, acessado_em) VALUES (?, ?, ?, ?)", (chave, texto, agora, agora))
+            conexao.executemany("INSERT OR IGNORE INTO etiqueta (chave, etiqueta) VALUES (?, ?)", [(chave, etiqueta) for etiqueta in etiquetas])
+            # Remove as entradas usadas há mais tempo quando passa do limite (LRU)
+            excedentes = conexao.execute("SELECT chave FROM resposta ORDER BY acessado_em DESC LIMIT -1 OFFSET ?", (self.max_itens,)).fetchall()
+            if excedentes:
+                conexao.executemany("DELETE FROM resposta WHERE chave = ?", excedentes)
+                conexao.executemany("DELETE FROM etiqueta WHERE chave = ?", excedentes)
+
+    def invalidar(self, etiqueta):
+        with self._conectar() as conexao:
+            chaves = conexao.execute("SELECT chave FROM etiqueta WHERE etiqueta = ?", (etiqueta,)).fetchall()
+            conexao.executemany("DELETE FROM resposta WHERE chave = ?", chaves)
+            conexao.executemany("DELETE FROM etiqueta WHERE chave = ?", chaves)
+            conexao.execute("UPDATE contador SET valor = valor + ? WHERE nome = 'invalidacoes'", (len(chaves),))
+        return len(chaves)
+
+    def estatisticas(self):
+        with self._conectar() as conexao:
+            dados = dict(conexao.execute("SELECT nome, valor FROM contador").fetchall())
+            dados['itens'] = conexao.execute("SELECT COUNT(*) FROM resposta").fetchone()[0]
+        total = dados['acertos'] + dados['falhas']
+        dados['taxa_acerto'] = round(dados['acertos'] / total, 4) if total else 0.0
+        return dados
+
+    def gerar(self, prompt, etiquetas=(), nome_modelo=MODELO_PADRAO):
+        chave = self.calcular_chave(nome_modelo, prompt)
+        texto = self.buscar(chave)
+        if texto is None:
+            # Pedidos idênticos simultâneos (ex.: clique duplo) esperam a mesma chamada ao modelo
+            texto = coalescedor.executar(('cache_ia', chave), lambda: self._gerar_e_guardar(chave, nome_modelo, prompt, etiquetas))
+        return texto
+
+    def _gerar_e_guardar(self, chave, nome_modelo, prompt, etiquetas):
+        texto = _chamar_modelo(nome_modelo, prompt)
+        self.guardar(chave, texto, etiquetas)
+        return texto
+
+    def gerar_em_partes(self, prompt, etiquetas=(), nome_modelo=MODELO_PADRAO):
+        # Acerto no cache sai de uma vez; senão repassa os pedaços do modelo e só grava a resposta completa
+        chave = self.calcular_chave(nome_modelo, prompt)
+        texto = self.buscar(chave)
+        if texto is not None:
+            yield texto
+            return
+        partes = []
+        for parte in _chamar_modelo_em_partes(nome_modelo, prompt):
+            partes.append(parte)
+            yield parte
+        self.guardar(chave, ''.join(partes), etiquetas)
+
+
+def gerar_resposta_ia(prompt, etiquetas=(), nome_modelo=MODELO_PADRAO):
+    cache = current_app.extensions.get('cache_ia')
+    if cache is None:
+        return _chamar_modelo(nome_modelo, prompt)
+    return cache.gerar(prompt, etiquetas, nome_modelo)
+
+
+def gerar_resposta_ia_em_partes(prompt, etiquetas=(), nome_modelo=MODELO_PADRAO):
+    # O cache é resolvido aqui, dentro da requisição; o gerador devolvido pode ser consumido depois que ela termina
+    cache = current_app.extensions.get('cache_ia')
+    if cache is None:
+        return _chamar_modelo_em_partes(nome_modelo, prompt)
+    return cache.gerar_em_partes(prompt, etiquetas, nome_modelo)
+
+
+def invalidar_cache_ia(etiqueta):
+    cache = current_app.extensions.get('cache_ia')
+    if cache is not None:
+        cache.invalidar(etiqueta)
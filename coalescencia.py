@@ -0,0 +1,44 @@
+import threading
+
+# Coalescência de chamadas idênticas ("single flight"): enquanto uma thread calcula o resultado de uma chave, as
+# outras que pedem a mesma chave esperam e recebem o mesmo resultado (ou a mesma exceção), em vez de repetir a
+# consulta ao banco ou a chamada ao Gemini. Vale dentro de um processo; entre workers, o cache_ia evita a repetição
+# depois que a primeira resposta fica pronta.
+
+
+class _Chamada:
+    def __init__(self):
+        self.concluida = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class Coalescedor:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._em_andamento = {}
+
+    def executar(self, chave, funcao):
+        with self._trava:
+            chamada = self._em_andamento.get(chave)
+            lider = chamada is None
+            if lider:
+                chamada = self._em_andamento[chave] = _Chamada()
+        if not lider:
+            chamada.concluida.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado
+        try:
+            chamada.resultado = funcao()
+            return chamada.resultado
+        except Exception as e:
+            chamada.erro = e
+            raise
+        finally:
+            with self._trava:
+                del self._em_andamento[chave]
+            chamada.concluida.set()
+
+
+coalescedor = Coalescedor()
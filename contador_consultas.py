@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Contagem de comandos SQL por requisição. Um único listener global grava nos contadores ativos do contexto atual
+# (ContextVar), então requisições simultâneas em outras threads não se misturam e contadores aninhados somam juntos.
+_contadores_ativos = ContextVar('contadores_consultas', default=())
+
+
+class OrcamentoConsultasExcedido(AssertionError):
+    pass
+
+
+class ContadorConsultas:
+    def __init__(self):
+        self.comandos = []
+
+    @property
+    def total(self):
+        return len(self.comandos)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _registrar_comando(conexao, cursor, comando, parametros, contexto, executemany):
+    for contador in _contadores_ativos.get():
+        contador.comandos.append(comando)
+
+
+@contextmanager
+def contar_consultas():
+    contador = ContadorConsultas()
+    token = _contadores_ativos.set(_contadores_ativos.get() + (contador,))
+    try:
+        yield contador
+    finally:
+        _contadores_ativos.reset(token)
+
+
+def orcamento_consultas(limite):
+    # Limita quantas consultas uma rota (incluindo a renderização do template) pode executar.
+    # Com TESTING ou ORCAMENTO_CONSULTAS_ESTRITO a requisição falha ao estourar; em produção só registra um aviso.
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with contar_consultas() as contador:
+                resposta = f(*args, **kwargs)
+            if contador.total > limite:
+                mensagem = f"{f.__name__} executou {contador.total} consultas (orçamento: {limite})"
+                if current_app.testing or current_app.config.get('ORCAMENTO_CONSULTAS_ESTRITO'):
+                    raise OrcamentoConsultasExcedido(mensagem + ':\n' + '\n'.join(contador.comandos))
+                current_app.logger.warning(mensagem)
+            return resposta
+        return decorated_function
+    return decorator
@@ -0,0 +1,92 @@
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from flask import g, session
+from sqlalchemy import select
+from models import db, Usuario, PerfilUsuario
+from versoes_dados import versionar, ao_confirmar_versoes
+
+# Contexto do usuário logado, recarregado do banco a cada requisição em vez de confiar no perfil gravado no cookie.
+# As linhas de Usuario ficam num cache LRU em memória por USUARIOS_CACHE_TTL segundos, então a verificação custa
+# zero consultas na maior parte das requisições. O worker que altera um usuário descarta a entrada logo após o
+# commit; os demais veem a mudança (perfil, desativação) em no máximo USUARIOS_CACHE_TTL segundos.
+
+MAXIMO_USUARIOS_EM_CACHE = 1024
+
+
+class UsuarioAtual(namedtuple('UsuarioAtual', 'id nome perfil ativo')):
+    __slots__ = ()
+
+    @property
+    def admin(self):
+        return self.perfil == PerfilUsuario.ADMIN
+
+
+class CacheUsuarios:
+    def __init__(self, app=None):
+        self._trava = threading.Lock()
+        self._usuarios = OrderedDict()
+        self.ttl = 30
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USUARIOS_CACHE_TTL', 30)
+        self.ttl = app.config['USUARIOS_CACHE_TTL']
+        app.extensions['cache_usuarios'] = self
+        ao_confirmar_versoes(self._apos_commit)
+
+        @app.before_request
+        def _descartar_usuario_anterior():
+            # Com um app context já ativo (CLI, testes, benchmark) o g sobrevive entre requisições
+            g.pop('usuario', None)
+
+        @app.context_processor
+        def _injetar_usuario_atual():
+            return {'usuario_atual': usuario_atual()}
+
+    def _apos_commit(self, chaves):
+        for chave in chaves:
+            if chave.startswith('usuario:'):
+                self.invalidar(int(chave.split(':', 1)[1]))
+
+    def invalidar(self, usuario_id=None):
+        with self._trava:
+            if usuario_id is None:
+                self._usuarios.clear()
+            else:
+                self._usuarios.pop(usuario_id, None)
+
+    def obter(self, usuario_id):
+        # UsuarioAtual ou None se o usuário não existe mais
+        agora = time.monotonic()
+        with self._trava:
+            entrada = self._usuarios.get(usuario_id)
+            if entrada is not None and agora - entrada[1] < self.ttl:
+                self._usuarios.move_to_end(usuario_id)
+                return entrada[0]
+        linha = db.session.execute(select(Usuario.id, Usuario.nome, Usuario.perfil, Usuario.ativo).filter_by(id=usuario_id)).first()
+        usuario = UsuarioAtual(*linha) if linha else None
+        with self._trava:
+            self._usuarios[usuario_id] = (usuario, agora)
+            self._usuarios.move_to_end(usuario_id)
+            while len(self._usuarios) > MAXIMO_USUARIOS_EM_CACHE:
+                self._usuarios.popitem(last=False)
+        return usuario
+
+
+cache_usuarios = CacheUsuarios()
+
+
+def usuario_atual():
+    # Usuário da sessão, carregado uma vez por requisição; None sem login ou se a conta foi removida ou desativada
+    if 'usuario' not in g:
+        usuario_id = session.get('usuario_id')
+        usuario = cache_usuarios.obter(usuario_id) if usuario_id else None
+        g.usuario = usuario if usuario is not None and usuario.ativo else None
+    return g.usuario
+
+
+@versionar(Usuario)
+def _chaves_usuario(usuario):
+    return {f'usuario:{usuario.id}'}
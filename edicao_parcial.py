@@ -0,0 +1,55 @@
+from models import db, Tipologia
+
+# Edição parcial dos formulários: compara os valores enviados com a entidade carregada e só atribui o que mudou,
+# para o UPDATE levar apenas essas colunas e um "Salvar" sem alterações não escrever nada (nem disparar os eventos
+# de índice de busca, estatísticas e versões). Campo vazio no formulário e NULL no banco contam como iguais.
+
+CAMPOS_TIPOLOGIA = ('metragem', 'suites', 'vagas')
+
+
+def _iguais(atual, novo):
+    return atual == novo or (atual in ('', None) and novo in ('', None))
+
+
+def aplicar_alteracoes(objeto, valores):
+    # Devolve os nomes das colunas alteradas
+    alterados = []
+    for campo, valor in valores.items():
+        if not _iguais(getattr(objeto, campo), valor):
+            setattr(objeto, campo, valor)
+            alterados.append(campo)
+    return alterados
+
+
+def reconciliar_tipologias(empreendimento, linhas):
+    # linhas: [{'id': id ou None, 'metragem': ..., 'suites': ..., 'vagas': ...}] na ordem do formulário.
+    # Linhas com id atualizam a tipologia correspondente; sem id, reaproveitam uma tipologia ainda não usada com a
+    # mesma metragem (formulários antigos, sem o campo) e só então viram INSERT; as que sobram são removidas.
+    existentes = {tipologia.id: tipologia for tipologia in empreendimento.tipologias}
+    contagem = {'inseridas': 0, 'alteradas': 0, 'removidas': 0, 'colunas': 0}
+    usadas = set()
+    pendentes = []
+    for linha in linhas:
+        tipologia = existentes.get(linha['id'])
+        if tipologia is None or tipologia.id in usadas:
+            pendentes.append(linha)
+            continue
+        usadas.add(tipologia.id)
+        alterados = aplicar_alteracoes(tipologia, {campo: linha[campo] for campo in CAMPOS_TIPOLOGIA})
+        contagem['alteradas'] += bool(alterados)
+        contagem['colunas'] += len(alterados)
+    for linha in pendentes:
+        tipologia = next((tipologia for tipologia in existentes.values() if tipologia.id not in usadas and tipologia.metragem == linha['metragem']), None)
+        if tipologia is not None:
+            usadas.add(tipologia.id)
+            alterados = aplicar_alteracoes(tipologia, {campo: linha[campo] for campo in CAMPOS_TIPOLOGIA})
+            contagem['alteradas'] += bool(alterados)
+            contagem['colunas'] += len(alterados)
+        else:
+            db.session.add(Tipologia(empreendimento_id=empreendimento.id, **{campo: linha[campo] for campo in CAMPOS_TIPOLOGIA}))
+            contagem['inseridas'] += 1
+    for tipologia in existentes.values():
+        if tipologia.id not in usadas:
+            db.session.delete(tipologia)
+            contagem['removidas'] += 1
+    return contagem
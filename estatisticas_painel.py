@@ -0,0 +1,95 @@
+from collections import defaultdict
+from sqlalchemy import event, select, update, insert, delete, func, inspect
+from sqlalchemy.orm import Session
+from models import Cliente, Empreendimento, EstatisticaPainel
+
+# Mantém a tabela estatistica_painel em dia a cada flush: cada cliente "contribui" com +1 nos contadores da linha
+# do seu proprietário e da linha geral (proprietario_id = 0). Uma alteração desfaz a contribuição antiga e aplica a nova.
+# Operações em massa (INSERT/UPDATE direto) não passam pelos eventos e devem chamar ajustar_estatisticas_por_id.
+
+ESCOPO_GERAL = 0
+CAMPOS_CONTABILIZADOS = ('proprietario_id', 'descartado', 'status', 'temperatura')
+TABELA = EstatisticaPainel.__table__
+
+
+def _contribuicao(deltas, proprietario_id, descartado, status, temperatura, quantidade=1):
+    if descartado:
+        colunas = ['clientes_descartados']
+    else:
+        colunas = ['clientes_ativos', f"temperatura_{temperatura.name.lower() if temperatura else 'nao_informada'}"]
+        if status:
+            colunas.append(f"status_{status.name.lower()}")
+    escopos = [ESCOPO_GERAL] + ([int(proprietario_id)] if proprietario_id else [])
+    for escopo in escopos:
+        for coluna in colunas:
+            deltas[escopo][coluna] += quantidade
+
+
+def _aplicar(conexao, deltas):
+    for escopo, colunas in deltas.items():
+        valores = {coluna: delta for coluna, delta in colunas.items() if delta}
+        if not valores:
+            continue
+        resultado = conexao.execute(update(TABELA).where(TABELA.c.proprietario_id == escopo).values({TABELA.c[coluna]: TABELA.c[coluna] + delta for coluna, delta in valores.items()}))
+        if resultado.rowcount == 0:
+            conexao.execute(insert(TABELA).values(proprietario_id=escopo, **valores))
+
+
+def _novos_deltas():
+    return defaultdict(lambda: defaultdict(int))
+
+
+def _valor_anterior(estado, campo):
+    historico = estado.attrs[campo].history
+    if historico.deleted:
+        return historico.deleted[0]
+    return historico.unchanged[0] if historico.unchanged else None
+
+
+def ajustar_estatisticas_por_id(conexao, ids_clientes, sinal=1):
+    # sinal=1 depois de inserir/alterar em massa; sinal=-1 antes de alterar/apagar em massa
+    deltas = _novos_deltas()
+    colunas = [getattr(Cliente, campo) for campo in CAMPOS_CONTABILIZADOS]
+    ids_clientes = list(ids_clientes)
+    for inicio in range(0, len(ids_clientes), 1000):
+        # Agrupado no banco: uma linha por combinação de proprietário/status/temperatura, não por cliente
+        for *valores, quantidade in conexao.execute(select(*colunas, func.count()).where(Cliente.id.in_(ids_clientes[inicio:inicio + 1000])).group_by(*colunas)):
+            _contribuicao(deltas, *valores, quantidade=sinal * quantidade)
+    _aplicar(conexao, deltas)
+
+
+def reconstruir_estatisticas(conexao):
+    # Recalcula tudo a partir das tabelas (correção de divergências)
+    deltas = _novos_deltas()
+    colunas = [getattr(Cliente, campo) for campo in CAMPOS_CONTABILIZADOS]
+    for linha in conexao.execute(select(*colunas, func.count()).group_by(*colunas)):
+        _contribuicao(deltas, *linha)
+    deltas[ESCOPO_GERAL]['total_empreendimentos'] = conexao.execute(select(func.count(Empreendimento.id))).scalar_one()
+    conexao.execute(delete(TABELA))
+    for escopo, valores in deltas.items():
+        conexao.execute(insert(TABELA).values(proprietario_id=escopo, **valores))
+    return len(deltas)
+
+
+@event.listens_for(Session, 'after_flush')
+def _atualizar_estatisticas_apos_flush(session, contexto_flush):
+    deltas = _novos_deltas()
+    for objeto in session.new:
+        if isinstance(objeto, Cliente):
+            _contribuicao(deltas, *(getattr(objeto, campo) for campo in CAMPOS_CONTABILIZADOS))
+        elif isinstance(objeto, Empreendimento):
+            deltas[ESCOPO_GERAL]['total_empreendimentos'] += 1
+    for objeto in session.dirty:
+        if isinstance(objeto, Cliente):
+            estado = inspect(objeto)
+            if any(estado.attrs[campo].history.has_changes() for campo in CAMPOS_CONTABILIZADOS):
+                _contribuicao(deltas, *(_valor_anterior(estado, campo) for campo in CAMPOS_CONTABILIZADOS), quantidade=-1)
+                _contribuicao(deltas, *(getattr(objeto, campo) for campo in CAMPOS_CONTABILIZADOS))
+    for objeto in session.deleted:
+        if isinstance(objeto, Cliente):
+            estado = inspect(objeto)
+            _contribuicao(deltas, *(_valor_anterior(estado, campo) for campo in CAMPOS_CONTABILIZADOS), quantidade=-1)
+        elif isinstance(objeto, Empreendimento):
+            deltas[ESCOPO_GERAL]['total_empreendimentos'] -= 1
+    if deltas:
+        _aplicar(session.connection(), deltas)
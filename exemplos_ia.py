@@ -0,0 +1,113 @@
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+from sqlalchemy import event, select
+from models import db, ExemploIA
+from busca_clientes import normalizar_texto
+
+# Recuperação de exemplos corrigidos (ExemploIA) para a leitura de PDFs. Cada documento vira uma assinatura
+# MinHash das sequências de 5 palavras; a fração de posições iguais entre duas assinaturas estima a similaridade
+# de Jaccard. As assinaturas ficam numa matriz NumPy por processo, completada só com os exemplos novos (id maior que
+# o último carregado), então a busca é uma comparação vetorizada mesmo com milhares de exemplos.
+
+NUM_PERMUTACOES = 128
+TAMANHO_SHINGLE = 5
+PRIMO = (1 << 31) - 1
+# Coeficientes fixos (derivados de sha256) para que as assinaturas gravadas valham em qualquer processo
+_COEFICIENTES = np.array([
+    [int.from_bytes(hashlib.sha256(f'minhash:{parte}:{i}'.encode()).digest()[:4], 'little') % (PRIMO - 1) + 1 for i in range(NUM_PERMUTACOES)]
+    for parte in ('a', 'b')], dtype=np.uint64)
+LIMIAR_QUASE_DUPLICATA = 0.9
+SIMILARIDADE_MINIMA_EXEMPLO = 0.1
+QUANTIDADE_EXEMPLOS = 3
+ORCAMENTO_CARACTERES_EXEMPLOS = 6000
+TAMANHO_TRECHO_EXEMPLO = 1500
+# Só o início do texto é assinado; a leitura de PDF manda ao modelo exatamente esse trecho (leitura_pdf.LIMITE_CARACTERES_PROMPT)
+CARACTERES_ASSINATURA = 8000
+
+
+def calcular_assinatura(texto):
+    palavras = re.findall(r'\w+', normalizar_texto(texto[:CARACTERES_ASSINATURA]))
+    shingles = {' '.join(palavras[i:i + TAMANHO_SHINGLE]) for i in range(max(len(palavras) - TAMANHO_SHINGLE + 1, 1))} if palavras else {''}
+    valores = np.fromiter((int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'little') for shingle in shingles),
+                          dtype=np.uint64, count=len(shingles))
+    # (a * x + b) mod p cabe em uint64: a, b < 2^31 e x < 2^32
+    permutados = (_COEFICIENTES[0][:, None] * valores[None, :] + _COEFICIENTES[1][:, None]) % PRIMO
+    return permutados.min(axis=1).astype(np.uint32)
+
+
+@event.listens_for(ExemploIA, 'before_insert')
+def _assinar_exemplo(mapper, conexao, exemplo):
+    exemplo.assinatura_minhash = calcular_assinatura(exemplo.texto_documento).tobytes()
+
+
+class IndiceExemplosIA:
+    def __init__(self):
+        self._trava = threading.Lock()
+        # (ids, assinaturas) trocados juntos, para quem lê sem a trava ver sempre um par consistente
+        self.dados = (np.empty(0, dtype=np.int64), np.empty((0, NUM_PERMUTACOES), dtype=np.uint32))
+        self.ultimo_id = 0
+
+    def atualizar(self):
+        # Carrega só os exemplos criados desde a última chamada (exemplos antigos sem assinatura são assinados aqui)
+        linhas = db.session.execute(select(ExemploIA.id, ExemploIA.assinatura_minhash).filter(ExemploIA.id > self.ultimo_id).order_by(ExemploIA.id)).all()
+        if not linhas:
+            return
+        sem_assinatura = [linha.id for linha in linhas if not linha.assinatura_minhash]
+        textos = dict(db.session.execute(select(ExemploIA.id, ExemploIA.texto_documento).filter(ExemploIA.id.in_(sem_assinatura))).all()) if sem_assinatura else {}
+        novas = np.stack([np.frombuffer(linha.assinatura_minhash, dtype=np.uint32) if linha.assinatura_minhash else calcular_assinatura(textos[linha.id])
+                          for linha in linhas])
+        with self._trava:
+            if linhas[0].id > self.ultimo_id:
+                ids, assinaturas = self.dados
+                self.dados = (np.concatenate([ids, [linha.id for linha in linhas]]), np.concatenate([assinaturas, novas]))
+                self.ultimo_id = linhas[-1].id
+
+    def mais_similares(self, texto, quantidade):
+        # [(similaridade estimada, id do exemplo)] em ordem decrescente
+        self.atualizar()
+        ids, assinaturas = self.dados
+        if not len(ids):
+            return []
+        similaridades = (assinaturas == calcular_assinatura(texto)).mean(axis=1)
+        quantidade = min(quantidade, len(ids))
+        melhores = np.argpartition(-similaridades, quantidade - 1)[:quantidade]
+        return [(float(similaridades[posicao]), int(ids[posicao])) for posicao in melhores[np.argsort(-similaridades[melhores], kind='stable')]]
+
+
+indice_exemplos = IndiceExemplosIA()
+
+
+def buscar_exemplos(texto):
+    # (exemplo quase idêntico ou None, exemplos parecidos para o prompt)
+    similares = [(similaridade, id_) for similaridade, id_ in indice_exemplos.mais_similares(texto, QUANTIDADE_EXEMPLOS)
+                 if similaridade >= SIMILARIDADE_MINIMA_EXEMPLO]
+    if not similares:
+        return None, []
+    exemplos = db.session.execute(select(ExemploIA).filter(ExemploIA.id.in_([id_ for _, id_ in similares]))).scalars().all()
+    por_id = {exemplo.id: exemplo for exemplo in exemplos}
+    ordenados = [por_id[id_] for _, id_ in similares if id_ in por_id]
+    quase_duplicata = ordenados[0] if ordenados and similares[0][0] >= LIMIAR_QUASE_DUPLICATA else None
+    return quase_duplicata, ordenados
+
+
+def formatar_exemplos_prompt(exemplos):
+    # Exemplos em ordem de similaridade até o orçamento de caracteres; cada um leva um trecho do documento e o JSON corrigido
+    blocos, total = [], 0
+    for numero, exemplo in enumerate(exemplos, start=1):
+        bloco = f"EXEMPLO {numero} - TRECHO DO DOCUMENTO: --- {exemplo.texto_documento[:TAMANHO_TRECHO_EXEMPLO]} --- JSON CORRETO: {exemplo.json_resultado_corrigido}"
+        if exemplo.instrucao_correcao:
+            bloco += f" (Observação do corretor: {exemplo.instrucao_correcao})"
+        if total + len(bloco) > ORCAMENTO_CARACTERES_EXEMPLOS:
+            break
+        blocos.append(bloco)
+        total += len(bloco)
+    if not blocos:
+        return ''
+    return " Use como referência estas extrações já revisadas por corretores em documentos parecidos: " + ' '.join(blocos)
+
+
+def dados_do_exemplo(exemplo):
+    return json.loads(exemplo.json_resultado_corrigido)
@@ -0,0 +1,120 @@
+import pandas as pd
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from models import db, Cliente, EstadoCivil
+from busca_clientes import indexar_clientes_por_id
+from estatisticas_painel import ajustar_estatisticas_por_id
+
+TAMANHO_LOTE_IMPORTACAO = 1000
+
+# Coluna da planilha -> coluna do modelo Cliente
+COLUNAS_PLANILHA = {
+    'Nome Completo': 'nome_completo',
+    'Data de Nascimento': 'data_nascimento',
+    'CPF': 'cpf',
+    'RG': 'rg',
+    'Profissão': 'profissao',
+    'Email Pessoal': 'email',
+    'DDD Pessoal': 'ddd_pessoal',
+    'Telefone Pessoal': 'telefone_pessoal',
+    'Estado Civil': 'estado_civil',
+}
+
+# Aceita tanto o nome do enum ("UNIAO_ESTAVEL") quanto o valor exibido ("União Estável")
+MAPA_ESTADO_CIVIL = {}
+for _estado in EstadoCivil:
+    MAPA_ESTADO_CIVIL[_estado.name] = _estado
+    MAPA_ESTADO_CIVIL[_estado.value.upper().replace(" ", "_")] = _estado
+
+
+def _somente_digitos(serie):
+    return serie.str.replace(r'\D', '', regex=True)
+
+
+def _texto_ou_none(serie):
+    serie = serie.str.strip()
+    return serie.where(serie.notna() & (serie != ''), None)
+
+
+def normalizar_planilha(df):
+    # Converte as colunas da planilha para as do modelo só com operações vetorizadas do pandas.
+    # Retorna o DataFrame normalizado e a máscara das linhas com dados obrigatórios inválidos.
+    faltando = [coluna for coluna in COLUNAS_PLANILHA if coluna not in df.columns]
+    if faltando:
+        raise ValueError(f"Colunas ausentes na planilha: {', '.join(faltando)}")
+    df = df[list(COLUNAS_PLANILHA)].rename(columns=COLUNAS_PLANILHA)
+    for coluna in ('nome_completo', 'cpf', 'rg', 'profissao', 'email', 'ddd_pessoal', 'telefone_pessoal', 'estado_civil'):
+        df[coluna] = _texto_ou_none(df[coluna].astype('string'))
+
+    df['email'] = df['email'].str.lower()
+    df['ddd_pessoal'] = _somente_digitos(df['ddd_pessoal'])
+    df['telefone_pessoal'] = _somente_digitos(df['telefone_pessoal'])
+    df['cpf_digitos'] = _somente_digitos(df['cpf'])
+
+    datas = pd.to_datetime(df['data_nascimento'], dayfirst=True, errors='coerce')
+    df['data_nascimento'] = datas.dt.date.where(datas.notna(), None)
+
+    chave_estado_civil = df['estado_civil'].str.upper().str.replace(" ", "_", regex=False)
+    df['estado_civil'] = chave_estado_civil.map(MAPA_ESTADO_CIVIL)
+
+    rejeitadas = (
+        df['nome_completo'].isna()
+        | df['ddd_pessoal'].isna()
+        | df['telefone_pessoal'].isna()
+        | (chave_estado_civil.notna() & df['estado_civil'].isna())
+    ).fillna(True).astype(bool)
+    return df, rejeitadas
+
+
+def carregar_chaves_existentes():
+    # Uma única consulta para todos os CPFs (só dígitos) e emails (minúsculos) já cadastrados
+    cpfs, emails = set(), set()
+    for cpf, email in db.session.execute(db.select(Cliente.cpf, Cliente.email)):
+        if cpf:
+            cpfs.add(''.join(c for c in cpf if c.isdigit()))
+        if email:
+            emails.add(email.strip().lower())
+    return cpfs, emails
+
+
+def importar_clientes_csv(arquivo, proprietario_id, tamanho_lote=TAMANHO_LOTE_IMPORTACAO):
+    # Insere em lotes com commit por lote. 'ignorados' são linhas já cadastradas ou repetidas
+    # na própria planilha; 'rejeitados' são linhas com dados obrigatórios inválidos.
+    df = pd.read_csv(arquivo, encoding='utf-8', sep=';', dtype=str)
+    df, rejeitadas = normalizar_planilha(df)
+    total = len(df)
+    df = df[~rejeitadas]
+
+    cpfs_existentes, emails_existentes = carregar_chaves_existentes()
+    tem_cpf = df['cpf_digitos'].notna() & (df['cpf_digitos'] != '')
+    tem_email = df['email'].notna()
+    ja_existe = (tem_cpf & df['cpf_digitos'].isin(cpfs_existentes)) | (tem_email & df['email'].isin(emails_existentes))
+    duplicada_no_arquivo = (tem_cpf & df['cpf_digitos'].duplicated()) | (tem_email & df['email'].duplicated())
+    df = df[~(ja_existe | duplicada_no_arquivo).fillna(False).astype(bool)]
+
+    df = df.drop(columns=['cpf_digitos']).astype(object)
+    df = df.where(df.notna(), None)
+    df['proprietario_id'] = proprietario_id
+    registros = df.to_dict('records')
+
+    contagem = {'inseridos': 0, 'ignorados': total - int(rejeitadas.sum()) - len(registros), 'rejeitados': int(rejeitadas.sum())}
+    for inicio in range(0, len(registros), tamanho_lote):
+        lote = registros[inicio:inicio + tamanho_lote]
+        try:
+            ids_inseridos = db.session.execute(insert(Cliente).returning(Cliente.id), lote).scalars().all()
+        except IntegrityError:
+            # Outro usuário pode ter cadastrado o mesmo CPF/email durante a importação: refaz o lote linha a linha,
+            # cada uma num savepoint, e só as linhas em conflito ficam de fora
+            db.session.rollback()
+            ids_inseridos = []
+            for registro in lote:
+                try:
+                    with db.session.begin_nested():
+                        ids_inseridos.append(db.session.execute(insert(Cliente).returning(Cliente.id), registro).scalar_one())
+                except IntegrityError:
+                    contagem['ignorados'] += 1
+        indexar_clientes_por_id(db.session.connection(), ids_inseridos)
+        ajustar_estatisticas_por_id(db.session.connection(), ids_inseridos)
+        db.session.commit()
+        contagem['inseridos'] += len(ids_inseridos)
+    return contagem
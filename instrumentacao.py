@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+import traceback
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Instrumentação opcional (INSTRUMENTACAO=1): tempo por rota, quantidade e tempo de SQL por requisição, tempo de
+# chamadas externas (Gemini, fitz) e log de consultas lentas com a linha do código que as originou.
+# Desligada, nenhum hook é registrado; medir_chamada_externa só confere uma variável global.
+# As métricas são por processo (cada worker do gunicorn expõe as suas).
+
+_instancia_ativa = None
+_requisicao_atual = ContextVar('instrumentacao_requisicao', default=None)
+QUANTIS = (0.5, 0.9, 0.95, 0.99)
+
+
+class _Resumo:
+    # Amostras recentes (janela deslizante) para os quantis, mais soma e contagem totais desde o início
+    def __init__(self, tamanho):
+        self.amostras = deque(maxlen=tamanho)
+        self.soma = 0.0
+        self.contagem = 0
+
+    def registrar(self, valor):
+        self.amostras.append(valor)
+        self.soma += valor
+        self.contagem += 1
+
+    def quantis(self):
+        ordenadas = sorted(self.amostras)
+        return [(quantil, ordenadas[min(int(quantil * len(ordenadas)), len(ordenadas) - 1)] if ordenadas else 0.0) for quantil in QUANTIS]
+
+
+class Instrumentacao:
+    def __init__(self, app=None):
+        self.ativa = False
+        self._trava = threading.Lock()
+        self._resumos = {}
+        self._consultas_lentas = defaultdict(int)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global _instancia_ativa
+        app.config.setdefault('INSTRUMENTACAO_ATIVA', os.getenv('INSTRUMENTACAO') == '1')
+        app.config.setdefault('INSTRUMENTACAO_LIMITE_CONSULTA_LENTA_MS', int(os.getenv('INSTRUMENTACAO_LIMITE_CONSULTA_LENTA_MS', 200)))
+        app.config.setdefault('INSTRUMENTACAO_AMOSTRAS', 1000)
+        app.config.setdefault('INSTRUMENTACAO_TOKEN', os.getenv('INSTRUMENTACAO_TOKEN'))
+        app.extensions['instrumentacao'] = self
+        self.ativa = app.config['INSTRUMENTACAO_ATIVA']
+        if not self.ativa:
+            return
+        self.app = app
+        self.limite_consulta_lenta = app.config['INSTRUMENTACAO_LIMITE_CONSULTA_LENTA_MS'] / 1000
+        self.tamanho_amostras = app.config['INSTRUMENTACAO_AMOSTRAS']
+        self.raiz_projeto = app.root_path
+        app.before_request(self._inicio_requisicao)
+        app.teardown_request(self._fim_requisicao)
+        event.listen(Engine, 'before_cursor_execute', self._antes_sql)
+        event.listen(Engine, 'after_cursor_execute', self._depois_sql)
+        _instancia_ativa = self
+
+    def _resumo(self, nome, rotulos):
+        chave = (nome, rotulos)
+        resumo = self._resumos.get(chave)
+        if resumo is None:
+            resumo = self._resumos.setdefault(chave, _Resumo(self.tamanho_amostras))
+        return resumo
+
+    def registrar(self, nome, rotulos, valor):
+        with self._trava:
+            self._resumo(nome, rotulos).registrar(valor)
+
+    # --- Requisições ---
+    def _inicio_requisicao(self):
+        request.environ['instrumentacao.token'] = _requisicao_atual.set({'inicio': time.perf_counter(), 'consultas': 0, 'tempo_sql': 0.0})
+
+    def _fim_requisicao(self, excecao=None):
+        token = request.environ.pop('instrumentacao.token', None)
+        dados = _requisicao_atual.get()
+        if token is None or dados is None:
+            return
+        _requisicao_atual.reset(token)
+        rotulos = (('rota', request.endpoint or 'desconhecida'),)
+        with self._trava:
+            self._resumo('halley_requisicao_segundos', rotulos).registrar(time.perf_counter() - dados['inicio'])
+            self._resumo('halley_requisicao_consultas_sql', rotulos).registrar(dados['consultas'])
+            self._resumo('halley_requisicao_sql_segundos', rotulos).registrar(dados['tempo_sql'])
+
+    # --- SQL ---
+    def _antes_sql(self, conexao, cursor, comando, parametros, contexto, executemany):
+        conexao.info.setdefault('instrumentacao.inicios', []).append(time.perf_counter())
+
+    def _depois_sql(self, conexao, cursor, comando, parametros, contexto, executemany):
+        duracao = time.perf_counter() - conexao.info['instrumentacao.inicios'].pop()
+        dados = _requisicao_atual.get()
+        if dados is not None:
+            dados['consultas'] += 1
+            dados['tempo_sql'] += duracao
+        if duracao >= self.limite_consulta_lenta:
+            origem = self._origem_no_projeto()
+            with self._trava:
+                self._consultas_lentas[origem] += 1
+            self.app.logger.warning("Consulta lenta (%.0f ms) em %s: %s", duracao * 1000, origem, ' '.join(comando.split())[:500])
+
+    def _origem_no_projeto(self):
+        # Último quadro da pilha que pertence ao código do CRM (fora de site-packages e deste módulo)
+        for quadro in reversed(traceback.extract_stack()):
+            if quadro.filename.startswith(self.raiz_projeto) and 'site-packages' not in quadro.filename and not quadro.filename.endswith('instrumentacao.py'):
+                return f"{os.path.relpath(quadro.filename, self.raiz_projeto)}:{quadro.lineno} ({quadro.name})"
+        return 'desconhecida'
+
+    # --- Exposição ---
+    def formato_prometheus(self):
+        linhas = []
+        with self._trava:
+            por_nome = defaultdict(list)
+            for (nome, rotulos), resumo in sorted(self._resumos.items()):
+                por_nome[nome].append((rotulos, resumo.quantis(), resumo.soma, resumo.contagem))
+            consultas_lentas = sorted(self._consultas_lentas.items())
+        for nome, series in por_nome.items():
+            linhas.append(f"# TYPE {nome} summary")
+            for rotulos, quantis, soma, contagem in series:
+                base = ','.join(f'{chave}="{_escapar_rotulo(valor)}"' for chave, valor in rotulos)
+                for quantil, valor in quantis:
+                    linhas.append(f'{nome}{{{base},quantile="{quantil}"}} {valor:.6g}')
+                linhas.append(f'{nome}_sum{{{base}}} {soma:.6g}')
+                linhas.append(f'{nome}_count{{{base}}} {contagem}')
+        linhas.append("# TYPE halley_consultas_lentas_total counter")
+        for origem, total in consultas_lentas:
+            linhas.append(f'halley_consultas_lentas_total{{origem="{_escapar_rotulo(origem)}"}} {total}')
+        return '\n'.join(linhas) + '\n'
+
+
+def _escapar_rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@contextmanager
+def medir_chamada_externa(servico):
+    instrumentacao = _instancia_ativa
+    if instrumentacao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        instrumentacao.registrar('halley_chamada_externa_segundos', (('servico', servico),), time.perf_counter() - inicio)
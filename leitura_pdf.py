@@ -0,0 +1,297 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+import fitz
+from flask import current_app
+from markupsafe import escape
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from models import db, TarefaLeituraPDF, StatusTarefa, ArquivoArmazenado, ExtracaoTextoPDF
+from armazenamento import TAMANHO_BLOCO
+from cache_ia import gerar_resposta_ia
+from exemplos_ia import buscar_exemplos, formatar_exemplos_prompt, dados_do_exemplo, CARACTERES_ASSINATURA
+from instrumentacao import medir_chamada_externa
+
+
+# O trecho enviado ao modelo é o mesmo que exemplos_ia assina, para que documentos repetidos tenham a mesma assinatura
+LIMITE_CARACTERES_PROMPT = CARACTERES_ASSINATURA
+
+
+def _extrair_intervalo(caminho, inicio, fim, limite_caracteres):
+    # Executado nos processos do pool; para assim que o trecho já tem texto suficiente para o prompt
+    paginas, total_caracteres = [], 0
+    with fitz.open(caminho) as doc:
+        for numero in range(inicio, fim):
+            texto = doc[numero].get_text()
+            paginas.append(texto)
+            total_caracteres += len(texto)
+            if total_caracteres >= limite_caracteres:
+                break
+    return paginas
+
+
+def _limitar_paginas(paginas, limite_caracteres):
+    total_caracteres = 0
+    for indice, texto in enumerate(paginas):
+        total_caracteres += len(texto)
+        if total_caracteres >= limite_caracteres:
+            return paginas[:indice + 1]
+    return paginas
+
+
+def extrair_documentos(caminhos, executor=None, limite_paginas=50, limite_caracteres=LIMITE_CARACTERES_PROMPT, paginas_por_tarefa=10):
+    # Divide cada PDF em intervalos de páginas e distribui todos os intervalos no pool de processos.
+    # Devolve, na mesma ordem dos caminhos, (páginas extraídas, total de páginas do PDF) ou a exceção do documento.
+    planos = []
+    for caminho in caminhos:
+        try:
+            with fitz.open(caminho) as doc:
+                total_paginas = doc.page_count
+        except Exception as e:
+            planos.append((caminho, e, []))
+            continue
+        ultima_pagina = min(total_paginas, limite_paginas)
+        intervalos = [(inicio, min(inicio + paginas_por_tarefa, ultima_pagina)) for inicio in range(0, ultima_pagina, paginas_por_tarefa)]
+        planos.append((caminho, total_paginas, intervalos))
+
+    usar_pool = executor is not None and sum(len(intervalos) for _, _, intervalos in planos) > 1
+    futuros = [[executor.submit(_extrair_intervalo, caminho, inicio, fim, limite_caracteres) for inicio, fim in intervalos] if usar_pool else None
+               for caminho, _, intervalos in planos]
+
+    resultados = []
+    for (caminho, total_paginas, intervalos), futuros_documento in zip(planos, futuros):
+        if isinstance(total_paginas, Exception):
+            resultados.append(total_paginas)
+            continue
+        try:
+            paginas, total_caracteres = [], 0
+            for posicao, (inicio, fim) in enumerate(intervalos):
+                if usar_pool:
+                    trecho = futuros_documento[posicao].result()
+                else:
+                    trecho = _extrair_intervalo(caminho, inicio, fim, limite_caracteres)
+                paginas.extend(trecho)
+                total_caracteres += sum(len(texto) for texto in trecho)
+                if total_caracteres >= limite_caracteres:
+                    # O restante do documento não entraria no prompt
+                    for futuro in (futuros_documento or [])[posicao + 1:]:
+                        futuro.cancel()
+                    break
+            resultados.append((_limitar_paginas(paginas, limite_caracteres), total_paginas))
+        except Exception as e:
+            resultados.append(e)
+    return resultados
+
+
+def _hash_do_arquivo(caminho, nome_arquivo_servidor):
+    arquivo = db.session.execute(db.select(ArquivoArmazenado).filter_by(nome_arquivo_servidor=nome_arquivo_servidor)).scalar_one_or_none()
+    if arquivo is not None:
+        return arquivo.hash_sha256
+    hash_arquivo = hashlib.sha256()
+    with open(caminho, 'rb') as stream:
+        for bloco in iter(lambda: stream.read(TAMANHO_BLOCO), b''):
+            hash_arquivo.update(bloco)
+    return hash_arquivo.hexdigest()
+
+
+def _extracao_suficiente(extracao, limite_paginas, limite_caracteres):
+    # Uma extração interrompida pelos limites só serve se os limites atuais não pedirem mais texto
+    paginas = json.loads(extracao.paginas)
+    if len(paginas) >= min(extracao.quantidade_paginas, limite_paginas) or sum(len(texto) for texto in paginas) >= limite_caracteres:
+        return paginas
+    return None
+
+
+def obter_paginas_documentos(caminhos_e_nomes, executor=None, limite_paginas=50, limite_caracteres=LIMITE_CARACTERES_PROMPT, paginas_por_tarefa=10):
+    # O texto de cada página fica guardado pelo hash do conteúdo, então reenviar o mesmo PDF não abre o PyMuPDF de novo.
+    # limite_caracteres vale para o prompt inteiro: os documentos são lidos em ordem, cada um só até o que ainda cabe,
+    # e os seguintes nem são abertos depois que os anteriores preencheram o limite (devolvem lista vazia).
+    resultados = []
+    restante = limite_caracteres
+    for caminho, nome_arquivo_servidor in caminhos_e_nomes:
+        if restante <= 0:
+            resultados.append([])
+            continue
+        try:
+            hash_sha256 = _hash_do_arquivo(caminho, nome_arquivo_servidor)
+        except Exception as e:
+            resultados.append(e)
+            continue
+        extracao = db.session.execute(db.select(ExtracaoTextoPDF).filter_by(hash_sha256=hash_sha256)).scalar_one_or_none()
+        paginas = _extracao_suficiente(extracao, limite_paginas, restante) if extracao is not None else None
+        if paginas is None:
+            # Fora do cache: os intervalos de páginas deste documento vão para o pool de processos
+            with medir_chamada_externa('fitz'):
+                resultado, = extrair_documentos([caminho], executor, limite_paginas, restante, paginas_por_tarefa)
+            if isinstance(resultado, Exception):
+                resultados.append(resultado)
+                continue
+            paginas, total_paginas = resultado
+            if extracao is None:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(ExtracaoTextoPDF(hash_sha256=hash_sha256, paginas=json.dumps(paginas, ensure_ascii=False), quantidade_paginas=total_paginas))
+                except IntegrityError:
+                    # Outra tarefa extraiu o mesmo arquivo ao mesmo tempo; só esta linha é descartada
+                    pass
+            else:
+                extracao.paginas = json.dumps(paginas, ensure_ascii=False)
+        paginas = _limitar_paginas(paginas, restante)
+        restante -= sum(len(texto) for texto in paginas)
+        resultados.append(paginas)
+    db.session.commit()
+    return resultados
+
+
+def juntar_paginas(paginas):
+    return "".join(pagina + "\n\n" for pagina in paginas)
+
+
+def _extrair_json(resposta_texto):
+    inicio_json = resposta_texto.find('{')
+    fim_json = resposta_texto.rfind('}') + 1
+    if inicio_json == -1 or fim_json == 0:
+        return None
+    dados = json.loads(resposta_texto[inicio_json:fim_json])
+    if 'project' in dados: dados = dados['project']
+    return dados
+
+
+def analisar_texto_com_ia(texto_extraido_completo):
+    # Devolve os dados extraídos e a lista de mensagens (categoria, texto) que a rota deve exibir via flash
+    mensagens = []
+    # Documento quase idêntico a um já corrigido por um corretor: usa a correção e não chama o modelo
+    texto_prompt = texto_extraido_completo[:LIMITE_CARACTERES_PROMPT]
+    quase_duplicata, exemplos = buscar_exemplos(texto_prompt)
+    if quase_duplicata is not None:
+        mensagens.append(("success", "Documento praticamente igual a um já revisado: os campos foram preenchidos com a correção salva, sem consultar a IA. Por favor, confira."))
+        return dados_do_exemplo(quase_duplicata), mensagens
+    prompt = f"""Você é um robô assistente altamente preciso, especialista em extrair dados de documentos do mercado imobiliário para um CRM. Analise o texto abaixo e retorne as informações em um formato JSON. REGRAS RÍGIDAS: Sua resposta deve ser APENAS e EXCLUSIVAMENTE um objeto JSON válido. Se uma informação não for encontrada, o valor do campo no JSON deve ser uma string vazia "". Use este formato: {{"nome": "...", "status": "...", "endereco": "...", "descricao": "...", "previsao_entrega": "...", "valor_a_partir_de": "...", "tamanho_apartamentos_planta": "...", "vagas_garagem": "...", "quantidade_torres": 1, "subsolos": 2, "andares": 25, "campanha_promocional": "..."}}{formatar_exemplos_prompt(exemplos)} TEXTO DOS DOCUMENTOS: --- {texto_prompt} ---"""
+    dados_extraidos = {}
+    try:
+        resposta_texto = gerar_resposta_ia(prompt, etiquetas=('pdf',))
+        dados = _extrair_json(resposta_texto)
+        if dados is not None:
+            dados_extraidos = dados
+            mensagens.append(("success", "Documento analisado com IA! Por favor, revise os campos preenchidos."))
+        else:
+            mensagens.append(("warning", "A IA respondeu, mas não em um formato JSON válido. Tentando autocorreção..."))
+            prompt_correcao = f"Sua resposta anterior não estava no formato JSON correto. Sua resposta foi: '{resposta_texto}'. Por favor, corrija seu erro e forneça APENAS o objeto JSON válido baseado no documento original, sem nenhuma outra palavra ou explicação."
+            resposta_texto_corrigido = gerar_resposta_ia(prompt_correcao, etiquetas=('pdf',))
+            dados = _extrair_json(resposta_texto_corrigido)
+            if dados is not None:
+                dados_extraidos = dados
+                mensagens.append(("success", "Autocorreção da IA bem-sucedida! Por favor, revise os campos."))
+            else:
+                mensagens.append(("danger", f"A autocorreção da IA também falhou. A resposta da IA foi: <pre>{escape(resposta_texto_corrigido)}</pre>"))
+    except Exception as e:
+        current_app.logger.exception("Erro ao processar com a IA ou ao fazer o parse do JSON")
+        mensagens.append(("danger", f"A IA não conseguiu processar os documentos. Erro: {escape(e)}"))
+    return dados_extraidos, mensagens
+
+
+def processar_documentos(arquivos, pasta_uploads, **opcoes_extracao):
+    # arquivos: lista de (nome_original, nome_arquivo_servidor)
+    mensagens = []
+    paginas = []
+    caminhos_e_nomes = [(os.path.join(pasta_uploads, nome_seguro), nome_seguro) for _, nome_seguro in arquivos]
+    for (nome_original, _), resultado in zip(arquivos, obter_paginas_documentos(caminhos_e_nomes, **opcoes_extracao)):
+        if isinstance(resultado, Exception):
+            mensagens.append(("danger", f"Erro ao processar o arquivo {escape(nome_original)}: {escape(resultado)}"))
+        else:
+            paginas.extend(resultado)
+    texto_extraido_completo = juntar_paginas(paginas)
+    if not texto_extraido_completo.strip():
+        mensagens.append(("warning", "Não foi possível extrair texto dos PDFs enviados (o PDF pode ser baseado em imagem)."))
+        return {}, texto_extraido_completo, mensagens
+    dados_extraidos, mensagens_ia = analisar_texto_com_ia(texto_extraido_completo)
+    return dados_extraidos, texto_extraido_completo, mensagens + mensagens_ia
+
+
+class FilaLeituraPDF:
+    # Executa a leitura de PDFs + IA fora da requisição HTTP. O estado de cada tarefa fica na
+    # tabela TarefaLeituraPDF, então qualquer worker do gunicorn consegue responder ao polling.
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        self.processos = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('PDF_WORKERS', 2)
+        app.config.setdefault('PDF_PROCESSOS', 2)
+        app.config.setdefault('PDF_LIMITE_PAGINAS', 50)
+        app.config.setdefault('PDF_LIMITE_CARACTERES', LIMITE_CARACTERES_PROMPT)
+        app.config.setdefault('PDF_PAGINAS_POR_TAREFA', 10)
+        # Reenvio dos mesmos arquivos só reaproveita tarefas recentes; pendentes há mais que a expiração morreram
+        # com o worker (reinício do gunicorn) e são marcadas como erro
+        app.config.setdefault('PDF_REUSO_MINUTOS', 5)
+        app.config.setdefault('PDF_EXPIRACAO_MINUTOS', 30)
+        self.executor = ThreadPoolExecutor(max_workers=app.config['PDF_WORKERS'], thread_name_prefix='leitura-pdf')
+        # 'spawn' porque o processo do gunicorn já tem threads; PDF_PROCESSOS=0 extrai tudo no próprio worker
+        self.processos = None
+        if app.config['PDF_PROCESSOS'] > 0:
+            self.processos = ProcessPoolExecutor(max_workers=app.config['PDF_PROCESSOS'], mp_context=multiprocessing.get_context('spawn'))
+
+    def enfileirar(self, usuario_id, arquivos):
+        # Reenvio dos mesmos arquivos (ex.: clique duplo) enquanto a tarefa anterior não terminou reaproveita essa tarefa.
+        # Como o armazenamento deduplica por hash, os mesmos PDFs geram a mesma lista de arquivos no servidor.
+        self.expirar_tarefas_abandonadas()
+        arquivos_json = json.dumps(arquivos, ensure_ascii=False)
+        reuso_desde = datetime.utcnow() - timedelta(minutes=self.app.config['PDF_REUSO_MINUTOS'])
+        tarefa = db.session.execute(db.select(TarefaLeituraPDF).filter(
+            TarefaLeituraPDF.usuario_id == usuario_id, TarefaLeituraPDF.arquivos == arquivos_json,
+            TarefaLeituraPDF.status.in_([StatusTarefa.PENDENTE, StatusTarefa.PROCESSANDO]),
+            TarefaLeituraPDF.data_criacao >= reuso_desde).limit(1)).scalar_one_or_none()
+        if tarefa is not None:
+            return tarefa
+        tarefa = TarefaLeituraPDF(usuario_id=usuario_id, arquivos=arquivos_json)
+        db.session.add(tarefa)
+        db.session.commit()
+        self.executor.submit(self._executar, tarefa.id)
+        return tarefa
+
+    def expirar_tarefas_abandonadas(self, tarefa_id=None):
+        # Nenhuma leitura leva PDF_EXPIRACAO_MINUTOS; a tarefa ficou órfã quando o worker que a executava reiniciou.
+        # Por idade, e não na inicialização, para um worker novo não marcar as tarefas em andamento nos outros workers.
+        limite = datetime.utcnow() - timedelta(minutes=self.app.config['PDF_EXPIRACAO_MINUTOS'])
+        condicoes = [TarefaLeituraPDF.status.in_([StatusTarefa.PENDENTE, StatusTarefa.PROCESSANDO]), TarefaLeituraPDF.data_criacao < limite]
+        if tarefa_id is not None:
+            condicoes.append(TarefaLeituraPDF.id == tarefa_id)
+        mensagens = [("danger", "A leitura foi interrompida porque o servidor reiniciou. Envie os arquivos novamente.")]
+        resultado = db.session.execute(update(TarefaLeituraPDF).where(*condicoes).values(
+            status=StatusTarefa.ERRO, mensagens=json.dumps(mensagens, ensure_ascii=False), data_conclusao=datetime.utcnow()))
+        if resultado.rowcount:
+            db.session.commit()
+        return resultado.rowcount
+
+    def _executar(self, tarefa_id):
+        with self.app.app_context():
+            tarefa = db.session.get(TarefaLeituraPDF, tarefa_id)
+            tarefa.status = StatusTarefa.PROCESSANDO
+            db.session.commit()
+            try:
+                dados_extraidos, texto, mensagens = processar_documentos(
+                    json.loads(tarefa.arquivos), self.app.config['UPLOAD_FOLDER'], executor=self.processos,
+                    limite_paginas=self.app.config['PDF_LIMITE_PAGINAS'], limite_caracteres=self.app.config['PDF_LIMITE_CARACTERES'],
+                    paginas_por_tarefa=self.app.config['PDF_PAGINAS_POR_TAREFA'])
+                tarefa.dados_extraidos = json.dumps(dados_extraidos, ensure_ascii=False)
+                tarefa.texto_extraido = texto
+                tarefa.status = StatusTarefa.CONCLUIDA
+                tarefa.mensagens = json.dumps(mensagens, ensure_ascii=False)
+                tarefa.data_conclusao = datetime.utcnow()
+                db.session.commit()
+            except Exception as e:
+                # A sessão pode ter ficado inválida (ex.: "database is locked" no commit do cache de extração)
+                self.app.logger.exception("Erro na tarefa de leitura de PDF %s", tarefa_id)
+                db.session.rollback()
+                tarefa = db.session.get(TarefaLeituraPDF, tarefa_id)
+                tarefa.status = StatusTarefa.ERRO
+                tarefa.mensagens = json.dumps([("danger", f"A IA não conseguiu processar os documentos. Erro: {escape(e)}")], ensure_ascii=False)
+                tarefa.data_conclusao = datetime.utcnow()
+                db.session.commit()
@@ -0,0 +1,47 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# Limita quantas chamadas ao Gemini cada processo atende ao mesmo tempo. Com os workers gthread do Procfile, as
+# threads que sobram continuam livres para as páginas comuns do CRM; quem não consegue vaga em IA_ESPERA_MAXIMA
+# segundos recebe "IA ocupada" na hora, em vez de ficar enfileirado segurando uma thread.
+
+
+class IAOcupada(Exception):
+    pass
+
+
+class LimitadorIA:
+    def __init__(self, app=None):
+        self.maximo = None
+        self.espera_maxima = None
+        self._vagas = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IA_CONCORRENCIA_MAXIMA', int(os.getenv('IA_CONCORRENCIA_MAXIMA', 2)))
+        app.config.setdefault('IA_ESPERA_MAXIMA', 0.5)
+        self.maximo = app.config['IA_CONCORRENCIA_MAXIMA']
+        self.espera_maxima = app.config['IA_ESPERA_MAXIMA']
+        self._vagas = threading.BoundedSemaphore(self.maximo)
+        app.extensions['limitador_ia'] = self
+
+    def reservar(self):
+        # Ocupa uma vaga e devolve a função que a libera (pode ser chamada mais de uma vez); sem vaga, IAOcupada
+        if not self._vagas.acquire(timeout=self.espera_maxima):
+            raise IAOcupada()
+        trava = threading.Lock()
+
+        def liberar():
+            if trava.acquire(blocking=False):
+                self._vagas.release()
+        return liberar
+
+    @contextmanager
+    def vaga(self):
+        liberar = self.reservar()
+        try:
+            yield
+        finally:
+            liberar()
@@ -0,0 +1,136 @@
+import os
+import math
+import time
+import sqlite3
+import threading
+from functools import wraps
+from flask import current_app, request, session, flash, redirect, url_for, jsonify
+
+# Limite de requisições por balde de fichas (token bucket), por usuário logado ou, sem login, por IP.
+# Cada limite nomeado tem (capacidade, fichas por segundo): a capacidade é a rajada aceita e as fichas voltam
+# continuamente. O backend 'memoria' vale por processo; com vários workers do gunicorn, 'sqlite' guarda os baldes
+# num arquivo compartilhado por todos os processos da máquina.
+# O IP vem de request.remote_addr, corrigido pelo ProxyFix do app.py conforme PROXIES_CONFIAVEIS.
+
+LIMITES_PADRAO = {
+    'api_publica': (120, 2.0),
+    'ia': (5, 0.1),
+    'ler_pdf': (5, 0.05),
+}
+MAXIMO_BALDES_EM_MEMORIA = 10000
+
+
+class _BaldesMemoria:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._baldes = {}
+
+    def consumir(self, chave, capacidade, taxa):
+        # Segundos até haver uma ficha; 0 quando a requisição pode seguir
+        agora = time.monotonic()
+        with self._trava:
+            fichas, atualizado_em, _ = self._baldes.get(chave, (capacidade, agora, agora))
+            fichas = min(capacidade, fichas + (agora - atualizado_em) * taxa)
+            espera = 0.0
+            if fichas >= 1:
+                fichas -= 1
+            else:
+                espera = (1 - fichas) / taxa
+            self._baldes[chave] = (fichas, agora, agora + (capacidade - fichas) / taxa)
+            if len(self._baldes) > MAXIMO_BALDES_EM_MEMORIA:
+                # Baldes que já estariam cheios equivalem a não ter registro
+                self._baldes = {chave: balde for chave, balde in self._baldes.items() if balde[2] > agora}
+            return espera
+
+
+class _BaldesSQLite:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._chamadas = 0
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("CREATE TABLE IF NOT EXISTS balde (chave TEXT PRIMARY KEY, fichas REAL NOT NULL, atualizado_em REAL NOT NULL, cheio_em REAL NOT NULL)")
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+
+    def consumir(self, chave, capacidade, taxa):
+        agora = time.time()
+        conexao = self._conectar()
+        try:
+            # BEGIN IMMEDIATE serializa a leitura e a escrita do balde entre os processos
+            conexao.execute("BEGIN IMMEDIATE")
+            linha = conexao.execute("SELECT fichas, atualizado_em FROM balde WHERE chave = ?", (chave,)).fetchone()
+            fichas = min(capacidade, linha[0] + (agora - linha[1]) * taxa) if linha else capacidade
+            espera = 0.0
+            if fichas >= 1:
+                fichas -= 1
+            else:
+                espera = (1 - fichas) / taxa
+            conexao.execute("INSERT OR REPLACE INTO balde (chave, fichas, atualizado_em, cheio_em) VALUES (?, ?, ?, ?)",
+                            (chave, fichas, agora, agora + (capacidade - fichas) / taxa))
+            self._chamadas += 1
+            if self._chamadas % 1000 == 0:
+                conexao.execute("DELETE FROM balde WHERE cheio_em <= ?", (agora,))
+            conexao.execute("COMMIT")
+            return espera
+        except Exception:
+            if conexao.in_transaction:
+                conexao.execute("ROLLBACK")
+            raise
+        finally:
+            conexao.close()
+
+
+class LimitadorRequisicoes:
+    def __init__(self, app=None):
+        self.ativo = False
+        self.limites = {}
+        self.baldes = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIMITE_REQUISICOES_ATIVO', os.getenv('LIMITE_REQUISICOES_ATIVO', '1') == '1')
+        app.config.setdefault('LIMITE_REQUISICOES_BACKEND', os.getenv('LIMITE_REQUISICOES_BACKEND', 'memoria'))
+        app.config.setdefault('LIMITE_REQUISICOES_CAMINHO', os.path.join(app.instance_path, 'limite_requisicoes.sqlite3'))
+        app.config.setdefault('LIMITES_REQUISICOES', {})
+        self.ativo = app.config['LIMITE_REQUISICOES_ATIVO']
+        self.limites = dict(LIMITES_PADRAO, **app.config['LIMITES_REQUISICOES'])
+        if app.config['LIMITE_REQUISICOES_BACKEND'] == 'sqlite':
+            self.baldes = _BaldesSQLite(app.config['LIMITE_REQUISICOES_CAMINHO'])
+        else:
+            self.baldes = _BaldesMemoria()
+        app.extensions['limitador_requisicoes'] = self
+
+    def consumir(self, nome):
+        capacidade, taxa = self.limites[nome]
+        identificador = f"u{session['usuario_id']}" if session.get('usuario_id') else f"ip{request.remote_addr}"
+        return self.baldes.consumir(f"{nome}:{identificador}", capacidade, taxa)
+
+
+def resposta_limite_excedido(espera):
+    segundos = max(math.ceil(espera), 1)
+    # Formulários HTML voltam para a página de origem com um aviso; APIs, SSE e fetch recebem 429
+    if request.method == 'POST' and request.accept_mimetypes.best != 'application/json':
+        flash(f'Muitas solicitações seguidas. Aguarde {segundos} segundos e tente novamente.', 'warning')
+        return redirect(request.referrer or url_for('dashboard'))
+    resposta = jsonify({'erro': 'Limite de requisições excedido.', 'tentar_novamente_em': segundos})
+    resposta.status_code = 429
+    resposta.headers['Retry-After'] = str(segundos)
+    return resposta
+
+
+def limitar(nome):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            limitador = current_app.extensions.get('limitador_requisicoes')
+            if limitador is not None and limitador.ativo:
+                espera = limitador.consumir(nome)
+                if espera:
+                    return resposta_limite_excedido(espera)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
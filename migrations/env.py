@@ -94,6 +94,14 @@ def run_migrations_online():
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
 
+    # the client search index (cliente_busca, see busca_clientes.py) is created
+    # with raw DDL and is not part of the metadata, so autogenerate must ignore it
+    def include_object(object, name, type_, reflected, compare_to):
+        return not (type_ == 'table' and reflected and name.startswith('cliente_busca'))
+
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
+
     connectable = get_engine()
 
     with connectable.connect() as connection:
@@ -0,0 +1,79 @@
+"""Indice de busca textual de clientes
+
+Revision ID: a123d981349c
+Revises: 2a407f91ab03
+Create Date: 2026-10-18 08:46:13.181024
+
+"""
+import re
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a123d981349c'
+down_revision = '2a407f91ab03'
+branch_labels = None
+depends_on = None
+
+
+# Cópia do esquema e da indexação de busca_clientes.py nesta revisão, para a migração não mudar junto com o app
+DDL_SQLITE = "CREATE VIRTUAL TABLE IF NOT EXISTS cliente_busca USING fts5(nome, contatos, observacoes, tokenize='unicode61 remove_diacritics 2')"
+DDL_POSTGRES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE TABLE IF NOT EXISTS cliente_busca (cliente_id INTEGER PRIMARY KEY REFERENCES cliente (id) ON DELETE CASCADE, texto TEXT NOT NULL, documento TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_cliente_busca_documento ON cliente_busca USING GIN (documento)",
+    "CREATE INDEX IF NOT EXISTS ix_cliente_busca_texto_trgm ON cliente_busca USING GIN (texto gin_trgm_ops)",
+]
+INSERT_SQLITE = "INSERT INTO cliente_busca (rowid, nome, contatos, observacoes) VALUES (:id, :nome, :contatos, :observacoes)"
+INSERT_POSTGRES = (
+    "INSERT INTO cliente_busca (cliente_id, texto, documento) VALUES (:id, concat_ws(' ', :nome, :contatos, :observacoes), "
+    "setweight(to_tsvector('simple', :nome), 'A') || setweight(to_tsvector('simple', :contatos), 'B') || setweight(to_tsvector('simple', :observacoes), 'C'))"
+)
+TELEFONES = (('ddd_pessoal', 'telefone_pessoal'), ('ddd_pessoal_2', 'telefone_pessoal_2'),
+             ('ddd_residencial', 'telefone_residencial'), ('ddd_comercial', 'telefone_comercial'))
+TAMANHO_LOTE = 1000
+
+
+def _normalizar(valor):
+    if not valor:
+        return ''
+    return unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode('ascii').lower().strip()
+
+
+def _digitos(valor):
+    return re.sub(r'\D', '', valor or '')
+
+
+def _documento(linha):
+    contatos = [_normalizar(linha.email), _normalizar(linha.email_comercial), _digitos(linha.cpf)]
+    for campo_ddd, campo_telefone in TELEFONES:
+        telefone = _digitos(getattr(linha, campo_telefone))
+        if telefone:
+            contatos.append(_digitos(getattr(linha, campo_ddd)) + telefone)
+            contatos.append(telefone)
+    return {'id': linha.id, 'nome': _normalizar(linha.nome_completo), 'contatos': ' '.join(contato for contato in contatos if contato),
+            'observacoes': _normalizar(linha.observacoes)}
+
+
+def upgrade():
+    # FTS5 no SQLite, tsvector + pg_trgm no Postgres
+    conexao = op.get_bind()
+    postgres = conexao.dialect.name == 'postgresql'
+    for comando in DDL_POSTGRES if postgres else [DDL_SQLITE]:
+        conexao.execute(sa.text(comando))
+    conexao.execute(sa.text("DELETE FROM cliente_busca"))
+    colunas = ['id', 'nome_completo', 'email', 'email_comercial', 'cpf', 'observacoes'] + [campo for par in TELEFONES for campo in par]
+    ultimo_id = 0
+    while True:
+        linhas = conexao.execute(sa.text(f"SELECT {', '.join(colunas)} FROM cliente WHERE descartado = :falso AND id > :ultimo ORDER BY id LIMIT :limite"),
+                                 {'falso': False, 'ultimo': ultimo_id, 'limite': TAMANHO_LOTE}).all()
+        if not linhas:
+            break
+        conexao.execute(sa.text(INSERT_POSTGRES if postgres else INSERT_SQLITE), [_documento(linha) for linha in linhas])
+        ultimo_id = linhas[-1].id
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS cliente_busca")
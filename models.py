@@ -20,6 +20,8 @@ class PerfilUsuario(enum.Enum):
     ADMIN = "Admin"; CORRETOR = "Corretor"
 class TipoAtividade(enum.Enum):
     LIGACAO = "Ligação"; EMAIL = "Email"; WHATSAPP = "WhatsApp"; REUNIAO = "Reunião"; VISITA = "Visita"; FOLLOW_UP = "Follow-up"; OUTRO = "Outro"
+class StatusTarefa(enum.Enum):
+    PENDENTE = "Pendente"; PROCESSANDO = "Processando"; CONCLUIDA = "Concluída"; ERRO = "Erro"
 
 class Cliente(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -70,6 +72,10 @@ class Cliente(db.Model):
     proprietario = db.relationship('Usuario', back_populates='clientes')
     agendamentos = db.relationship('Agendamento', back_populates='cliente', cascade='all, delete-orphan')
     atividades = db.relationship('Atividade', back_populates='cliente', cascade='all, delete-orphan', lazy='dynamic')
+    __table_args__ = (
+        db.Index('ix_cliente_proprietario_descartado_nome', 'proprietario_id', 'descartado', 'nome_completo'),
+        db.Index('ix_cliente_ativos_nome', 'nome_completo', 'id', sqlite_where=db.text('descartado = 0'), postgresql_where=db.text('NOT descartado')),
+    )
 
 class Empreendimento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -94,6 +100,9 @@ class Empreendimento(db.Model):
     materiais = db.relationship('Material', back_populates='empreendimento', cascade='all, delete-orphan')
     interessados = db.relationship('Cliente', secondary=interesses_table, back_populates='empreendimentos_interesse')
     agendamentos = db.relationship('Agendamento', back_populates='empreendimento', cascade='all, delete-orphan')
+    __table_args__ = (
+        db.Index('ix_empreendimento_publico_nome', 'publico', 'nome'),
+    )
 
 class Usuario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -108,12 +117,30 @@ class Usuario(db.Model):
     def definir_senha(self, senha): self._senha_hash = generate_password_hash(senha)
     def verificar_senha(self, senha): return check_password_hash(self._senha_hash, senha)
 
+class ArquivoArmazenado(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hash_sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    nome_arquivo_servidor = db.Column(db.String(200), nullable=False, unique=True)
+    tamanho = db.Column(db.Integer, nullable=False)
+    referencias = db.Column(db.Integer, nullable=False, default=0)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    materiais = db.relationship('Material', back_populates='arquivo')
+
+class ExtracaoTextoPDF(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hash_sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    paginas = db.Column(db.Text, nullable=False)
+    quantidade_paginas = db.Column(db.Integer, nullable=False)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Material(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome_original = db.Column(db.String(200), nullable=False)
-    nome_arquivo_servidor = db.Column(db.String(200), nullable=False, unique=True)
+    nome_arquivo_servidor = db.Column(db.String(200), nullable=False)
     empreendimento_id = db.Column(db.Integer, db.ForeignKey('empreendimento.id'), nullable=False)
+    arquivo_id = db.Column(db.Integer, db.ForeignKey('arquivo_armazenado.id'), nullable=True)
     empreendimento = db.relationship('Empreendimento', back_populates='materiais')
+    arquivo = db.relationship('ArquivoArmazenado', back_populates='materiais')
 
 class Agendamento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -124,9 +151,38 @@ class Agendamento(db.Model):
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=True)
     empreendimento_id = db.Column(db.Integer, db.ForeignKey('empreendimento.id'), nullable=True)
+    # Série recorrente: regra RRULE (ver recorrencia.py) e fim da última ocorrência (NULL = sem fim)
+    regra_recorrencia = db.Column(db.String(200), nullable=True)
+    recorrencia_ate = db.Column(db.DateTime, nullable=True)
     usuario = db.relationship('Usuario', back_populates='agendamentos')
     cliente = db.relationship('Cliente', back_populates='agendamentos')
     empreendimento = db.relationship('Empreendimento', back_populates='agendamentos')
+    excecoes = db.relationship('ExcecaoAgendamento', back_populates='agendamento', cascade='all, delete-orphan')
+    __table_args__ = (
+        db.Index('ix_agendamento_usuario_data_inicio', 'usuario_id', 'data_inicio'),
+        db.Index('ix_agendamento_usuario_data_fim', 'usuario_id', 'data_fim'),
+        db.Index('ix_agendamento_data_inicio', 'data_inicio'),
+        db.Index('ix_agendamento_data_fim', 'data_fim'),
+        db.Index('ix_agendamento_cliente_data_inicio', 'cliente_id', 'data_inicio'),
+        db.Index('ix_agendamento_cliente_data_fim', 'cliente_id', 'data_fim'),
+        db.Index('ix_agendamento_empreendimento_data_inicio', 'empreendimento_id', 'data_inicio'),
+        db.Index('ix_agendamento_empreendimento_data_fim', 'empreendimento_id', 'data_fim'),
+    )
+
+class ExcecaoAgendamento(db.Model):
+    # Ocorrência de uma série recorrente cancelada ou editada individualmente; data_original identifica a ocorrência
+    id = db.Column(db.Integer, primary_key=True)
+    agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamento.id'), nullable=False)
+    data_original = db.Column(db.DateTime, nullable=False)
+    cancelada = db.Column(db.Boolean, nullable=False, default=False)
+    titulo = db.Column(db.String(200), nullable=True)
+    data_inicio = db.Column(db.DateTime, nullable=True)
+    data_fim = db.Column(db.DateTime, nullable=True)
+    descricao = db.Column(db.Text, nullable=True)
+    agendamento = db.relationship('Agendamento', back_populates='excecoes')
+    __table_args__ = (
+        db.UniqueConstraint('agendamento_id', 'data_original', name='uq_excecao_agendamento_ocorrencia'),
+    )
 
 class Atividade(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -137,6 +193,9 @@ class Atividade(db.Model):
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
     cliente = db.relationship('Cliente', back_populates='atividades')
     usuario = db.relationship('Usuario', back_populates='atividades')
+    __table_args__ = (
+        db.Index('ix_atividade_cliente_data_criacao', 'cliente_id', 'data_criacao'),
+    )
 
 class ExemploIA(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -144,6 +203,8 @@ class ExemploIA(db.Model):
     json_resultado_corrigido = db.Column(db.Text, nullable=False)
     instrucao_correcao = db.Column(db.Text, nullable=True)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    # Assinatura MinHash de texto_documento, calculada por exemplos_ia.py ao inserir
+    assinatura_minhash = db.Column(db.LargeBinary, nullable=True)
 
 class Tipologia(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -151,4 +212,39 @@ class Tipologia(db.Model):
     suites = db.Column(db.String(100), nullable=True)
     vagas = db.Column(db.String(100), nullable=True)
     empreendimento_id = db.Column(db.Integer, db.ForeignKey('empreendimento.id'), nullable=False)
-    empreendimento = db.relationship('Empreendimento', back_populates='tipologias')
\ No newline at end of file
+    empreendimento = db.relationship('Empreendimento', back_populates='tipologias')
+
+class TarefaLeituraPDF(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.Enum(StatusTarefa), nullable=False, default=StatusTarefa.PENDENTE)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    arquivos = db.Column(db.Text, nullable=False)
+    texto_extraido = db.Column(db.Text, nullable=True)
+    dados_extraidos = db.Column(db.Text, nullable=True)
+    mensagens = db.Column(db.Text, nullable=True)
+    data_criacao = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    data_conclusao = db.Column(db.DateTime, nullable=True)
+
+class EstatisticaPainel(db.Model):
+    # Contadores do dashboard mantidos incrementalmente por estatisticas_painel.py.
+    # Uma linha por proprietário; proprietario_id = 0 guarda o total geral (visão do Admin) e o total de empreendimentos.
+    proprietario_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    clientes_ativos = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    clientes_descartados = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    status_lead_novo = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    status_em_contato = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    status_em_negociacao = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    status_comprou = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    status_descartado = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    temperatura_quente = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    temperatura_morno = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    temperatura_frio = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    temperatura_nao_informada = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_empreendimentos = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class VersaoDados(db.Model):
+    # Versão de um conjunto de dados (ex.: 'agenda:3'), incrementada a cada alteração por versoes_dados.py.
+    # Permite responder ETag/Last-Modified (e 304) sem consultar os próprios dados.
+    chave = db.Column(db.String(100), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+    data_atualizacao = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
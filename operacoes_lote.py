@@ -0,0 +1,109 @@
+from datetime import datetime
+from sqlalchemy import select, update, delete, func, or_, and_
+from models import Cliente, Agendamento, ExcecaoAgendamento, Atividade, interesses_table
+from busca_clientes import indexar_clientes_por_id, remover_do_indice
+from estatisticas_painel import ajustar_estatisticas_por_id
+from versoes_dados import incrementar_versoes
+
+# Operações em massa sobre clientes como UPDATE/DELETE por conjunto (lotes de ids com IN), na conexão da sessão
+# atual: quem chama faz o commit, então tudo vale ou nada vale. Como não passam pelos eventos do ORM, cada operação
+# mantém por conta própria o índice de busca, a tabela estatistica_painel e as versões da agenda.
+
+TAMANHO_LOTE = 1000
+CLIENTE = Cliente.__table__
+AGENDAMENTO = Agendamento.__table__
+
+
+def _lotes(ids_clientes):
+    for inicio in range(0, len(ids_clientes), TAMANHO_LOTE):
+        yield ids_clientes[inicio:inicio + TAMANHO_LOTE]
+
+
+def _chaves_agenda(usuarios_ids):
+    return {'agenda'} | {f'agenda:{usuario_id}' for usuario_id in usuarios_ids}
+
+
+def _agendamentos_pendentes(agora):
+    # Eventos que ainda não terminaram e séries recorrentes sem fim ou com ocorrências futuras
+    return or_(func.coalesce(AGENDAMENTO.c.data_fim, AGENDAMENTO.c.data_inicio) >= agora,
+               and_(AGENDAMENTO.c.regra_recorrencia.isnot(None), or_(AGENDAMENTO.c.recorrencia_ate.is_(None), AGENDAMENTO.c.recorrencia_ate >= agora)))
+
+
+def reatribuir_clientes(conexao, ids_clientes, novo_proprietario_id):
+    # Os agendamentos pendentes que eram do antigo proprietário acompanham o cliente; o histórico
+    # (atividades e eventos passados) continua com quem o registrou
+    ids_clientes = list(ids_clientes)
+    agora = datetime.utcnow()
+    proprietario_atual = select(CLIENTE.c.proprietario_id).where(CLIENTE.c.id == AGENDAMENTO.c.cliente_id).scalar_subquery()
+    contagem = {'clientes': 0, 'agendamentos': 0}
+    usuarios_agenda = set()
+    ajustar_estatisticas_por_id(conexao, ids_clientes, sinal=-1)
+    for lote in _lotes(ids_clientes):
+        condicao = and_(AGENDAMENTO.c.cliente_id.in_(lote), AGENDAMENTO.c.usuario_id == proprietario_atual,
+                        AGENDAMENTO.c.usuario_id != novo_proprietario_id, _agendamentos_pendentes(agora))
+        usuarios_agenda.update(conexao.execute(select(AGENDAMENTO.c.usuario_id).where(condicao).distinct()).scalars())
+        contagem['agendamentos'] += conexao.execute(update(AGENDAMENTO).where(condicao).values(usuario_id=novo_proprietario_id)).rowcount
+        contagem['clientes'] += conexao.execute(update(CLIENTE).where(CLIENTE.c.id.in_(lote), CLIENTE.c.proprietario_id.is_distinct_from(novo_proprietario_id))
+                                                .values(proprietario_id=novo_proprietario_id)).rowcount
+    ajustar_estatisticas_por_id(conexao, ids_clientes)
+    if usuarios_agenda:
+        incrementar_versoes(conexao, _chaves_agenda(usuarios_agenda | {novo_proprietario_id}))
+    return contagem
+
+
+def descartar_clientes(conexao, ids_clientes):
+    ids_clientes = list(ids_clientes)
+    contagem = {'clientes': 0}
+    ajustar_estatisticas_por_id(conexao, ids_clientes, sinal=-1)
+    for lote in _lotes(ids_clientes):
+        contagem['clientes'] += conexao.execute(update(CLIENTE).where(CLIENTE.c.id.in_(lote), CLIENTE.c.descartado == False).values(descartado=True)).rowcount
+    ajustar_estatisticas_por_id(conexao, ids_clientes)
+    remover_do_indice(conexao, ids_clientes)
+    return contagem
+
+
+def restaurar_clientes(conexao, ids_clientes, novo_proprietario_id):
+    ids_clientes = list(ids_clientes)
+    contagem = {'clientes': 0}
+    ajustar_estatisticas_por_id(conexao, ids_clientes, sinal=-1)
+    for lote in _lotes(ids_clientes):
+        contagem['clientes'] += conexao.execute(update(CLIENTE).where(CLIENTE.c.id.in_(lote), CLIENTE.c.descartado == True)
+                                                .values(descartado=False, proprietario_id=novo_proprietario_id)).rowcount
+    ajustar_estatisticas_por_id(conexao, ids_clientes)
+    indexar_clientes_por_id(conexao, ids_clientes)
+    return contagem
+
+
+def alterar_status_clientes(conexao, ids_clientes, status=None, temperatura=None):
+    # Só as colunas informadas; status e temperatura não fazem parte do índice de busca
+    valores = {coluna: valor for coluna, valor in (('status', status), ('temperatura', temperatura)) if valor is not None}
+    ids_clientes = list(ids_clientes)
+    contagem = {'clientes': 0}
+    if not valores:
+        return contagem
+    ajustar_estatisticas_por_id(conexao, ids_clientes, sinal=-1)
+    for lote in _lotes(ids_clientes):
+        contagem['clientes'] += conexao.execute(update(CLIENTE).where(CLIENTE.c.id.in_(lote)).values(**valores)).rowcount
+    ajustar_estatisticas_por_id(conexao, ids_clientes)
+    return contagem
+
+
+def excluir_clientes(conexao, ids_clientes):
+    # Mesma cascata do ORM (Cliente.agendamentos/atividades com delete-orphan, exceções das séries e interesses),
+    # filhos antes do pai para respeitar as chaves estrangeiras
+    ids_clientes = list(ids_clientes)
+    contagem = {'clientes': 0, 'agendamentos': 0, 'atividades': 0}
+    usuarios_agenda = set()
+    ajustar_estatisticas_por_id(conexao, ids_clientes, sinal=-1)
+    remover_do_indice(conexao, ids_clientes)
+    for lote in _lotes(ids_clientes):
+        agendamentos_do_lote = select(AGENDAMENTO.c.id).where(AGENDAMENTO.c.cliente_id.in_(lote))
+        usuarios_agenda.update(conexao.execute(select(AGENDAMENTO.c.usuario_id).where(AGENDAMENTO.c.cliente_id.in_(lote)).distinct()).scalars())
+        conexao.execute(delete(ExcecaoAgendamento.__table__).where(ExcecaoAgendamento.__table__.c.agendamento_id.in_(agendamentos_do_lote)))
+        contagem['agendamentos'] += conexao.execute(delete(AGENDAMENTO).where(AGENDAMENTO.c.cliente_id.in_(lote))).rowcount
+        contagem['atividades'] += conexao.execute(delete(Atividade.__table__).where(Atividade.__table__.c.cliente_id.in_(lote))).rowcount
+        conexao.execute(delete(interesses_table).where(interesses_table.c.cliente_id.in_(lote)))
+        contagem['clientes'] += conexao.execute(delete(CLIENTE).where(CLIENTE.c.id.in_(lote))).rowcount
+    if usuarios_agenda:
+        incrementar_versoes(conexao, _chaves_agenda(usuarios_agenda))
+    return contagem
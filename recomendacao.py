@@ -0,0 +1,143 @@
+import math
+import re
+import threading
+from collections import Counter
+import numpy as np
+from sqlalchemy import select
+from models import db, Empreendimento, Tipologia
+from busca_clientes import normalizar_texto
+from versoes_dados import obter_versao
+
+# Pré-seleção local de empreendimentos para um cliente: TF-IDF (NumPy) sobre descrição, tipologias e valores do
+# catálogo, comparado por cosseno com o perfil do cliente (observações, profissão, valor buscado) e com os
+# empreendimentos em que ele já demonstrou interesse. O prompt da IA recebe só os K melhores candidatos, então o
+# tamanho não cresce com o catálogo. O índice fica em memória (por processo) e é refeito quando a versão
+# 'catalogo' (versoes_dados.py) muda.
+
+PESO_INTERESSES = 0.5
+PESO_PRECO = 0.3
+TAMANHO_DESCRICAO_PROMPT = 400
+STOPWORDS = frozenset(
+    'a o as os de da do das dos e em no na nos nas um uma uns umas para por com sem que se ao aos como mais muito '
+    'sua seu suas seus ou ja nao sao ser tem ter esta este essa esse isso ate entre sobre apos cada todo toda'.split())
+# "3 suítes", "2 vagas" viram um único termo ("3suites") para casar quantidades entre perfil e tipologia
+QUANTIDADES = re.compile(r'(\d+)\s*(suites?|quartos?|dorms?|dormitorios?|vagas?|banheiros?)\b')
+
+
+def termos(texto):
+    texto = QUANTIDADES.sub(lambda m: f' {m.group(1)}{m.group(2).rstrip("s")} ', normalizar_texto(texto))
+    return [termo for termo in re.findall(r'\w+', texto) if len(termo) > 1 and termo not in STOPWORDS]
+
+
+def extrair_valor(texto):
+    # "R$ 450.000,00", "450 mil", "1,2 milhão", "890k" -> valor em reais; None quando não há número
+    encontrado = re.search(r'(\d[\d.,]*)\s*(milhoes|milhao|mi|mil|k)?\b', normalizar_texto(texto))
+    if not encontrado:
+        return None
+    numero, multiplicador = encontrado.groups()
+    if ',' in numero:
+        numero = numero.replace('.', '').replace(',', '.')
+    elif re.fullmatch(r'\d{1,3}(\.\d{3})+', numero):
+        numero = numero.replace('.', '')
+    try:
+        valor = float(numero.rstrip('.'))
+    except ValueError:
+        return None
+    valor *= {'mil': 1e3, 'k': 1e3, 'mi': 1e6, 'milhao': 1e6, 'milhoes': 1e6}.get(multiplicador, 1)
+    return valor or None
+
+
+def _resumo_tipologias(tipologias):
+    return '; '.join(f"{tipologia.metragem}" + (f", {tipologia.suites} suítes" if tipologia.suites else '') + (f", {tipologia.vagas} vagas" if tipologia.vagas else '')
+                     for tipologia in tipologias)
+
+
+class IndiceRecomendacao:
+    def __init__(self, empreendimentos, tipologias_por_empreendimento):
+        self.ids = [empreendimento.id for empreendimento in empreendimentos]
+        self.posicao = {id_: posicao for posicao, id_ in enumerate(self.ids)}
+        self.resumos = []
+        documentos, precos = [], []
+        for empreendimento in empreendimentos:
+            tipologias = _resumo_tipologias(tipologias_por_empreendimento.get(empreendimento.id, []))
+            valor = empreendimento.valor_a_partir_de or empreendimento.valor_medio_unidades
+            documentos.append(Counter(termos(' '.join(filter(None, (
+                empreendimento.nome, empreendimento.status, empreendimento.endereco, empreendimento.descricao,
+                empreendimento.campanha_promocional, tipologias, valor))))))
+            precos.append(extrair_valor(valor) or math.nan)
+            self.resumos.append({'id': empreendimento.id, 'nome': empreendimento.nome, 'valor': valor, 'tipologias': tipologias,
+                                 'descricao': (empreendimento.descricao or '')[:TAMANHO_DESCRICAO_PROMPT]})
+        self.vocabulario = {termo: indice for indice, termo in enumerate(sorted({termo for documento in documentos for termo in documento}))}
+        frequencia_documentos = np.zeros(len(self.vocabulario), dtype=np.float32)
+        self.matriz = np.zeros((len(documentos), len(self.vocabulario)), dtype=np.float32)
+        for linha, documento in enumerate(documentos):
+            for termo, quantidade in documento.items():
+                self.matriz[linha, self.vocabulario[termo]] = 1 + math.log(quantidade)
+                frequencia_documentos[self.vocabulario[termo]] += 1
+        self.idf = np.log((1 + len(documentos)) / (1 + frequencia_documentos)) + 1
+        self.matriz = self._normalizar(self.matriz * self.idf)
+        self.log_precos = np.log(np.array(precos, dtype=np.float64))
+
+    @staticmethod
+    def _normalizar(vetores):
+        normas = np.linalg.norm(vetores, axis=-1, keepdims=True)
+        return vetores / np.where(normas == 0, 1, normas)
+
+    def vetor_texto(self, texto):
+        vetor = np.zeros(len(self.vocabulario), dtype=np.float32)
+        for termo, quantidade in Counter(termos(texto)).items():
+            if termo in self.vocabulario:
+                vetor[self.vocabulario[termo]] = 1 + math.log(quantidade)
+        return self._normalizar(vetor * self.idf)
+
+    def ranquear(self, cliente, k, excluir_ids=()):
+        # [(pontuação, resumo do empreendimento)] dos k melhores, sem os ids excluídos (interesses já registrados)
+        if not self.ids:
+            return []
+        perfil = ' '.join(filter(None, (cliente.observacoes, cliente.profissao, cliente.valor_imovel_buscado,
+                                        cliente.estado_civil.value if cliente.estado_civil else None)))
+        consulta = self.vetor_texto(perfil)
+        posicoes_interesse = [self.posicao[empreendimento.id] for empreendimento in cliente.empreendimentos_interesse if empreendimento.id in self.posicao]
+        if posicoes_interesse:
+            consulta = self._normalizar(consulta + PESO_INTERESSES * self.matriz[posicoes_interesse].mean(axis=0))
+        pontuacoes = self.matriz @ consulta
+        preco_buscado = extrair_valor(cliente.valor_imovel_buscado)
+        if preco_buscado:
+            # 1 quando o preço bate, 0,5 quando é o dobro ou a metade; empreendimentos sem preço não ganham nem perdem
+            afinidade = np.exp(-np.abs(self.log_precos - math.log(preco_buscado)))
+            pontuacoes = pontuacoes + PESO_PRECO * np.nan_to_num(afinidade, nan=0.0)
+        excluidas = [self.posicao[id_] for id_ in excluir_ids if id_ in self.posicao]
+        pontuacoes[excluidas] = -np.inf
+        k = min(k, len(self.ids) - len(excluidas))
+        if k <= 0:
+            return []
+        melhores = np.argpartition(-pontuacoes, k - 1)[:k]
+        melhores = melhores[np.argsort(-pontuacoes[melhores], kind='stable')]
+        return [(float(pontuacoes[posicao]), self.resumos[posicao]) for posicao in melhores]
+
+
+_trava = threading.Lock()
+_indice_atual = {'versao': None, 'indice': None}
+
+
+def construir_indice():
+    empreendimentos = db.session.execute(select(Empreendimento).order_by(Empreendimento.id)).scalars().all()
+    tipologias_por_empreendimento = {}
+    for tipologia in db.session.execute(select(Tipologia).order_by(Tipologia.id)).scalars():
+        tipologias_por_empreendimento.setdefault(tipologia.empreendimento_id, []).append(tipologia)
+    return IndiceRecomendacao(empreendimentos, tipologias_por_empreendimento)
+
+
+def obter_indice():
+    # Uma consulta (versão do catálogo) por chamada; o índice só é refeito quando o catálogo mudou
+    versao, _ = obter_versao(db.session, 'catalogo')
+    if _indice_atual['versao'] != versao or _indice_atual['indice'] is None:
+        with _trava:
+            if _indice_atual['versao'] != versao or _indice_atual['indice'] is None:
+                _indice_atual['indice'] = construir_indice()
+                _indice_atual['versao'] = versao
+    return _indice_atual['indice']
+
+
+def recomendar_empreendimentos(cliente, k):
+    return obter_indice().ranquear(cliente, k, excluir_ids=[empreendimento.id for empreendimento in cliente.empreendimentos_interesse])
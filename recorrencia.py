@@ -0,0 +1,167 @@
+import calendar
+from datetime import datetime, timedelta
+
+# Subconjunto do RRULE (RFC 5545) usado pela agenda: FREQ=DAILY|WEEKLY|MONTHLY|YEARLY, INTERVAL, BYDAY (semanal),
+# COUNT e UNTIL. As ocorrências não são gravadas: são calculadas só dentro da janela pedida, saltando direto para
+# o primeiro período da janela em vez de percorrer a série desde o início.
+
+FREQUENCIAS = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+DIAS_SEMANA = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+# Duração máxima de um período em dias, usada para estimar por baixo o primeiro período da janela
+DIAS_POR_PERIODO = {'DAILY': 1, 'WEEKLY': 7, 'MONTHLY': 31, 'YEARLY': 366}
+LIMITE_OCORRENCIAS = 5000
+
+
+class RegraRecorrencia:
+    def __init__(self, frequencia, intervalo=1, dias_semana=(), contagem=None, ate=None):
+        if frequencia not in FREQUENCIAS:
+            raise ValueError(f"Frequência inválida: {frequencia}")
+        if intervalo < 1 or (contagem is not None and contagem < 1):
+            raise ValueError("INTERVAL e COUNT devem ser positivos")
+        if contagem is not None and contagem > LIMITE_OCORRENCIAS:
+            raise ValueError(f"COUNT acima do limite de {LIMITE_OCORRENCIAS} ocorrências")
+        self.frequencia = frequencia
+        self.intervalo = intervalo
+        self.dias_semana = tuple(sorted(set(dias_semana))) if frequencia == 'WEEKLY' else ()
+        self.contagem = contagem
+        self.ate = ate
+
+    @classmethod
+    def interpretar(cls, texto):
+        partes = {}
+        for parte in texto.upper().removeprefix('RRULE:').split(';'):
+            if parte:
+                nome, _, valor = parte.partition('=')
+                partes[nome.strip()] = valor.strip()
+        try:
+            dias_semana = [DIAS_SEMANA.index(dia) for dia in partes['BYDAY'].split(',')] if partes.get('BYDAY') else ()
+            ate = datetime.strptime(partes['UNTIL'].rstrip('Z'), '%Y%m%dT%H%M%S' if 'T' in partes['UNTIL'] else '%Y%m%d') if partes.get('UNTIL') else None
+            return cls(partes.get('FREQ'), int(partes.get('INTERVAL', 1)), dias_semana, int(partes['COUNT']) if partes.get('COUNT') else None, ate)
+        except (KeyError, IndexError) as e:
+            raise ValueError(f"Regra de recorrência inválida: {texto}") from e
+
+    def formatar(self):
+        partes = [f"FREQ={self.frequencia}"]
+        if self.intervalo != 1:
+            partes.append(f"INTERVAL={self.intervalo}")
+        if self.dias_semana:
+            partes.append("BYDAY=" + ','.join(DIAS_SEMANA[dia] for dia in self.dias_semana))
+        if self.contagem:
+            partes.append(f"COUNT={self.contagem}")
+        if self.ate:
+            partes.append(f"UNTIL={self.ate.strftime('%Y%m%dT%H%M%S')}")
+        return ';'.join(partes)
+
+    def _dias_da_semana(self, inicio_serie):
+        return self.dias_semana or (inicio_serie.weekday(),)
+
+    def _inicio_do_periodo(self, inicio_serie, k):
+        if self.frequencia == 'DAILY':
+            return inicio_serie + timedelta(days=k * self.intervalo)
+        if self.frequencia == 'WEEKLY':
+            segunda = inicio_serie - timedelta(days=inicio_serie.weekday())
+            return segunda.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(weeks=k * self.intervalo)
+        if self.frequencia == 'MONTHLY':
+            meses = inicio_serie.month - 1 + k * self.intervalo
+            return datetime(inicio_serie.year + meses // 12, meses % 12 + 1, 1)
+        return datetime(inicio_serie.year + k * self.intervalo, 1, 1)
+
+    def _candidatos(self, inicio_serie, k):
+        # Ocorrências do período k em ordem; meses sem o dia (ex.: 31) e 29/02 fora de ano bissexto são pulados (RFC 5545)
+        inicio_periodo = self._inicio_do_periodo(inicio_serie, k)
+        if self.frequencia == 'DAILY':
+            return [inicio_periodo]
+        if self.frequencia == 'WEEKLY':
+            horario = timedelta(hours=inicio_serie.hour, minutes=inicio_serie.minute, seconds=inicio_serie.second)
+            return [inicio_periodo + timedelta(days=dia) + horario for dia in self._dias_da_semana(inicio_serie)]
+        if self.frequencia == 'MONTHLY' and inicio_serie.day > calendar.monthrange(inicio_periodo.year, inicio_periodo.month)[1]:
+            return []
+        if self.frequencia == 'YEARLY' and inicio_serie.month == 2 and inicio_serie.day == 29 and not calendar.isleap(inicio_periodo.year):
+            return []
+        if self.frequencia == 'YEARLY':
+            return [inicio_serie.replace(year=inicio_periodo.year)]
+        return [inicio_serie.replace(year=inicio_periodo.year, month=inicio_periodo.month)]
+
+    def _primeiro_periodo(self, inicio_serie, limite):
+        # Primeiro período a examinar e quantas ocorrências vieram antes dele (para respeitar COUNT)
+        por_periodo = len(self._dias_da_semana(inicio_serie)) if self.frequencia == 'WEEKLY' else 1
+        salto_exato = not (self.contagem and (
+            (self.frequencia == 'MONTHLY' and inicio_serie.day > 28) or (self.frequencia == 'YEARLY' and (inicio_serie.month, inicio_serie.day) == (2, 29))))
+        if not salto_exato or limite <= inicio_serie:
+            return 0, 0
+        k = max((limite - inicio_serie).days // (DIAS_POR_PERIODO[self.frequencia] * self.intervalo) - 1, 0)
+        if k == 0:
+            return 0, 0
+        antes_do_inicio = sum(1 for candidato in self._candidatos(inicio_serie, 0) if candidato < inicio_serie)
+        return k, k * por_periodo - antes_do_inicio
+
+    def _periodos(self, inicio_serie, k):
+        # (início do período, candidatos) a partir do período k. Diário e semanal têm passo fixo e só somam timedelta.
+        if self.frequencia in ('DAILY', 'WEEKLY'):
+            passo = timedelta(days=self.intervalo) if self.frequencia == 'DAILY' else timedelta(weeks=self.intervalo)
+            inicio_periodo = self._inicio_do_periodo(inicio_serie, k)
+            deslocamentos = [candidato - inicio_periodo for candidato in self._candidatos(inicio_serie, k)]
+            while True:
+                yield inicio_periodo, [inicio_periodo + deslocamento for deslocamento in deslocamentos]
+                inicio_periodo += passo
+        while True:
+            yield self._inicio_do_periodo(inicio_serie, k), self._candidatos(inicio_serie, k)
+            k += 1
+
+    def ocorrencias(self, inicio_serie, duracao=timedelta(0), janela_inicio=None, janela_fim=None):
+        # Início de cada ocorrência que se sobrepõe a [janela_inicio, janela_fim)
+        k, indice = self._primeiro_periodo(inicio_serie, janela_inicio - duracao) if janela_inicio else (0, 0)
+        limite_inicio = janela_inicio - duracao if janela_inicio else None
+        ate, contagem = self.ate, self.contagem or float('inf')
+        geradas = 0
+        for inicio_periodo, candidatos in self._periodos(inicio_serie, k):
+            if janela_fim and inicio_periodo >= janela_fim:
+                return
+            for candidato in candidatos:
+                if candidato < inicio_serie:
+                    continue
+                if (ate and candidato > ate) or indice >= contagem:
+                    return
+                indice += 1
+                if janela_fim and candidato >= janela_fim:
+                    return
+                if limite_inicio is None or candidato > limite_inicio or candidato >= janela_inicio:
+                    geradas += 1
+                    if geradas > LIMITE_OCORRENCIAS:
+                        return
+                    yield candidato
+
+    def fim_da_serie(self, inicio_serie, duracao=timedelta(0)):
+        # Fim da última ocorrência (None = série sem fim), gravado em Agendamento.recorrencia_ate para filtrar no banco
+        if self.contagem:
+            ultima = inicio_serie
+            for ultima in self.ocorrencias(inicio_serie):
+                pass
+            return ultima + duracao
+        if self.ate:
+            return self.ate + duracao
+        return None
+
+
+def expandir_series(series, excecoes, janela_inicio, janela_fim):
+    # series: linhas com id, titulo, data_inicio, data_fim e regra_recorrencia; excecoes: linhas de ExcecaoAgendamento.
+    # Devolve dicts de ocorrência (id, titulo, data_inicio, data_fim, ocorrencia = início original da ocorrência).
+    excecoes_por_serie = {}
+    for excecao in excecoes:
+        excecoes_por_serie.setdefault(excecao.agendamento_id, {})[excecao.data_original] = excecao
+    resultado = []
+    for serie in series:
+        duracao = serie.data_fim - serie.data_inicio if serie.data_fim else timedelta(0)
+        alteradas = excecoes_por_serie.get(serie.id, {})
+        for inicio in RegraRecorrencia.interpretar(serie.regra_recorrencia).ocorrencias(serie.data_inicio, duracao, janela_inicio, janela_fim):
+            if inicio not in alteradas:
+                resultado.append({'id': serie.id, 'titulo': serie.titulo, 'data_inicio': inicio, 'data_fim': inicio + duracao if serie.data_fim else None, 'ocorrencia': inicio})
+        for data_original, excecao in alteradas.items():
+            # Ocorrência editada: aparece no novo horário, que pode estar na janela mesmo se o original não estiver
+            if excecao.cancelada:
+                continue
+            data_inicio = excecao.data_inicio or data_original
+            data_fim = excecao.data_fim or (data_inicio + duracao if serie.data_fim else None)
+            if (janela_fim is None or data_inicio < janela_fim) and (janela_inicio is None or (data_fim or data_inicio) >= janela_inicio):
+                resultado.append({'id': serie.id, 'titulo': excecao.titulo or serie.titulo, 'data_inicio': data_inicio, 'data_fim': data_fim, 'ocorrencia': data_original})
+    return resultado
@@ -0,0 +1,87 @@
+from datetime import datetime
+from sqlalchemy import event, update, insert, select, inspect
+from sqlalchemy.orm import Session
+from models import Agendamento, ExcecaoAgendamento, Empreendimento, Tipologia, VersaoDados
+
+# Cada alteração em um modelo registrado incrementa as versões das chaves que ele afeta, no mesmo flush.
+# As rotas montam o ETag a partir dessas versões e respondem 304 sem tocar nas tabelas de dados.
+
+TABELA = VersaoDados.__table__
+CHAVES_POR_MODELO = {}
+_OUVINTES_APOS_COMMIT = []
+
+
+def versionar(modelo):
+    # Registra a função que devolve as chaves afetadas por um objeto alterado do modelo
+    def decorator(f):
+        CHAVES_POR_MODELO[modelo] = f
+        return f
+    return decorator
+
+
+def ao_confirmar_versoes(funcao):
+    # funcao(chaves) roda neste processo logo após o commit que incrementou as chaves (ex.: limpar um cache local)
+    _OUVINTES_APOS_COMMIT.append(funcao)
+    return funcao
+
+
+def valores_atual_e_anterior(objeto, campo):
+    historico = inspect(objeto).attrs[campo].history
+    return {getattr(objeto, campo)} | set(historico.deleted)
+
+
+def incrementar_versoes(conexao, chaves):
+    agora = datetime.utcnow()
+    for chave in sorted(chaves):
+        resultado = conexao.execute(update(TABELA).where(TABELA.c.chave == chave).values(versao=TABELA.c.versao + 1, data_atualizacao=agora))
+        if resultado.rowcount == 0:
+            conexao.execute(insert(TABELA).values(chave=chave, versao=1, data_atualizacao=agora))
+
+
+def obter_versao(sessao, chave):
+    # (versao, data_atualizacao); (0, None) se o conjunto ainda não mudou desde a criação da tabela
+    linha = sessao.execute(select(TABELA.c.versao, TABELA.c.data_atualizacao).where(TABELA.c.chave == chave)).first()
+    return (linha.versao, linha.data_atualizacao) if linha else (0, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _incrementar_versoes_apos_flush(session, contexto_flush):
+    chaves = set()
+    for objeto in list(session.new) + list(session.dirty) + list(session.deleted):
+        funcao_chaves = CHAVES_POR_MODELO.get(type(objeto))
+        if funcao_chaves and (objeto not in session.dirty or session.is_modified(objeto, include_collections=False)):
+            chaves.update(funcao_chaves(objeto))
+    if chaves:
+        incrementar_versoes(session.connection(), chaves)
+        session.info.setdefault('versoes_incrementadas', set()).update(chaves)
+
+
+@event.listens_for(Session, 'after_commit')
+def _avisar_versoes_confirmadas(session):
+    chaves = session.info.pop('versoes_incrementadas', None)
+    if chaves:
+        for funcao in _OUVINTES_APOS_COMMIT:
+            funcao(chaves)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_versoes_revertidas(session):
+    session.info.pop('versoes_incrementadas', None)
+
+
+@versionar(Agendamento)
+def _chaves_agenda(agendamento):
+    # 'agenda' é a visão do Admin (todos os eventos); 'agenda:<id>' a de cada corretor
+    return {'agenda'} | {f'agenda:{usuario_id}' for usuario_id in valores_atual_e_anterior(agendamento, 'usuario_id') if usuario_id}
+
+
+@versionar(ExcecaoAgendamento)
+def _chaves_agenda_excecao(excecao):
+    return _chaves_agenda(excecao.agendamento)
+
+
+@versionar(Empreendimento)
+@versionar(Tipologia)
+def _chaves_catalogo(objeto):
+    # 'catalogo' cobre empreendimentos e tipologias (índice de recomendação em recomendacao.py)
+    return {'catalogo'}